@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# batch.py
+"""
+Batch runner.
+Assembles and runs many .apo programs over a process pool and streams one
+JSON line per program (final registers, instruction count, wall time,
+status / error) as each one finishes.
+"""
+import io
+import os
+import sys
+import glob
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+SLICE = 100000  # instructions between timeout checks
+
+
+def find_programs(target):
+    """every .apo and .elf under a directory, or whatever a glob pattern matches"""
+    if os.path.isdir(target):
+        return sorted(path for pattern in ('*.apo', '*.elf')
+                      for path in glob.glob(os.path.join(target, '**', pattern), recursive=True))
+    return sorted(glob.glob(target, recursive=True))
+
+
+def run_program(path, max_instructions=10000000, timeout=10.0, memory_size=1024,
+                paged=False, vlen=256, obj_cache=None):
+    """
+    assemble (through the object cache in directory obj_cache, if given) or
+    load an ELF and run one program, returns its result record
+    """
+    from fileParser import Parser
+    from cpu import ApocaCore
+    from objcache import ObjectCache
+    from elf import ElfFile, is_elf
+    from hostcall import HostCalls
+
+    result = {'file': path, 'status': 'ok', 'instructions': 0, 'registers': None, 'wall_time': 0.0}
+    start = time.perf_counter()
+    sink = host = None
+    try:
+        core = ApocaCore(memory_size=memory_size, paged=paged, vlen=vlen)
+        # host calls work, program output goes nowhere so the JSON lines stay clean
+        sink = open(os.devnull, 'wb')
+        host = HostCalls(stdin=io.BytesIO(), stdout=sink, stderr=sink).attach(core)
+        if is_elf(path):
+            ElfFile(path).load(core)
+        else:
+            parser = Parser()
+            if obj_cache is not None:
+                parser.obj_cache = ObjectCache(obj_cache)
+            machine, memory = parser.assemble(path)
+            core.load_memory(memory)
+            core.load_program(machine)
+        deadline = start + timeout
+        # run in slices so the wall clock gets looked at now and then
+        while core.pc < core.program_length:
+            if core.instret >= max_instructions:
+                result['status'] = 'budget'
+                break
+            if time.perf_counter() > deadline:
+                result['status'] = 'timeout'
+                break
+            core.run(min(SLICE, max_instructions - core.instret))
+        result['instructions'] = core.instret
+        result['registers'] = list(core.registers)
+        if core.exit_code is not None:
+            result['exit_code'] = core.exit_code
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = f'{type(e).__name__}: {e}'
+    finally:
+        # workers live on for the next program, nothing may stay open
+        if host is not None:
+            host.close()
+        if sink is not None:
+            sink.close()
+    result['wall_time'] = time.perf_counter() - start
+    return result
+
+
+def run_batch(paths, jobs=None, out=sys.stdout, **options):
+    """
+    run every path on jobs worker processes, one JSON line each to out in
+    the order the programs finish, so a slow one holds up nobody else
+    """
+    jobs = jobs or os.cpu_count() or 1
+    counts = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(run_program, path, **options): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # the worker itself went down (killed, or the pool broke)
+                result = {'file': futures[future], 'status': 'error', 'instructions': 0, 'registers': None,
+                          'wall_time': 0.0, 'error': f'{type(e).__name__}: {e}'}
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+    return counts
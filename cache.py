@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# cache.py
+"""
+Cache hierarchy model.
+Set associative caches with LRU / FIFO / random replacement and write-back
+or write-through policies, wired up as L1-I and L1-D over an optional
+unified L2 and main memory. Only tags are modelled (data still lives in the
+core's memory), kept in flat arrays indexed by set * assoc + way.
+"""
+import random
+from array import array
+
+DEFAULT_SPEC = 'l1i=4k:2:32,l1d=4k:4:32:lru:wb,l2=64k:8:64:lru:wb:10,mem=100'
+
+
+def power_of_two(value, what):
+    if value < 1 or value & (value - 1):
+        raise ValueError(f"{what} has to be a power of two, got {value}")
+    return value.bit_length() - 1
+
+
+class MainMemory:
+    """bottom of the hierarchy, every access costs latency cycles"""
+    def __init__(self, latency=100):
+        self.name = 'mem'
+        self.latency = latency
+        self.reads = 0
+        self.writes = 0
+
+    def access(self, address, write=False):
+        if write:
+            self.writes += 1
+        else:
+            self.reads += 1
+        return True
+
+    def amat(self):
+        return self.latency
+
+
+class Cache:
+    """
+    One level. tags holds the line tag of every way (-1 when the way is
+    empty), stamps the last use (LRU) or fill (FIFO) time, dirty one byte
+    per way for write-back.
+    """
+    def __init__(self, name, size, assoc, line, policy='lru', write='wb', hit_time=1, seed=0):
+        if policy not in ('lru', 'fifo', 'random'):
+            raise ValueError(f"{name}: unknown replacement policy {policy!r}")
+        if write not in ('wb', 'wt'):
+            raise ValueError(f"{name}: write policy is 'wb' or 'wt', got {write!r}")
+        self.name = name
+        self.size = size
+        self.assoc = assoc
+        self.line = line
+        self.offset_bits = power_of_two(line, f"{name} line size")
+        power_of_two(assoc, f"{name} associativity")
+        self.sets = size // (assoc * line)
+        self.index_bits = power_of_two(self.sets, f"{name} number of sets")
+        self.set_mask = self.sets - 1
+        self.policy = policy
+        self.lru = policy == 'lru'
+        # write-back allocates on a write miss, write-through writes around
+        self.write_back = write == 'wb'
+        self.hit_time = hit_time
+        self.random = random.Random(seed)
+        self.next = None
+        ways = self.sets * assoc
+        self.tags = array('q', [-1]) * ways
+        self.stamps = array('q', [0]) * ways
+        self.dirty = bytearray(ways)
+        self.clock = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writebacks = 0
+
+    def access(self, address, write=False):
+        """one access to the line holding address, True on a hit"""
+        line = address >> self.offset_bits
+        index = line & self.set_mask
+        tag = line >> self.index_bits
+        base = index * self.assoc
+        tags = self.tags
+        self.clock += 1
+        for way in range(base, base + self.assoc):
+            if tags[way] == tag:
+                self.hits += 1
+                if self.lru:
+                    self.stamps[way] = self.clock
+                if write:
+                    if self.write_back:
+                        self.dirty[way] = 1
+                    else:
+                        self.next.access(address, True)
+                return True
+        self.misses += 1
+        if write and not self.write_back:
+            self.next.access(address, True)
+            return False
+        way = self.victim(base)
+        if tags[way] != -1:
+            self.evictions += 1
+            if self.dirty[way]:
+                self.writebacks += 1
+                victim = ((tags[way] << self.index_bits) | index) << self.offset_bits
+                self.next.access(victim, True)
+        self.next.access(address, False)  # line fill
+        tags[way] = tag
+        self.stamps[way] = self.clock
+        self.dirty[way] = 1 if write else 0
+        return False
+
+    def victim(self, base):
+        tags = self.tags
+        for way in range(base, base + self.assoc):
+            if tags[way] == -1:
+                return way
+        if self.policy == 'random':
+            return base + self.random.randrange(self.assoc)
+        stamps = self.stamps
+        return min(range(base, base + self.assoc), key=stamps.__getitem__)
+
+    def accesses(self):
+        return self.hits + self.misses
+
+    def miss_rate(self):
+        total = self.accesses()
+        return self.misses / total if total else 0.0
+
+    def amat(self):
+        """hit time plus the miss rate times the cost of going one level down"""
+        return self.hit_time + self.miss_rate() * self.next.amat()
+
+    def stats(self):
+        return {
+            'size': self.size, 'assoc': self.assoc, 'line': self.line, 'policy': self.policy,
+            'write': 'wb' if self.write_back else 'wt',
+            'accesses': self.accesses(), 'hits': self.hits, 'misses': self.misses,
+            'evictions': self.evictions, 'writebacks': self.writebacks,
+            'miss_rate': self.miss_rate(), 'amat': self.amat(),
+        }
+
+
+class CachedMemory:
+    """
+    Stands in for core.memory and sends every data access through L1-D
+    before handing it to the real memory.
+    """
+    def __init__(self, memory, caches):
+        self.memory = memory
+        self.caches = caches
+
+    def __getattr__(self, name):
+        return getattr(self.memory, name)
+
+    def __len__(self):
+        return len(self.memory)
+
+    def load(self, address, size):
+        self.caches.data(address, size, False)
+        return self.memory.load(address, size)
+
+    def load_signed(self, address, size):
+        self.caches.data(address, size, False)
+        return self.memory.load_signed(address, size)
+
+    def store(self, address, value, size):
+        self.caches.data(address, size, True)
+        self.memory.store(address, value, size)
+
+    def read_bytes(self, address, length):
+        self.caches.data(address, length, False)
+        return self.memory.read_bytes(address, length)
+
+    def write_bytes(self, address, data):
+        self.caches.data(address, len(data), True)
+        self.memory.write_bytes(address, data)
+
+    def gather(self, addresses, size):
+        for address in addresses.tolist():
+            self.caches.data(address, size, False)
+        return self.memory.gather(addresses, size)
+
+    def scatter(self, addresses, rows):
+        for address in addresses.tolist():
+            self.caches.data(address, rows.shape[1], True)
+        self.memory.scatter(addresses, rows)
+
+
+class CacheHierarchy:
+    """
+    L1-I and L1-D (either can be left out) over an optional unified L2.
+    attach(core) puts L1-D in front of the core's memory and sends every
+    fetch of core.run() through L1-I.
+    """
+    def __init__(self, l1i=None, l1d=None, l2=None, memory_latency=100):
+        self.l1i = l1i
+        self.l1d = l1d
+        self.l2 = l2
+        self.memory = MainMemory(memory_latency)
+        lower = self.memory
+        if l2 is not None:
+            l2.next = self.memory
+            lower = l2
+        for cache in (l1i, l1d):
+            if cache is not None:
+                cache.next = lower
+        self.core = None
+        self.wall_time = 0.0
+
+    @classmethod
+    def from_spec(cls, spec=DEFAULT_SPEC):
+        """
+        'l1i=4k:2:32,l1d=4k:4:32:lru:wb,l2=64k:8:64:lru:wb:10,mem=100', every
+        level is size:assoc:line[:policy[:write[:hit time]]]
+        """
+        levels = {}
+        latency = 100
+        for part in spec.split(','):
+            name, _, value = part.strip().partition('=')
+            name = name.lower()
+            if name == 'mem':
+                latency = int(value)
+                continue
+            if name not in ('l1i', 'l1d', 'l2'):
+                raise ValueError(f"unknown cache level {name!r} in {spec!r}")
+            fields = value.split(':')
+            if len(fields) < 3:
+                raise ValueError(f"{name} needs size:assoc:line, got {value!r}")
+            size = fields[0].lower()
+            scale = {'k': 1 << 10, 'm': 1 << 20}.get(size[-1], 1)
+            size = int(size.rstrip('km')) * scale
+            options = {}
+            if len(fields) > 3:
+                options['policy'] = fields[3]
+            if len(fields) > 4:
+                options['write'] = fields[4]
+            if len(fields) > 5:
+                options['hit_time'] = int(fields[5])
+            elif name == 'l2':
+                options['hit_time'] = 10
+            levels[name] = Cache(name.upper(), size, int(fields[1]), int(fields[2]), **options)
+        return cls(levels.get('l1i'), levels.get('l1d'), levels.get('l2'), latency)
+
+    def attach(self, core):
+        self.core = core
+        core.memory = CachedMemory(core.memory, self)
+        core.caches = self
+        core.observe(self)
+        return self
+
+    def data(self, address, size, write):
+        """every line an access of size bytes at address touches"""
+        l1d = self.l1d
+        if l1d is None:
+            return
+        shift = l1d.offset_bits
+        for line in range(address >> shift, ((address + size - 1) >> shift) + 1):
+            l1d.access(line << shift, write)
+
+    def before(self, pc, op):
+        """every fetch goes through L1-I"""
+        if self.l1i is not None:
+            self.l1i.access(pc << 2)
+
+    def finish(self, count, seconds):
+        self.wall_time += seconds
+
+    def levels(self):
+        return [cache for cache in (self.l1i, self.l1d, self.l2) if cache is not None]
+
+    def report(self):
+        levels = {cache.name: cache.stats() for cache in self.levels()}
+        levels['MEM'] = {'latency': self.memory.latency, 'reads': self.memory.reads, 'writes': self.memory.writes}
+        l1 = [cache for cache in (self.l1i, self.l1d) if cache is not None]
+        total = sum(cache.accesses() for cache in l1)
+        amat = sum(cache.accesses() * cache.amat() for cache in l1) / total if total else 0.0
+        return {'levels': levels, 'amat': amat}
+
+    def table(self):
+        report = self.report()
+        lines = [f"{'level':<5} {'accesses':>10} {'hits':>10} {'misses':>10} {'miss%':>7} {'evict':>8} {'wback':>8} {'AMAT':>7}"]
+        for cache in self.levels():
+            s = cache.stats()
+            lines.append(f"{cache.name:<5} {s['accesses']:>10} {s['hits']:>10} {s['misses']:>10} "
+                         f"{100 * s['miss_rate']:>7.2f} {s['evictions']:>8} {s['writebacks']:>8} {s['amat']:>7.2f}")
+        lines.append(f"memory: {self.memory.reads} line reads, {self.memory.writes} writes, {self.memory.latency} cycles each")
+        lines.append(f"average memory access time: {report['amat']:.2f} cycles")
+        return '\n'.join(lines)
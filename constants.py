@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 """ ALL OF THE ISA CODES WILL BE IN HERE"""
+import numpy as np
 
 opCodes = {
   'LUI'     :0b0110111,
@@ -11,7 +12,9 @@ opCodes = {
   'LOAD'    :0b0000011,
   'STORE'   :0b0100011,
   'ALU_IMM' :0b0010011,
-  'ALU_REG' :0b0110011
+  'ALU_REG' :0b0110011,
+  'AMO'     :0b0001011,  # custom-0, the standard AMO opcode is JAL here
+  'SYSTEM'  :0b1110011,
 }
 opCodes_vector={
   'VECTOR_LOAD'  :0b1010111,
@@ -19,6 +22,14 @@ opCodes_vector={
   'VECTOR_ADD'   :0b1011001,
   'VECTOR_MUL'   :0b1011010,
 }
+# element types of the vector register file for each SEW, little endian
+# like memory so loads and stores are straight byte copies
+VECTOR_DTYPES = {
+  8  :np.dtype('<i1'),
+  16 :np.dtype('<i2'),
+  32 :np.dtype('<i4'),
+  64 :np.dtype('<i8'),
+}
 funct3_codes={
   'ADD_SUB' :0b000,
   'SLL'     :0b001,
@@ -54,7 +65,47 @@ funct6_codes = {
     'VDIV' : 0b100001,
     'VSTR' : 0b000001,
     'VLOAD': 0b000101,
+    'VMINU': 0b000100,
+    'VMIN' : 0b000101,
+    'VMAXU': 0b000110,
+    'VMAX' : 0b000111,
+    'VAND' : 0b001001,
+    'VOR'  : 0b001010,
+    'VXOR' : 0b001011,
+    'VMSEQ': 0b011000,
+    'VMSNE': 0b011001,
+    'VMSLTU': 0b011010,
+    'VMSLT': 0b011011,
+    'VMSLEU': 0b011100,
+    'VMSLE': 0b011101,
+    'VDIVU': 0b100000,
+    'VREMU': 0b100010,
+    'VREM' : 0b100011,
+    'VREDSUM' : 0b000000,
+    'VREDMINU': 0b000100,
+    'VREDMIN' : 0b000101,
+    'VREDMAXU': 0b000110,
+    'VREDMAX' : 0b000111,
     }
+# vector operand forms, same funct3 values as RVV
+vector_funct3 = {
+  'OPIVV' :0b000,  # vector-vector
+  'OPMVV' :0b010,
+  'OPIVI' :0b011,  # vector-immediate (5 bit signed)
+  'OPIVX' :0b100,  # vector-scalar
+  'OPMVX' :0b110,
+  'OPCFG' :0b111,  # vsetvli / vsetivli / vsetvl
+}
+# vector load/store addressing modes, in funct3 of the LV/SV opcodes
+vector_mop = {
+  'UNIT'    :0b000,  # LV / SV, base + imm
+  'STRIDED' :0b010,  # VLSE / VSSE, base + i * rs2
+  'INDEXED' :0b011,  # VLUXEI / VSUXEI, base + vs2[i]
+}
+MAX_VLEN = 4096
+# vtype vsew / vlmul fields as in RVV, fractional LMUL is 101 / 110 / 111
+vsew_codes = {8: 0b000, 16: 0b001, 32: 0b010, 64: 0b011}
+vlmul_codes = {1: 0b000, 2: 0b001, 4: 0b010, 8: 0b011, 0.125: 0b101, 0.25: 0b110, 0.5: 0b111}
 
 instruction_map = {
     # R-type instructions (ALU operations with registers)
@@ -125,4 +176,72 @@ instruction_map = {
     'SV' : {'opcode': opCodes_vector['VECTOR_STORE'],'funct3':funct3_codes['ADD_SUB'] ,'funct6':funct6_codes['VSTR']},
     'LV' : {'opcode': opCodes_vector['VECTOR_LOAD'], 'funct3':funct3_codes['ADD_SUB'] ,'funct6':funct6_codes['VLOAD']},
     'VADD' : {'opcode': opCodes_vector['VECTOR_ADD'], 'funct3':funct3_codes['ADD_SUB'] ,'funct6':funct6_codes['VADD']},
+    'VLSE'   : {'opcode': opCodes_vector['VECTOR_LOAD'], 'funct3': 0b010},
+    'VSSE'   : {'opcode': opCodes_vector['VECTOR_STORE'], 'funct3': 0b010},
+    'VLUXEI' : {'opcode': opCodes_vector['VECTOR_LOAD'], 'funct3': 0b011},
+    'VSUXEI' : {'opcode': opCodes_vector['VECTOR_STORE'], 'funct3': 0b011},
+}
+
+# vector ALU: integer ops sit on VECTOR_ADD, multiply/divide and reductions on
+# VECTOR_MUL. The bare mnemonic is the .vv form, VADD.VX / VADD.VI the others
+vector_alu = {
+    'VADD'  : ('VECTOR_ADD', ('VV', 'VX', 'VI')),
+    'VSUB'  : ('VECTOR_ADD', ('VV', 'VX')),
+    'VMINU' : ('VECTOR_ADD', ('VV', 'VX')),
+    'VMIN'  : ('VECTOR_ADD', ('VV', 'VX')),
+    'VMAXU' : ('VECTOR_ADD', ('VV', 'VX')),
+    'VMAX'  : ('VECTOR_ADD', ('VV', 'VX')),
+    'VAND'  : ('VECTOR_ADD', ('VV', 'VX', 'VI')),
+    'VOR'   : ('VECTOR_ADD', ('VV', 'VX', 'VI')),
+    'VXOR'  : ('VECTOR_ADD', ('VV', 'VX', 'VI')),
+    'VMSEQ' : ('VECTOR_ADD', ('VV', 'VX', 'VI')),
+    'VMSNE' : ('VECTOR_ADD', ('VV', 'VX', 'VI')),
+    'VMSLTU': ('VECTOR_ADD', ('VV', 'VX')),
+    'VMSLT' : ('VECTOR_ADD', ('VV', 'VX')),
+    'VMSLEU': ('VECTOR_ADD', ('VV', 'VX', 'VI')),
+    'VMSLE' : ('VECTOR_ADD', ('VV', 'VX', 'VI')),
+    'VMUL'  : ('VECTOR_MUL', ('VV', 'VX')),
+    'VDIVU' : ('VECTOR_MUL', ('VV', 'VX')),
+    'VDIV'  : ('VECTOR_MUL', ('VV', 'VX')),
+    'VREMU' : ('VECTOR_MUL', ('VV', 'VX')),
+    'VREM'  : ('VECTOR_MUL', ('VV', 'VX')),
+    'VREDSUM' : ('VECTOR_MUL', ('VS',)),
+    'VREDMINU': ('VECTOR_MUL', ('VS',)),
+    'VREDMIN' : ('VECTOR_MUL', ('VS',)),
+    'VREDMAXU': ('VECTOR_MUL', ('VS',)),
+    'VREDMAX' : ('VECTOR_MUL', ('VS',)),
+}
+instruction_map['VSETVLI'] = {'opcode': opCodes_vector['VECTOR_ADD'], 'funct3': vector_funct3['OPCFG']}
+instruction_map['VSETIVLI'] = {'opcode': opCodes_vector['VECTOR_ADD'], 'funct3': vector_funct3['OPCFG']}
+instruction_map['VSETVL'] = {'opcode': opCodes_vector['VECTOR_ADD'], 'funct3': vector_funct3['OPCFG']}
+for name, (opcode, forms) in vector_alu.items():
+    group = 'OPI' if opcode == 'VECTOR_ADD' else 'OPM'
+    for form in forms:
+        funct3 = vector_funct3[group + ('VV' if form == 'VS' else form)]
+        mnemonic = name if form in ('VV', 'VS') else f'{name}.{form}'
+        instruction_map[mnemonic] = {'opcode': opCodes_vector[opcode], 'funct3': funct3, 'funct6': funct6_codes[name]}
+
+# A extension (word sized only): funct5 in bits [31:27], aq/rl left 0
+amo_funct5 = {
+    'LR.W'     : 0b00010,
+    'SC.W'     : 0b00011,
+    'AMOSWAP.W': 0b00001,
+    'AMOADD.W' : 0b00000,
+    'AMOXOR.W' : 0b00100,
+    'AMOAND.W' : 0b01100,
+    'AMOOR.W'  : 0b01000,
+    'AMOMIN.W' : 0b10000,
+    'AMOMAX.W' : 0b10100,
+    'AMOMINU.W': 0b11000,
+    'AMOMAXU.W': 0b11100,
+}
+for name, funct5 in amo_funct5.items():
+    instruction_map[name] = {'opcode': opCodes['AMO'], 'funct3': funct3_codes['WORD'], 'funct5': funct5}
+
+# SYSTEM, told apart by imm[11:0] (funct12)
+system_funct12 = {
+    'ECALL' : 0,
+    'EBREAK': 1,
 }
+for name, funct12 in system_funct12.items():
+    instruction_map[name] = {'opcode': opCodes['SYSTEM'], 'funct3': 0, 'funct12': funct12}
@@ -1,15 +1,153 @@
+import sys
 from fileParser import *
 from cpu import *
+from batch import find_programs, run_batch
+from profiler import Profiler
+from tracing import Tracer, TraceWriter
+from cache import CacheHierarchy
+from timing import Retirement
+from pipeline import Pipeline
+from predictor import BranchUnit, BTB, make_predictor
+from ooo import OutOfOrder, parse_units
+from ilp import ILPAnalyzer
+from objcache import ObjectCache
+from elf import ElfFile, is_elf
+from harts import System, HARTID_REGISTER
+from ensemble import Ensemble
+from devices import standard_bus
+from hostcall import HostCalls
+from snapshot import Checkpointer, load_chain
+from sampling import Sampler
 
 if __name__ == '__main__':
     parser = Parser()
     filename = parser.arguments()
-    machine, memory = parser.assemble(filename)
+    if parser.batch is not None:
+        paths = find_programs(parser.batch)
+        counts = run_batch(paths, jobs=parser.jobs, max_instructions=parser.max_instructions,
+                           timeout=parser.timeout, memory_size=parser.memory_size,
+                           paged=parser.paged, vlen=parser.vlen, obj_cache=parser.obj_cache_dir)
+        print(f"{len(paths)} programs: " + ", ".join(f"{n} {status}" for status, n in sorted(counts.items())),
+              file=sys.stderr)
+        sys.exit(1 if counts.get('error') else 0)
+    elf = ElfFile(filename) if is_elf(filename) else None
+    if elf is None:
+        if parser.obj_cache_dir is not None:
+            parser.obj_cache = ObjectCache(parser.obj_cache_dir)
+        machine, memory = parser.assemble(filename)
     
-    if parser.run == 'Run':
-        emulator = ApocaCore(debug=(parser.debug == 'debug'))  # Pass debug flag
-        emulator.load_memory(memory)
-        emulator.load_program(machine)
-        emulator.run()
+    if parser.run == 'Run' and parser.harts > 1:
+        with System(parser.harts, parser.quantum, memory_size=parser.memory_size, paged=parser.paged,
+                    vlen=parser.vlen, engine=parser.engine, processes=parser.hart_processes) as system:
+            if elf is not None:
+                system.load_elf(elf)
+            else:
+                system.load_program(machine, memory)
+            host = None
+            if not parser.hart_processes:
+                host = HostCalls()
+                for hart in system.harts:
+                    hart.host = host
+            system.run()
+            if host is not None:
+                host.close()
+        for hart in system.harts:
+            print(f"hart {hart.hartid}: {hart.instret} instructions")
+            hart.examine_all_registers()
+            hart.dump_vector_registers()
+    elif parser.run == 'Run' and parser.ensemble:
+        host = HostCalls()
+        ensemble = Ensemble(parser.ensemble, memory_size=parser.memory_size, vlen=parser.vlen, host=host)
+        if elf is not None:
+            ensemble.load_elf(elf)
+        else:
+            ensemble.load_program(machine)
+            ensemble.load_memory(memory)
+        ensemble.set_register(HARTID_REGISTER, ensemble.lanes)
+        ensemble.run()
+        host.close()
+        for i, result in enumerate(ensemble.results()):
+            exited = '' if result['exit_code'] is None else f", exited with {result['exit_code']}"
+            print(f"instance {i}: {result['retired']} instructions{exited}")
+            registers = result['registers']
+            for base in range(0, 16, 8):
+                print(" ".join(f"x{j:02}={registers[j]:>3}" for j in range(base, base + 8)))
+    elif parser.run == 'Run':
+        snapshot = load_chain(parser.restore) if parser.restore else None
+        memory_size, paged = (snapshot.memory_size, snapshot.paged) if snapshot else (parser.memory_size, parser.paged)
+        emulator = ApocaCore(memory_size=memory_size, debug=(parser.debug == 'debug'),
+                              engine=parser.engine, paged=paged, vlen=parser.vlen)  # Pass debug flag
+        if elf is not None:
+            elf.load(emulator)
+        else:
+            emulator.load_memory(memory)
+            emulator.load_program(machine)
+        if snapshot is not None:
+            emulator.restore(snapshot)
+        if parser.profile:
+            symbols = elf.symbols if elf is not None else parser.symbols
+            Profiler(emulator, parser.source, symbols).attach()
+        if parser.trace:
+            Tracer(emulator, TraceWriter(parser.trace, compress=parser.trace_compress)).attach()
+        if parser.cache:
+            CacheHierarchy.from_spec(parser.cache).attach(emulator)
+        models = []
+        # every timing model gets a predictor of its own
+        branch_unit = lambda: BranchUnit(make_predictor(parser.predictor, parser.predictor_bits, parser.history),
+                                         BTB(parser.btb)) if parser.predictor else None
+        if parser.pipeline:
+            models.append(Pipeline(forwarding=parser.forwarding, branch_stage=parser.branch_stage,
+                                   branches=branch_unit()))
+        if parser.ooo:
+            models.append(OutOfOrder(width=parser.width, rob_size=parser.rob, rs_size=parser.rs,
+                                     units=parse_units(parser.units) if parser.units else None,
+                                     branches=branch_unit()))
+        if parser.ilp:
+            models.append(ILPAnalyzer(parser.windows))
+        if parser.predictor and not models:
+            models.append(branch_unit())
+        if models:
+            Retirement(*models).attach(emulator)
+        host = HostCalls().attach(emulator)
+        if parser.devices:
+            bus = standard_bus(parser.uart_out, parser.uart_in, parser.dma_file).attach(emulator)
+            bus.run(slice=parser.device_slice)
+            bus.close()
+        elif parser.sample:
+            sampler = Sampler(emulator, *parser.sample, confidence=parser.confidence)
+            if parser.simpoints:
+                sampler.simpoints(parser.simpoints)
+            else:
+                sampler.run()
+        elif parser.checkpoint_every:
+            checkpoints = Checkpointer(emulator, compress=parser.checkpoint_compress)
+            while emulator.pc < emulator.program_length:
+                emulator.run(parser.checkpoint_every)
+                checkpoints.write(f"{parser.checkpoint_prefix}.{checkpoints.sequence:04d}.snap")
+        else:
+            emulator.run()
+        host.close()
+        if emulator.breakpoint is not None:
+            print(f"stopped at EBREAK at {emulator.breakpoint}")
+        elif emulator.exit_code is not None:
+            print(f"exited with {emulator.exit_code}")
+        if parser.trace:
+            emulator.tracer.writer.close()
         emulator.examine_all_registers()
-        emulator.dump_vector_registers()
\ No newline at end of file
+        emulator.dump_vector_registers()
+        if parser.profile:
+            print()
+            print(emulator.profiler.table(parser.top))
+            if parser.profile_out:
+                emulator.profiler.write_json(parser.profile_out)
+        if parser.cache:
+            print()
+            print(emulator.caches.table())
+        if models:
+            print()
+            print(emulator.timing.table())
+        if parser.sample:
+            print()
+            print(sampler.table())
+        if emulator.exit_code:
+            sys.exit(emulator.exit_code & 0xFF)
@@ -1,27 +1,79 @@
 #!/usr/bin/env python
 from constants import *
+import time
 import typing
+import numpy as np
 from exec import InstructionHandlers
+from translator import BlockTranslator
+from memory import Memory, PagedMemory
+from snapshot import Snapshot
+from functools import partial
+from contextlib import nullcontext
 class ApocaCore:
-  def __init__(self,memory_size=1024,debug=False):
+  def __init__(self,memory_size=1024,debug=False,engine='interp',paged=False,vlen=256,memory=None):
     self.registers = [0]*16
     self.f_registers =[0.0]*16 
     self.pc=0
-    self.memory=[0]*memory_size
+    # byte addressed, pc indexes 32 bit words. paged maps 4 KiB pages on first
+    # touch so memory_size can be the whole 32 bit space. Harts (harts.py)
+    # pass one memory in to share it
+    if memory is None:
+      memory = PagedMemory(memory_size) if paged else Memory(memory_size)
+    self.memory=memory
     self.debug = debug
     self.build_map()
-    self.VLEN = 256
-    self.MAX_SEW=8
-    self.LMUL=1
-    self.vl=8
-    self.vtype = {'SEW':32,'LMUL':1}
-    self.vreg= [[0]*(self.VLEN//self.vtype['SEW']) for _ in range(16)]
+    if vlen & (vlen - 1) or not 64 <= vlen <= MAX_VLEN:
+      raise ValueError(f"VLEN has to be a power of two between 64 and {MAX_VLEN}, got {vlen}")
+    self.VLEN = vlen
+    self.MAX_SEW=64
+    self.vl=8  # until a vsetvli says otherwise
+    # all 16 vector registers back to back in one buffer, plus room for a
+    # group of 8 starting at v15 so every group view stays inside it
+    self.vrf = np.zeros((16 + 7) * self.VLEN // 8, dtype=np.uint8)
+    self.set_vtype(32, 1)
     self.next_address=0
     self.jump_adress= {}
+    self.program_length=0
+    self.code_end=0  # byte address just past the program
+    self.instret=0  # instructions retired, on every engine
+    self.observers=[]  # see observe(), run() steps through them when there are any
+    self.profiler=None  # the attached profiler.Profiler, if any
+    self.tracer=None  # tracing.Tracer
+    self.caches=None  # cache.CacheHierarchy
+    self.timing=None  # timing.Retirement driving timing models
+    self.reservation=None  # (address, value) of the last LR.W
+    self.atomic=nullcontext()  # held around AMOs, a shared lock when harts run in parallel
+    self.host=None  # a hostcall.HostCalls answering ECALL
+    self.exit_code=None  # set by the exit host call
+    self.breakpoint=None  # byte address of the EBREAK that stopped the run
+    self.image_end=0  # byte address past the loaded program and data, the first brk
+    self.icache = {}  # pc -> predecoded handler with its operands bound
+    # 'interp' steps one instruction at a time, 'block' compiles basic blocks
+    self.translator = BlockTranslator(self) if engine == 'block' else None
 
 
+  def set_vtype(self, sew, lmul):
+    """
+    switch SEW/LMUL. vreg[r] becomes a view of the register group that
+    starts at vr: VLMAX elements running on through the next LMUL-1
+    registers (or a fraction of vr). Rows are strided views over vrf so
+    grouped ops never copy.
+    """
+    if sew not in VECTOR_DTYPES or sew > self.MAX_SEW:
+      raise Exception(f"Unsupported SEW {sew}")
+    vlmax = int(self.VLEN * lmul) // sew
+    if vlmax < 1:
+      raise Exception(f"Illegal vtype: SEW={sew} LMUL={lmul} with VLEN={self.VLEN}")
+    self.vtype = {'SEW':sew,'LMUL':lmul}
+    self.LMUL = lmul
+    self.VLMAX = vlmax
+    flat = self.vrf.view(VECTOR_DTYPES[sew])
+    self.vreg = np.lib.stride_tricks.as_strided(
+        flat, shape=(16, vlmax), strides=(self.VLEN // 8, flat.itemsize))
+
   def build_map(self):
     handlers=InstructionHandlers()
+    self.handlers = handlers
     self.dispatch = {
             # Special case for NOP
             (0, 0, 0): handlers.exec_nop,
@@ -38,6 +90,33 @@ class ApocaCore:
             (opCodes['ALU_REG'], funct3_codes['SRL_SRA'], funct7_codes['SRA']): handlers.exec_sra,
             (opCodes['ALU_REG'], funct3_codes['OR'], funct7_codes['STANDARD']): handlers.exec_or,
             (opCodes['ALU_REG'], funct3_codes['AND'], funct7_codes['STANDARD']): handlers.exec_and,
+
+            # M extension
+            (opCodes['ALU_REG'], funct3_codes['ADD_SUB'], funct7_codes['MUL']): handlers.exec_mul,
+            (opCodes['ALU_REG'], funct3_codes['SLL'], funct7_codes['MUL']): handlers.exec_mulh,
+            (opCodes['ALU_REG'], funct3_codes['SLT'], funct7_codes['MUL']): handlers.exec_mulhsu,
+            (opCodes['ALU_REG'], funct3_codes['SLTU'], funct7_codes['MUL']): handlers.exec_mulhu,
+            (opCodes['ALU_REG'], funct3_codes['XOR'], funct7_codes['MUL']): handlers.exec_div,
+            (opCodes['ALU_REG'], funct3_codes['SRL_SRA'], funct7_codes['MUL']): handlers.exec_divu,
+            (opCodes['ALU_REG'], funct3_codes['OR'], funct7_codes['MUL']): handlers.exec_rem,
+            (opCodes['ALU_REG'], funct3_codes['AND'], funct7_codes['MUL']): handlers.exec_remu,
+            
+            # A extension, keyed by funct5
+            (opCodes['AMO'], funct3_codes['WORD'], amo_funct5['LR.W']): handlers.exec_lr,
+            (opCodes['AMO'], funct3_codes['WORD'], amo_funct5['SC.W']): handlers.exec_sc,
+            (opCodes['AMO'], funct3_codes['WORD'], amo_funct5['AMOSWAP.W']): handlers.exec_amoswap,
+            (opCodes['AMO'], funct3_codes['WORD'], amo_funct5['AMOADD.W']): handlers.exec_amoadd,
+            (opCodes['AMO'], funct3_codes['WORD'], amo_funct5['AMOXOR.W']): handlers.exec_amoxor,
+            (opCodes['AMO'], funct3_codes['WORD'], amo_funct5['AMOAND.W']): handlers.exec_amoand,
+            (opCodes['AMO'], funct3_codes['WORD'], amo_funct5['AMOOR.W']): handlers.exec_amoor,
+            (opCodes['AMO'], funct3_codes['WORD'], amo_funct5['AMOMIN.W']): handlers.exec_amomin,
+            (opCodes['AMO'], funct3_codes['WORD'], amo_funct5['AMOMAX.W']): handlers.exec_amomax,
+            (opCodes['AMO'], funct3_codes['WORD'], amo_funct5['AMOMINU.W']): handlers.exec_amominu,
+            (opCodes['AMO'], funct3_codes['WORD'], amo_funct5['AMOMAXU.W']): handlers.exec_amomaxu,
+            
+            # SYSTEM
+            (opCodes['SYSTEM'], 0, system_funct12['ECALL']): handlers.exec_ecall,
+            (opCodes['SYSTEM'], 0, system_funct12['EBREAK']): handlers.exec_ebreak,
             
             # I-type instructions
             # ALU operations with immediates
@@ -50,8 +129,8 @@ class ApocaCore:
             
             # Shifts with immediates (these might have funct7 values in some implementations)
             (opCodes['ALU_IMM'], funct3_codes['SLL'], None): handlers.exec_slli,
-            (opCodes['ALU_IMM'], funct3_codes['SRL_SRA'], 0b0000000): handlers.exec_srli,
-            (opCodes['ALU_IMM'], funct3_codes['SRL_SRA'], 0b0100000): handlers.exec_srai,
+            (opCodes['ALU_IMM'], funct3_codes['SRL_SRA'], funct7_codes['STANDARD']): handlers.exec_srli,
+            (opCodes['ALU_IMM'], funct3_codes['SRL_SRA'], funct7_codes['SRA']): handlers.exec_srai,
             
             # Load instructions
             (opCodes['LOAD'], funct3_codes['BYTE'], None): handlers.exec_lb,
@@ -67,6 +146,7 @@ class ApocaCore:
             
             # Branch instructions
             (opCodes['BRANCH'], funct3_codes['BEQ'], None): handlers.exec_beq,
+            (opCodes['BRANCH'], funct3_codes['BEQI'], None): handlers.exec_beqi,
             (opCodes['BRANCH'], funct3_codes['BNE'], None): handlers.exec_bne,
             (opCodes['BRANCH'], funct3_codes['BLT'], None): handlers.exec_blt,
             (opCodes['BRANCH'], funct3_codes['BGE'], None): handlers.exec_bge,
@@ -83,27 +163,144 @@ class ApocaCore:
 
             (opCodes_vector['VECTOR_LOAD'], 0, 0): handlers.exec_vl,
             (opCodes_vector['VECTOR_STORE'], 0, 0): handlers.exec_vs,
+            (opCodes_vector['VECTOR_LOAD'], vector_mop['STRIDED'], 0): handlers.exec_vlse,
+            (opCodes_vector['VECTOR_STORE'], vector_mop['STRIDED'], 0): handlers.exec_vsse,
+            (opCodes_vector['VECTOR_LOAD'], vector_mop['INDEXED'], 0): handlers.exec_vluxei,
+            (opCodes_vector['VECTOR_STORE'], vector_mop['INDEXED'], 0): handlers.exec_vsuxei,
             (opCodes_vector['VECTOR_ADD'], funct3_codes['ADD_SUB'], funct6_codes['VADD']): handlers.exec_vadd,
         }
-  def run(self):
-    for i in range(1024):  # Safety limit
-      while self.pc < self.program_length:
+    # the rest of the vector ALU, every form of an op shares its handler
+    for mnemonic, info in instruction_map.items():
+        if info['opcode'] in (opCodes_vector['VECTOR_ADD'], opCodes_vector['VECTOR_MUL']):
+            handler = getattr(handlers, 'exec_' + mnemonic.split('.')[0].lower())
+            self.dispatch[(info['opcode'], info['funct3'], info.get('funct6', mnemonic))] = handler
+  def run(self, max_instructions=None):
+    """
+    run until the pc leaves the program or max_instructions have retired.
+    With blocks a budgeted run goes block by block while the next block
+    fits in what is left and steps the rest through the interpreter.
+    """
+    if self.observers:
+      return self.run_observed(max_instructions)
+    limit = -1 if max_instructions is None else max_instructions
+    count = 0
+    if self.debug==True:
+      # slow path, decodes every step so execute can print it
+      while self.pc < self.program_length and count != limit:
             ins = self.fetch()
             decoded = self.decode(ins)
             self.execute(*decoded)
+            count += 1
+      self.instret += count
+      return
+    if self.translator is not None:
+      count = self.translator.run(max_instructions)
+      if limit == -1:
+        return
+      limit -= count
+      count = 0
+    icache = self.icache
+    while self.pc < self.program_length and count != limit:
+      pc = self.pc
+      self.pc = pc + 1
+      try:
+        op = icache[pc]
+      except KeyError:
+        op = self.predecode(pc)
+      op()
+      count += 1
+    self.instret += count
+  def run_observed(self, max_instructions=None):
+    """
+    the icache loop with the observers' before(pc, op) and after(pc, op)
+    around every instruction, then finish(count, seconds) once
+    """
+    observers = self.observers
+    befores = [o.before for o in observers if hasattr(o, 'before')]
+    afters = [o.after for o in observers if hasattr(o, 'after')]
+    limit = -1 if max_instructions is None else max_instructions
+    count = 0
+    icache = self.icache
+    start = time.perf_counter()
+    while self.pc < self.program_length and count != limit:
+      pc = self.pc
+      self.pc = pc + 1
+      try:
+        op = icache[pc]
+      except KeyError:
+        op = self.predecode(pc)
+      for before in befores:
+        before(pc, op)
+      op()
+      for after in afters:
+        after(pc, op)
+      count += 1
+    self.instret += count
+    elapsed = time.perf_counter() - start
+    for observer in observers:
+      if hasattr(observer, 'finish'):
+        observer.finish(count, elapsed)
+  def observe(self, observer):
+    """
+    add an observer to run(). It can have any of before(pc, op) and
+    after(pc, op) around each instruction (op the bound handler, self.pc is
+    the next pc in after), decoded(pc, op) whenever the word at pc is
+    decoded afresh and finish(count, seconds) at the end of a run
+    """
+    if observer not in self.observers:
+      self.observers.append(observer)
+    return observer
+  def unobserve(self, observer):
+    if observer in self.observers:
+      self.observers.remove(observer)
+  def predecode(self, pc):
+    """decode the word at pc once and cache it as a ready to call handler"""
+    handler, operands = self.resolve(self.decode(self.memory.words[pc]))
+    op = partial(handler, self, *operands)
+    self.icache[pc] = op
+    for observer in self.observers:
+      if hasattr(observer, 'decoded'):
+        observer.decoded(pc, op)
+    return op
+  def invalidate_code(self, address, size=1):
+    """drop predecoded entries overwritten by a store into the program"""
+    first = address >> 2
+    end = min((address + size + 3) >> 2, self.program_length)
+    for slot in range(first, end):
+      self.icache.pop(slot, None)
+    if self.translator is not None:
+      self.translator.invalidate(first, end)
   def load_memory(self, memory_vectors):
     base_address = 512
     for i, vector in enumerate(memory_vectors):  # each vector is a list of values
         for j, val in enumerate(vector):
             address = base_address + (i * len(vector) + j) * 4  # each value is 8 bytes
             self.write_memory(address, int(val, 0) if isinstance(val, str) else val, 8)
+            self.image_end = max(self.image_end, address + 8)
 
   def load_program(self,program):
-    self.memory[:len(program)] = program
-    self.program_length = len(program)
+    self.memory.load_words(0, program)
+    self.set_code_end(len(program) * 4)
+  def set_code_end(self, end):
+    """the program is everything below byte address end, drops whatever was predecoded"""
+    self.program_length = end >> 2
+    self.code_end = end
+    self.image_end = max(self.image_end, end)
+    self.icache.clear()
+    if self.translator is not None:
+      self.translator = BlockTranslator(self)
 
+  def snapshot(self):
+    """everything needed to carry on from here later, see snapshot.py"""
+    return Snapshot(self)
+  def restore(self, snapshot):
+    """go back to a snapshot of this core (or one with the same kind and size of memory)"""
+    snapshot.restore(self)
+  def halt(self):
+    """stop the run as if the pc had left the program"""
+    self.pc = self.program_length
   def fetch(self):
-    instruction = self.memory[self.pc]
+    instruction = self.memory.words[self.pc]
     self.pc+=1
     return instruction
   def decode(self, instruction):
@@ -122,12 +319,23 @@ class ApocaCore:
         rs1 = (instruction >> 15) & 0x1F  # vs1 / base register
         funct3 = (instruction >> 12) & 0x7
         rd = (instruction >> 7) & 0x1F    # vd
+        if funct3 == vector_funct3['OPCFG'] and opcode == opCodes_vector['VECTOR_ADD']:
+            # vsetvli: 0 zimm[10:0] rs1, vsetivli: 11 zimm[9:0] uimm[4:0], vsetvl: 1000000 rs2 rs1
+            form = instruction >> 30
+            if form == 0b11:
+                return ('vector_cfg', opcode, rd, funct3, 'VSETIVLI', rs1, (instruction >> 20) & 0x3FF)
+            if form == 0b10:
+                return ('vector_cfg', opcode, rd, funct3, 'VSETVL', rs1, rs2)
+            return ('vector_cfg', opcode, rd, funct3, 'VSETVLI', rs1, (instruction >> 20) & 0x7FF)
+        if (opcode == opCodes_vector['VECTOR_LOAD'] or opcode == opCodes_vector['VECTOR_STORE']) and funct3 != vector_mop['UNIT']:
+            # strided / indexed: rs2 is the stride register or the index vector, no immediate
+            return ('vector_mem', opcode, rd, funct3, rs1, rs2, 0, vm)
         if opcode == opCodes_vector['VECTOR_LOAD'] or opcode == opCodes_vector['VECTOR_STORE']:
             # Extract immediate from bits [31:20] like scalar loads
             imm = (instruction >> 20) & 0xFFF
             # Sign extend from 12 bits
             if imm & 0x800:
-                imm |= 0xFFFFF000
+                imm -= 0x1000
             
             funct6 = 0  # Not used for load/store
             vm = 1      # Default mask
@@ -143,13 +351,13 @@ class ApocaCore:
         return ('vector_arith', opcode, rd, funct6, funct3, rs1, rs2, vm)
 
     if opcode == opCodes['ALU_IMM'] or opcode == opCodes['LOAD'] or opcode == opCodes['JALR']:
-        imm = (instruction >> 20) if (instruction >> 31) == 0 else (instruction >> 20) | 0xFFFFF000
+        imm = (instruction >> 20) if (instruction >> 31) == 0 else (instruction >> 20) - 0x1000
     elif opcode == opCodes['STORE']:
         imm_11_5 = (instruction >> 25) & 0x7F
         imm_4_0 = (instruction >> 7) & 0x1F
         imm = (imm_11_5 << 5) | imm_4_0
         if (imm_11_5 >> 6) & 1:  # Sign extend
-            imm |= 0xFFFFF000
+            imm -= 0x1000
     elif opcode == opCodes['BRANCH']:
         imm = (instruction >> 20) & 0xFFF  # Get 12 bits
         
@@ -158,55 +366,80 @@ class ApocaCore:
         
         # Sign extend from bit 12
         if imm & 0x1000:  # Check if bit 12 is set (sign bit)
-            imm |= 0xFFFFE000  # Sign extend to 32 bits
+            imm -= 0x2000  # Sign extend, negative so backward branches work
         opcode = instruction & 0x7F  # Bits [6:0] - unchanged
         funct3 = (instruction >> 7) & 0x7  # Bits [9:7] - unchanged
         rs1 = (instruction >> 10) & 0x1F  # Bits [14:10] - CHANGED (was 15)
         rs2 = (instruction >> 15) & 0x1F  # Bits [19:15] - CHANGED (was 20)
         return ('branch',opcode,imm,rs1,rs2,funct3)
+    elif opcode == opCodes['LUI'] or opcode == opCodes['AUIPC']:
+        # imm[31:12], sign extended from bit 19
+        imm = instruction >> 12
+        if imm & 0x80000:
+            imm -= 0x100000
+        return ('scalar', opcode, rd, None, 0, 0, None, imm)
+    elif opcode == opCodes['JAL']:
+        # imm[31:12] holds the byte offset >> 1, like the branches
+        imm = ((instruction >> 12) & 0xFFFFF) << 1
+        if imm & 0x100000:
+            imm -= 0x200000
+        return ('scalar', opcode, rd, None, 0, 0, None, imm)
     else:
-        # Default case (includes LUI, AUIPC which have upper immediate)
         imm = instruction >> 20
         
     return ('scalar',opcode, rd, funct3_codes, rs1, rs2, funct7, imm)
-  def execute(self, *decoded):
-    if self.debug==True:
-        print(decoded,(self.pc*4)-4)
+  def resolve(self, decoded):
+    """look up the handler for a decoded tuple, returns (handler, operands)"""
     instruction_type = decoded[0]
     if( instruction_type == 'vector_arith'):
         _, opcode,rd,funct6,funct3,rs1,rs2,vm =decoded
         key=(opcode,funct3,funct6)
         if key in self.dispatch:
-            self.dispatch[key](self, rd, rs1,rs2 )  # ← Pass imm correctly
+            return self.dispatch[key], (rd, rs1, rs2, vm, funct3)
+    elif instruction_type == 'vector_cfg':
+        _, opcode, rd, funct3, form, rs1, operand = decoded
+        return self.dispatch[(opcode, funct3, form)], (rd, rs1, operand)
     elif instruction_type == 'vector_mem':
         _, opcode, rd, funct3, rs1, imm, funct6, vm = decoded  # ← Changed rs2 to imm
         key = (opcode, funct3, funct6)
 
         if key in self.dispatch:
-            self.dispatch[key](self, rd, rs1, imm, vm)  # ← Pass imm correctly
+            return self.dispatch[key], (rd, rs1, imm, vm)  # ← Pass imm correctly
         else:
             raise Exception(f"Unknown vector instruction: opcode=0x{opcode:02x}, funct3=0x{funct3:x}, funct6=0x{funct6:x}")
-    
-    
 
     elif instruction_type == 'scalar':
         _, opcode, rd, funct3, rs1, rs2, funct7, imm = decoded
         
-        if opcode in [opCodes['ALU_REG']]:
+        if opcode == opCodes['ALU_REG']:
+            key = (opcode, funct3, funct7)
+        elif opcode == opCodes['ALU_IMM'] and funct3 == funct3_codes['SRL_SRA']:
+            # SRLI / SRAI tell themselves apart by the top bits of the immediate
             key = (opcode, funct3, funct7)
+        elif opcode == opCodes['SYSTEM']:
+            key = (opcode, funct3, imm)
+        elif opcode == opCodes['AMO']:
+            key = (opcode, funct3, funct7 >> 2)  # funct5, aq / rl do not matter here
         else:
             key = (opcode, funct3, None)
         
         if key in self.dispatch:
-            self.dispatch[key](self, rd, rs1, rs2, imm)
+            return self.dispatch[key], (rd, rs1, rs2, imm)
         else:
-            raise Exception(f"Unknown instruction SCALAR: opcode=0x{opcode:02x}, funct3=0x{funct3:x}")
+            raise Exception(f"Unknown instruction SCALAR: opcode=0x{opcode:02x}, funct3={funct3}")
         
     elif(instruction_type=='branch'):
        _,opcode,imm,rs1,rs2,funct3=decoded
        key=(opcode,funct3,None)
        if key in self.dispatch:
-            self.dispatch[key](self, rs1,rs2,imm )  # ← Pass imm correctly
+            return self.dispatch[key], (rs1,rs2,imm )
+    # unknown vector arith / branch encodings are skipped like a NOP
+    return self.handlers.exec_nop, (0, 0, 0, 0)
+  def execute(self, *decoded):
+    if self.debug==True:
+        print(decoded,(self.pc*4)-4)
+    handler, operands = self.resolve(decoded)
+    handler(self, *operands)
   def examine_all_registers(self):
     # group into rows of 8 registers
     for base in range(0, 16, 8):
@@ -214,14 +447,12 @@ class ApocaCore:
                         for j in range(base, base+8))
         print(row)
   def read_memory(self, address, size):
-      value = 0
-      for i in range(size):
-          value |= self.memory[address + i] << (i * 8)
-      return value  # <-- ADD THIS!
+      return self.memory.load(address, size)
     
   def write_memory(self, address,value,size):
-    for i in range(size):
-      self.memory[address+i] = (value >> (i*8)) & 0xFF
+    self.memory.store(address, value, size)
+    if address < self.code_end:
+      self.invalidate_code(address, size)
   def dump_memory(self, start, length):
       print(f"\n=== Memory Dump: {start} to {start + length - 1} ===")
       for i in range(start, start + length, 4):
@@ -231,8 +462,9 @@ class ApocaCore:
 
   def dump_vector_registers(self):
       print("\n=== Vector Registers ===")
-      for i, vreg in enumerate(self.vreg):
-          non_zero = [val for val in vreg if val != 0]
+      single = self.vrf[:16 * self.VLEN // 8].view(self.vreg.dtype).reshape(16, -1)
+      for i, vreg in enumerate(single):
+          non_zero = vreg[vreg != 0].tolist()
           if non_zero:
               print(f"  v{i}: {non_zero[:8]}")  # Show first 8 elements
       print()
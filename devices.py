@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# devices.py
+"""
+Memory mapped devices.
+A Bus hangs devices off a core's memory at page aligned addresses where
+there is no RAM. Memory only asks the bus when an access misses RAM (past
+the end of a flat Memory, or a page PagedMemory has nothing behind), so
+ordinary loads and stores never look at it. Devices see reads and writes
+of their own registers as (offset, size).
+
+Default map, see standard_bus:
+    0x02000000  Timer  instructions retired, host time, compare
+    0x10000000  UART   16550 style, RBR / THR at 0 and LSR at 5, buffered
+    0x10001000  DMA    block copies memory <-> memory and memory <-> host file
+
+Bus.run drives the core in slices of instructions, core.instret (and so
+the timer's instruction count) moves at that granularity.
+"""
+import sys
+import time
+import struct
+from memory import Memory, PAGE_BITS, PAGE_SIZE
+
+TIMER_BASE = 0x02000000
+UART_BASE = 0x10000000
+DMA_BASE = 0x10001000
+DEFAULT_SLICE = 1000  # instructions per run slice in Bus.run
+UART_BUFFER = 1 << 12  # output bytes held before a write to the host
+DMA_CHUNK = 1 << 20  # bytes per host read / write
+
+
+class Device:
+    """base device: size bytes of registers, reads as zero and ignores writes"""
+    size = PAGE_SIZE
+
+    def attach(self, core):
+        self.core = core
+
+    def read(self, offset, size):
+        return 0
+
+    def write(self, offset, value, size):
+        pass
+
+    def close(self):
+        pass
+
+
+class UART(Device):
+    """
+    16550 subset. Writing THR (offset 0) queues a byte for the host output,
+    reading RBR (offset 0) takes the next byte of the host input, LSR
+    (offset 5) has data ready in bit 0 and the transmitter always empty.
+    Input is read from the host in big blocks, output is written in them.
+    """
+    RBR_THR = 0
+    LSR = 5
+    LSR_DATA_READY = 0x01
+    LSR_THR_EMPTY = 0x60
+
+    def __init__(self, output=None, input=None):
+        self.output = output if output is not None else sys.stdout.buffer
+        self.input = input
+        self.pending = bytearray()
+        self.received = b''
+        self.position = 0
+        self.sent = 0
+
+    def fill(self):
+        """True when there is an input byte, refilling from the host a block at a time"""
+        if self.position < len(self.received):
+            return True
+        if self.input is None:
+            return False
+        self.received = self.input.read(UART_BUFFER)
+        self.position = 0
+        return bool(self.received)
+
+    def read(self, offset, size):
+        if offset == self.RBR_THR:
+            if not self.fill():
+                return 0
+            self.position += 1
+            return self.received[self.position - 1]
+        if offset == self.LSR:
+            return self.LSR_THR_EMPTY | (self.LSR_DATA_READY if self.fill() else 0)
+        return 0
+
+    def write(self, offset, value, size):
+        if offset == self.RBR_THR:
+            self.pending.append(value & 0xFF)
+            if len(self.pending) >= UART_BUFFER:
+                self.flush()
+
+    def flush(self):
+        if self.pending:
+            if self.output is sys.stdout.buffer:
+                sys.stdout.flush()  # keep the order with print()
+            self.output.write(self.pending)
+            self.output.flush()
+            self.sent += len(self.pending)
+            self.pending.clear()
+
+    def close(self):
+        self.flush()
+        if self.output is not sys.stdout.buffer:
+            self.output.close()
+        if self.input is not None and self.input is not sys.stdin.buffer:
+            self.input.close()
+
+
+class Timer(Device):
+    """
+    64 bit registers, read as two words: instructions retired at 0x0,
+    host nanoseconds since attach at 0x8, compare at 0x10 (writable) and
+    at 0x18 a status word with bit 0 set once instret has reached compare.
+    """
+    REGISTERS = struct.Struct('<QQQQ')
+    COMPARE = 0x10
+
+    def __init__(self):
+        self.compare = 0xFFFFFFFFFFFFFFFF
+        self.start = 0
+
+    def attach(self, core):
+        super().attach(core)
+        self.start = time.perf_counter_ns()
+
+    def image(self):
+        instret = self.core.instret
+        return self.REGISTERS.pack(instret, time.perf_counter_ns() - self.start, self.compare,
+                                   1 if instret >= self.compare else 0)
+
+    def read(self, offset, size):
+        return int.from_bytes(self.image()[offset:offset + size], 'little')
+
+    def write(self, offset, value, size):
+        if self.COMPARE <= offset < self.COMPARE + 8:
+            compare = bytearray(self.compare.to_bytes(8, 'little'))
+            shift = offset - self.COMPARE
+            compare[shift:shift + size] = value.to_bytes(size, 'little')[:8 - shift]
+            self.compare = int.from_bytes(compare, 'little')
+
+
+class DMA(Device):
+    """
+    Block transfers, run to completion when CMD is written. Word registers:
+    SRC at 0x0, DST at 0x4, LEN at 0x8, CMD at 0xC and STATUS at 0x10, the
+    bytes the last command moved (short at the end of the file).
+        CMD 1  memory SRC -> memory DST
+        CMD 2  file offset SRC -> memory DST
+        CMD 3  memory SRC -> file offset DST
+    The file is the host file the device was made with.
+    """
+    SRC, DST, LEN, CMD, STATUS = 0x0, 0x4, 0x8, 0xC, 0x10
+    COPY, FILE_TO_MEMORY, MEMORY_TO_FILE = 1, 2, 3
+
+    def __init__(self, file=None):
+        self.file = file
+        self.registers = {self.SRC: 0, self.DST: 0, self.LEN: 0, self.STATUS: 0}
+        self.moved = 0
+
+    def read(self, offset, size):
+        return self.registers.get(offset, 0)
+
+    def write(self, offset, value, size):
+        if offset == self.CMD:
+            self.registers[self.STATUS] = self.transfer(value)
+            self.moved += self.registers[self.STATUS]
+        elif offset in self.registers:
+            self.registers[offset] = value & 0xFFFFFFFF
+
+    def transfer(self, command):
+        src, dst, length = self.registers[self.SRC], self.registers[self.DST], self.registers[self.LEN]
+        memory = self.core.memory
+        if isinstance(memory, Memory):
+            # a slice past the end of a bytearray would grow it instead of failing
+            for address in ((src, dst) if command == self.COPY else
+                            (dst,) if command == self.FILE_TO_MEMORY else (src,)):
+                if address + length > len(memory):
+                    raise IndexError(f"DMA of {length} bytes at {address:#x} runs past the end of RAM")
+        if command == self.COPY:
+            # back to front when the destination overlaps the end of the source
+            starts = range(0, length, DMA_CHUNK)
+            for start in (reversed(starts) if src < dst < src + length else starts):
+                chunk = min(DMA_CHUNK, length - start)
+                memory.write_bytes(dst + start, bytes(memory.read_bytes(src + start, chunk)))
+            moved = length
+        elif command in (self.FILE_TO_MEMORY, self.MEMORY_TO_FILE):
+            if self.file is None:
+                raise ValueError("DMA file transfer without a host file, use --dma-file")
+            moved = self.file_transfer(command, src, dst, length)
+        else:
+            raise ValueError(f"unknown DMA command {command}")
+        if command != self.MEMORY_TO_FILE and dst < self.core.code_end:
+            self.core.invalidate_code(dst, moved)
+        return moved
+
+    def file_transfer(self, command, src, dst, length):
+        memory = self.core.memory
+        moved = 0
+        if command == self.FILE_TO_MEMORY:
+            self.file.seek(src)
+            while moved < length:
+                chunk = min(DMA_CHUNK, length - moved)
+                if isinstance(memory, Memory):
+                    # straight into the RAM buffer, no copy in between
+                    got = self.file.readinto(memory.read_bytes(dst + moved, chunk))
+                else:
+                    data = self.file.read(chunk)
+                    memory.write_bytes(dst + moved, data)
+                    got = len(data)
+                moved += got
+                if got < chunk:
+                    break
+        else:
+            self.file.seek(dst)
+            while moved < length:
+                chunk = min(DMA_CHUNK, length - moved)
+                self.file.write(memory.read_bytes(src + moved, chunk))
+                moved += chunk
+            self.file.flush()
+        return moved
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class Bus:
+    """devices by page; attach(core) hangs the bus off core.memory"""
+    def __init__(self):
+        self.devices = []  # (base, device)
+        self.pages = {}  # page number -> (base, device)
+        self.core = None
+
+    def map(self, base, device):
+        if base & (PAGE_SIZE - 1):
+            raise ValueError(f"device base {base:#x} is not page aligned")
+        for number in range(base >> PAGE_BITS, (base + device.size + PAGE_SIZE - 1) >> PAGE_BITS):
+            if number in self.pages:
+                raise ValueError(f"device at {base:#x} overlaps the one at {self.pages[number][0]:#x}")
+            self.pages[number] = (base, device)
+        self.devices.append((base, device))
+        return device
+
+    def attach(self, core):
+        memory = core.memory
+        for number, (base, device) in self.pages.items():
+            if isinstance(memory, Memory) and base < len(memory):
+                raise ValueError(f"device at {base:#x} is inside {len(memory)} bytes of RAM")
+            if not isinstance(memory, Memory) and number in memory.pages:
+                raise ValueError(f"device at {base:#x} is over a page that already holds RAM")
+        for _, device in self.devices:
+            device.attach(core)
+        self.core = core
+        memory.bus = self
+        if core.translator is not None:
+            core.set_code_end(core.code_end)  # blocks compiled for plain RAM have to go
+        return self
+
+    def read(self, address, size):
+        entry = self.pages.get(address >> PAGE_BITS)
+        if entry is None:
+            raise IndexError(f"no memory or device at {address:#x}")
+        base, device = entry
+        return device.read(address - base, size)
+
+    def write(self, address, value, size):
+        entry = self.pages.get(address >> PAGE_BITS)
+        if entry is None:
+            raise IndexError(f"no memory or device at {address:#x}")
+        base, device = entry
+        device.write(address - base, value, size)
+
+    def run(self, max_instructions=None, slice=DEFAULT_SLICE):
+        """run the core slice instructions at a time so the timer sees instret move"""
+        core = self.core
+        while core.pc < core.program_length:
+            if max_instructions is None:
+                core.run(slice)
+            elif core.instret >= max_instructions:
+                break
+            else:
+                core.run(min(slice, max_instructions - core.instret))
+        self.flush()
+
+    def flush(self):
+        for _, device in self.devices:
+            if hasattr(device, 'flush'):
+                device.flush()
+
+    def close(self):
+        for _, device in self.devices:
+            device.close()
+
+
+def standard_bus(uart_out=None, uart_in=None, dma_file=None):
+    """timer, UART and DMA at the default addresses. Paths, '-' for stdin / stdout"""
+    bus = Bus()
+    bus.map(TIMER_BASE, Timer())
+    output = sys.stdout.buffer if uart_out in (None, '-') else open(uart_out, 'wb')
+    input = sys.stdin.buffer if uart_in == '-' else open(uart_in, 'rb') if uart_in else None
+    bus.map(UART_BASE, UART(output, input))
+    bus.map(DMA_BASE, DMA(open_dma_file(dma_file) if dma_file else None))
+    return bus
+
+
+def open_dma_file(path):
+    """read / write without truncating, made if it is not there"""
+    try:
+        return open(path, 'r+b')
+    except FileNotFoundError:
+        return open(path, 'w+b')
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# elf.py
+"""
+ELF32 executables for ApocaCore.
+ElfFile maps an executable with mmap, reads the ELF, program and section
+headers with struct, and loads every PT_LOAD segment into a core with one
+buffer copy per segment (flat memory) or by handing whole pages of a copy
+on write mapping straight to PagedMemory. The entry point becomes the pc,
+the executable segments the code region, and the symbol table is kept for
+the profiler.
+
+The container is standard little endian ELF32 for EM_RISCV; the words in it
+have to be apocacore encodings (see constants.py). write_elf goes the other
+way and turns an assembled .apo into an executable:
+    python elf.py test.apo -o test.elf
+    python elf.py test.elf
+"""
+import mmap
+import struct
+import argparse
+from array import array
+from collections import namedtuple
+from memory import PagedMemory
+
+ELF_MAGIC = b'\x7fELF'
+ELFCLASS32 = 1
+ELFDATA2LSB = 1
+ET_EXEC = 2
+EM_RISCV = 243
+PT_LOAD = 1
+PF_X, PF_W, PF_R = 1, 2, 4
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+STT_OBJECT, STT_FUNC = 1, 2
+SHN_UNDEF = 0
+SHN_ABS = 0xFFF1
+PAGE_ALIGN = 0x1000
+
+# ident, type, machine, version, entry, phoff, shoff, flags, ehsize, phentsize, phnum, shentsize, shnum, shstrndx
+ELF_HEADER = struct.Struct('<16sHHIIIIIHHHHHH')
+# type, offset, vaddr, paddr, filesz, memsz, flags, align
+PROGRAM_HEADER = struct.Struct('<IIIIIIII')
+# name, type, flags, addr, offset, size, link, info, addralign, entsize
+SECTION_HEADER = struct.Struct('<IIIIIIIIII')
+# name, value, size, info, other, shndx
+SYMBOL = struct.Struct('<IIIBBH')
+
+Segment = namedtuple('Segment', 'vaddr offset filesz memsz flags')
+
+
+class ElfFile:
+    """an ELF32 RISC-V executable, mapped copy on write so segments can be handed out as pages"""
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        if len(self.map) < ELF_HEADER.size:
+            raise ValueError(f"{path}: too short for an ELF header")
+        (ident, kind, machine, _, self.entry, phoff, shoff, _, _,
+         phentsize, phnum, shentsize, shnum, shstrndx) = ELF_HEADER.unpack_from(self.map, 0)
+        if ident[:4] != ELF_MAGIC:
+            raise ValueError(f"{path}: not an ELF file")
+        if ident[4] != ELFCLASS32 or ident[5] != ELFDATA2LSB:
+            raise ValueError(f"{path}: only little endian ELF32 is supported")
+        if machine != EM_RISCV or kind != ET_EXEC:
+            raise ValueError(f"{path}: not a RISC-V executable (type {kind}, machine {machine})")
+        self.segments = []
+        for i in range(phnum):
+            ptype, offset, vaddr, _, filesz, memsz, flags, _ = \
+                PROGRAM_HEADER.unpack_from(self.map, phoff + i * phentsize)
+            if ptype == PT_LOAD and memsz:
+                if offset + filesz > len(self.map) or filesz > memsz:
+                    raise ValueError(f"{path}: segment at {vaddr:#x} runs past the end of the file")
+                self.segments.append(Segment(vaddr, offset, filesz, memsz, flags))
+        if not self.segments:
+            raise ValueError(f"{path}: no PT_LOAD segments, nothing to run")
+        self.symbols = {}
+        sections = [SECTION_HEADER.unpack_from(self.map, shoff + i * shentsize) for i in range(shnum)]
+        for section in sections:
+            if section[1] == SHT_SYMTAB:
+                self.read_symbols(section, sections[section[6]])
+
+    def read_symbols(self, symtab, strtab):
+        """functions, objects and labels with a value, name -> byte address"""
+        names = self.map[strtab[4]:strtab[4] + strtab[5]]
+        for offset in range(symtab[4], symtab[4] + symtab[5], SYMBOL.size):
+            name, value, _, info, _, shndx = SYMBOL.unpack_from(self.map, offset)
+            if not name or shndx == SHN_UNDEF or (info & 0xF) not in (0, STT_OBJECT, STT_FUNC):
+                continue
+            self.symbols[names[name:names.index(b'\0', name)].decode()] = value
+
+    def code_end(self):
+        """byte address just past the last executable segment"""
+        return max((s.vaddr + s.memsz for s in self.segments if s.flags & PF_X), default=0)
+
+    def load(self, core):
+        """load the segments into a freshly made core and point it at the entry"""
+        memory = core.memory
+        view = memoryview(self.map)
+        for segment in self.segments:
+            if segment.vaddr + segment.memsz > len(memory):
+                raise ValueError(f"{self.path}: segment at {segment.vaddr:#x} does not fit in "
+                                 f"{len(memory)} bytes of memory, use -m or --paged")
+            data = view[segment.offset:segment.offset + segment.filesz]
+            if isinstance(memory, PagedMemory):
+                memory.map_pages(segment.vaddr, data)
+            else:
+                memory.write_bytes(segment.vaddr, data)
+            # .bss: a fresh memory reads zero already
+        if self.entry & 3:
+            raise ValueError(f"{self.path}: entry {self.entry:#x} is not word aligned")
+        core.set_code_end(self.code_end())
+        core.image_end = max(segment.vaddr + segment.memsz for segment in self.segments)
+        core.pc = self.entry >> 2
+        return self
+
+
+def is_elf(path):
+    with open(path, 'rb') as f:
+        return f.read(4) == ELF_MAGIC
+
+
+def write_elf(path, segments, entry=0, symbols=None):
+    """
+    segments is a list of (vaddr, data, flags); symbols name -> address
+    become STT_FUNC in the executable segments, STT_OBJECT elsewhere. File
+    offsets are page aligned with their vaddr like a linker lays them out.
+    """
+    symbols = symbols or {}
+    header_end = ELF_HEADER.size + PROGRAM_HEADER.size * len(segments)
+    offset = header_end
+    placed = []
+    for vaddr, data, flags in segments:
+        offset += (vaddr - offset) % PAGE_ALIGN
+        placed.append((vaddr, bytes(data), flags, offset))
+        offset += len(data)
+    # string tables, symbol table, section headers
+    shstrtab = b'\0.symtab\0.strtab\0.shstrtab\0'
+    strtab = bytearray(b'\0')
+    symtab = bytearray(SYMBOL.size)  # the null symbol
+    code = [(vaddr, vaddr + len(data)) for vaddr, data, flags, _ in placed if flags & PF_X]
+    for name, value in symbols.items():
+        executable = any(start <= value < end for start, end in code)
+        symtab += SYMBOL.pack(len(strtab), value, 0, (1 << 4) | (STT_FUNC if executable else STT_OBJECT), 0, SHN_ABS)
+        strtab += name.encode() + b'\0'
+    symtab_offset = offset
+    strtab_offset = symtab_offset + len(symtab)
+    shstrtab_offset = strtab_offset + len(strtab)
+    shoff = (shstrtab_offset + len(shstrtab) + 3) & ~3
+    sections = [
+        (0, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+        (1, SHT_SYMTAB, 0, 0, symtab_offset, len(symtab), 2, 1, 4, SYMBOL.size),
+        (9, SHT_STRTAB, 0, 0, strtab_offset, len(strtab), 0, 0, 1, 0),
+        (17, SHT_STRTAB, 0, 0, shstrtab_offset, len(shstrtab), 0, 0, 1, 0),
+    ]
+    image = bytearray(shoff + SECTION_HEADER.size * len(sections))
+    ident = ELF_MAGIC + bytes([ELFCLASS32, ELFDATA2LSB, 1]) + bytes(9)
+    ELF_HEADER.pack_into(image, 0, ident, ET_EXEC, EM_RISCV, 1, entry, ELF_HEADER.size, shoff, 0,
+                         ELF_HEADER.size, PROGRAM_HEADER.size, len(segments), SECTION_HEADER.size,
+                         len(sections), 3)
+    for i, (vaddr, data, flags, offset) in enumerate(placed):
+        PROGRAM_HEADER.pack_into(image, ELF_HEADER.size + i * PROGRAM_HEADER.size,
+                                 PT_LOAD, offset, vaddr, vaddr, len(data), len(data), flags, PAGE_ALIGN)
+        image[offset:offset + len(data)] = data
+    image[symtab_offset:strtab_offset] = symtab
+    image[strtab_offset:shstrtab_offset] = strtab
+    image[shstrtab_offset:shstrtab_offset + len(shstrtab)] = shstrtab
+    for i, section in enumerate(sections):
+        SECTION_HEADER.pack_into(image, shoff + i * SECTION_HEADER.size, *section)
+    with open(path, 'wb') as f:
+        f.write(image)
+
+
+def program_segments(code, data):
+    """an assembled .apo as segments: code at 0, the data section where load_memory puts it"""
+    from cpu import ApocaCore
+    segments = [(0, array('I', code).tobytes(), PF_R | PF_X)]
+    if data:
+        if len(code) * 4 > 512:
+            raise ValueError("code runs into the data section at 512")
+        # let load_memory lay the values out, then cut out the bytes it wrote
+        core = ApocaCore(memory_size=1 << 20)
+        core.load_memory(data)
+        end = max(512 + (i * len(vector) + len(vector) - 1) * 4 + 8 for i, vector in enumerate(data) if vector)
+        segments.append((512, bytes(core.memory.read_bytes(512, end - 512)), PF_R | PF_W))
+    return segments
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='build an ELF executable from a .apo program, or describe one')
+    parser.add_argument('file', help='.apo source to build, or an ELF file to describe')
+    parser.add_argument('-o', required=False, help='ELF file to write')
+    args = parser.parse_args()
+    if args.o:
+        from fileParser import Parser
+        source = Parser()
+        code, data = source.assemble(args.file)
+        write_elf(args.o, program_segments(code, data), 0, source.symbols)
+    else:
+        elf = ElfFile(args.file)
+        print(f"entry {elf.entry:#x}")
+        for s in elf.segments:
+            flags = ''.join(c if s.flags & bit else '-' for c, bit in (('r', PF_R), ('w', PF_W), ('x', PF_X)))
+            print(f"  LOAD {s.vaddr:#010x} filesz {s.filesz:>8} memsz {s.memsz:>8} {flags}")
+        for name, value in sorted(elf.symbols.items(), key=lambda item: item[1]):
+            print(f"  {value:#010x} {name}")
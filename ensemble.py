@@ -0,0 +1,460 @@
+#!/usr/bin/env python
+# ensemble.py
+"""
+Lockstep ensemble mode.
+N independent copies of one program (same code, different data) held as a
+structure of arrays: registers are a (16, N) int64 array and memory an
+(N, memory_size) uint8 array. Instances that sit at the same pc execute
+that instruction together as one numpy operation.
+
+What the lockstep handlers cannot do (vector, atomic and system
+instructions, accesses outside a lane's memory) runs lane by lane on a
+LaneCore, an ApocaCore over that lane's row of memory, with the same
+InstructionHandlers a single core uses. Registers are int64 where
+ApocaCore keeps unbounded ints: the values agree while they fit in 64
+bits, and ADD, SUB, ADDI, MUL and the left shifts check for that and go
+to the scalar core when they might not. A lane that stores into its code
+or ends up with a register past 64 bits leaves the ensemble and runs to
+the end on its LaneCore, results() then reports that core.
+"""
+import numpy as np
+from constants import *
+from exec import InstructionHandlers
+from cpu import ApocaCore
+from memory import Memory
+from timing import ATOMICS
+
+# handlers that can move the pc, a converged group has to be rechecked after them
+CONTROL = ('exec_beq', 'exec_beqi', 'exec_bne', 'exec_blt', 'exec_bge', 'exec_bltu',
+           'exec_bgeu', 'exec_jal', 'exec_jalr')
+SYSTEM = ('exec_ecall', 'exec_ebreak')
+INT64_MIN, INT64_MAX = -(1 << 63), (1 << 63) - 1
+
+
+class LaneFallback(Exception):
+    """raised by a lockstep handler before it changes anything: run this one lane by lane"""
+
+
+def lane_load(processor, address, size, signed):
+    """one load per lane, address is an array with an entry per lane"""
+    if address.min() < 0 or address.max() > processor.memory.shape[1] - size:
+        raise LaneFallback
+    columns = address[:, None] + np.arange(size)
+    raw = processor.memory[processor.lanes[:, None], columns]
+    dtype = np.dtype(f"<{'i' if signed else 'u'}{size}")
+    return np.ascontiguousarray(raw).view(dtype).ravel().astype(np.int64)
+
+def lane_store(processor, address, value, size):
+    # stores into the code change what that lane decodes, the scalar core sees to it
+    if address.min() < processor.code_end or address.max() > processor.memory.shape[1] - size:
+        raise LaneFallback
+    columns = address[:, None] + np.arange(size)
+    data = (value & ((1 << (size * 8)) - 1)).astype(f'<u{size}')
+    processor.memory[processor.lanes[:, None], columns] = data.view(np.uint8).reshape(-1, size)
+
+
+def lane_signed32(value):
+    return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+class EnsembleHandlers(InstructionHandlers):
+    """
+    InstructionHandlers for a group of lanes.
+    The ALU handlers are inherited as they are: processor.registers[r] is a
+    row with one entry per lane so the same expressions broadcast. Only the
+    ones that branch on a value (compares, branches) or touch memory are
+    redone here with numpy, and the ones that can carry a value past 64
+    bits check for it.
+    """
+    @staticmethod
+    def exec_add(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            a, b = processor.registers[rs1], processor.registers[rs2]
+            result = a + b
+            if (((a ^ result) & (b ^ result)) < 0).any():
+                raise LaneFallback
+            processor.registers[rd] = result
+
+    @staticmethod
+    def exec_sub(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            a, b = processor.registers[rs1], processor.registers[rs2]
+            result = a - b
+            if (((a ^ b) & (a ^ result)) < 0).any():
+                raise LaneFallback
+            processor.registers[rd] = result
+
+    @staticmethod
+    def exec_addi(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            a = processor.registers[rs1]
+            result = a + imm
+            if (((a ^ result) & (imm ^ result)) < 0).any():
+                raise LaneFallback
+            processor.registers[rd] = result
+
+    @staticmethod
+    def exec_mul(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            a, b = processor.registers[rs1], processor.registers[rs2]
+            # a float estimate is enough, anything near the edge goes to the scalar core
+            if (np.abs(a.astype(np.float64) * b) >= 2.0 ** 62).any():
+                raise LaneFallback
+            processor.registers[rd] = a * b
+
+    @staticmethod
+    def exec_sll(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            a = processor.registers[rs1]
+            shift = processor.registers[rs2] & 0x1F
+            if ((np.abs(a) >> (62 - shift)) != 0).any():
+                raise LaneFallback
+            processor.registers[rd] = a << shift
+
+    @staticmethod
+    def exec_slli(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            a = processor.registers[rs1]
+            shift = imm & 0x1F
+            if ((np.abs(a) >> (62 - shift)) != 0).any():
+                raise LaneFallback
+            processor.registers[rd] = a << shift
+
+    @staticmethod
+    def exec_slt(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            processor.registers[rd] = processor.registers[rs1] < processor.registers[rs2]
+
+    @staticmethod
+    def exec_sltu(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            processor.registers[rd] = (processor.registers[rs1] & 0xFFFFFFFF) < (processor.registers[rs2] & 0xFFFFFFFF)
+
+    @staticmethod
+    def exec_slti(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            processor.registers[rd] = processor.registers[rs1] < imm
+
+    @staticmethod
+    def exec_sltiu(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            processor.registers[rd] = (processor.registers[rs1] & 0xFFFFFFFF) < (imm & 0xFFFFFFFF)
+
+    # M extension: the 64 bit products and the divide by zero cases per lane
+    @staticmethod
+    def exec_mulh(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            processor.registers[rd] = (lane_signed32(processor.registers[rs1]) * lane_signed32(processor.registers[rs2])) >> 32
+
+    @staticmethod
+    def exec_mulhsu(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            processor.registers[rd] = (lane_signed32(processor.registers[rs1]) * (processor.registers[rs2] & 0xFFFFFFFF)) >> 32
+
+    @staticmethod
+    def exec_mulhu(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            a = (processor.registers[rs1] & 0xFFFFFFFF).astype(np.uint64)
+            b = (processor.registers[rs2] & 0xFFFFFFFF).astype(np.uint64)
+            processor.registers[rd] = ((a * b) >> np.uint64(32)).astype(np.int64)
+
+    @staticmethod
+    def exec_div(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            a = lane_signed32(processor.registers[rs1])
+            b = lane_signed32(processor.registers[rs2])
+            quotient = np.abs(a) // np.where(b == 0, 1, np.abs(b))
+            quotient = lane_signed32(np.where((a < 0) == (b < 0), quotient, -quotient))
+            processor.registers[rd] = np.where(b == 0, -1, quotient)
+
+    @staticmethod
+    def exec_divu(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            b = processor.registers[rs2] & 0xFFFFFFFF
+            quotient = (processor.registers[rs1] & 0xFFFFFFFF) // np.where(b == 0, 1, b)
+            processor.registers[rd] = np.where(b == 0, 0xFFFFFFFF, quotient)
+
+    @staticmethod
+    def exec_rem(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            a = lane_signed32(processor.registers[rs1])
+            b = lane_signed32(processor.registers[rs2])
+            remainder = np.abs(a) % np.where(b == 0, 1, np.abs(b))
+            processor.registers[rd] = np.where(b == 0, a, np.where(a < 0, -remainder, remainder))
+
+    @staticmethod
+    def exec_remu(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            a = processor.registers[rs1] & 0xFFFFFFFF
+            b = processor.registers[rs2] & 0xFFFFFFFF
+            processor.registers[rd] = np.where(b == 0, a, a % np.where(b == 0, 1, b))
+
+    @staticmethod
+    def exec_lb(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            value = lane_load(processor, processor.registers[rs1] + imm, 1, False)
+            processor.registers[rd] = np.where(value & 0x80, value | 0xFFFFFF00, value)
+
+    @staticmethod
+    def exec_lh(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            value = lane_load(processor, processor.registers[rs1] + imm, 2, False)
+            processor.registers[rd] = np.where(value & 0x8000, value | 0xFFFF0000, value)
+
+    @staticmethod
+    def exec_lw(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            processor.registers[rd] = lane_load(processor, processor.registers[rs1] + imm, 4, True)
+
+    @staticmethod
+    def exec_lbu(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            processor.registers[rd] = lane_load(processor, processor.registers[rs1] + imm, 1, False)
+
+    @staticmethod
+    def exec_lhu(processor, rd, rs1, rs2, imm):
+        if rd != 0:
+            processor.registers[rd] = lane_load(processor, processor.registers[rs1] + imm, 2, False)
+
+    @staticmethod
+    def exec_sb(processor, rd, rs1, rs2, imm):
+        lane_store(processor, processor.registers[rs1] + imm, processor.registers[rs2], 1)
+
+    @staticmethod
+    def exec_sh(processor, rd, rs1, rs2, imm):
+        lane_store(processor, processor.registers[rs1] + imm, processor.registers[rs2], 2)
+
+    @staticmethod
+    def exec_sw(processor, rd, rs1, rs2, imm):
+        lane_store(processor, processor.registers[rs1] + imm, processor.registers[rs2], 4)
+
+    # Branches pick the new pc per lane
+    @staticmethod
+    def exec_beq(processor, rs1, rs2, imm):
+        taken = processor.registers[rs1] == processor.registers[rs2]
+        processor.pc = np.where(taken, processor.pc + imm // 4 - 1, processor.pc)
+
+    @staticmethod
+    def exec_beqi(processor, rs1, rs2, imm):
+        taken = processor.registers[rs1] == (rs2 - 32 if rs2 & 0x10 else rs2)
+        processor.pc = np.where(taken, processor.pc + imm // 4 - 1, processor.pc)
+
+    @staticmethod
+    def exec_bne(processor, rs1, rs2, imm):
+        taken = processor.registers[rs1] != processor.registers[rs2]
+        processor.pc = np.where(taken, processor.pc + imm // 4 - 1, processor.pc)
+
+    @staticmethod
+    def exec_blt(processor, rs1, rs2, imm):
+        taken = processor.registers[rs1] < processor.registers[rs2]
+        processor.pc = np.where(taken, processor.pc + imm // 4 - 1, processor.pc)
+
+    @staticmethod
+    def exec_bge(processor, rs1, rs2, imm):
+        taken = processor.registers[rs1] >= processor.registers[rs2]
+        processor.pc = np.where(taken, processor.pc + imm // 4 - 1, processor.pc)
+
+    @staticmethod
+    def exec_bltu(processor, rs1, rs2, imm):
+        taken = (processor.registers[rs1] & 0xFFFFFFFF) < (processor.registers[rs2] & 0xFFFFFFFF)
+        processor.pc = np.where(taken, processor.pc + imm // 4 - 1, processor.pc)
+
+    @staticmethod
+    def exec_bgeu(processor, rs1, rs2, imm):
+        taken = (processor.registers[rs1] & 0xFFFFFFFF) >= (processor.registers[rs2] & 0xFFFFFFFF)
+        processor.pc = np.where(taken, processor.pc + imm // 4 - 1, processor.pc)
+
+
+class LaneCore(ApocaCore):
+    """one lane as a scalar core over its row of the ensemble's memory"""
+    def __init__(self, ensemble, lane):
+        row = ensemble.memory[lane]
+        super().__init__(memory=Memory(len(row), row), vlen=ensemble.vlen)
+        self.set_code_end(ensemble.code_end)
+        self.image_end = ensemble.decoder.image_end  # where brk starts
+        self.host = ensemble.host
+        self.wrote_code = False
+
+    def invalidate_code(self, address, size=1):
+        self.wrote_code = True
+        ApocaCore.invalidate_code(self, address, size)
+
+    def fits(self):
+        """every register still fits the ensemble's int64 rows"""
+        return all(INT64_MIN <= value <= INT64_MAX for value in self.registers)
+
+
+class LaneGroup:
+    """the processor a handler sees: every lane that is at one pc"""
+    def __init__(self, ensemble, lanes, registers, pc):
+        self.lanes = lanes
+        self.registers = registers
+        self.pc = pc
+        self.memory = ensemble.memory
+        self.code_end = ensemble.code_end
+        self.program_length = ensemble.program_length
+
+
+class Ensemble:
+    """
+    Run one program over n data sets at once.
+    While every live instance agrees on the pc they step together on the
+    full arrays; after a branch splits them, the instances that share a pc
+    run as a group (lowest pc first, so loops that exit at different
+    iterations meet up again further down).
+    host (a hostcall.HostCalls) answers ECALL for every instance.
+    """
+    def __init__(self, n, memory_size=1024, vlen=256, host=None):
+        self.n = n
+        self.vlen = vlen
+        self.host = host
+        self.registers = np.zeros((16, n), dtype=np.int64)
+        self.memory = np.zeros((n, memory_size), dtype=np.uint8)
+        self.pc = np.zeros(n, dtype=np.int64)
+        self.retired = np.zeros(n, dtype=np.int64)
+        self.lanes = np.arange(n)
+        self.program_length = 0
+        self.code_end = 0
+        self.decoder = ApocaCore(memory_size=memory_size)  # decode / handler lookup only
+        self.handlers = EnsembleHandlers()
+        self.ops = {}  # pc -> (handler, operands, is_control, is_scalar)
+        self.cores = {}  # lane -> LaneCore, made the first time a lane needs one
+        self.solo = np.zeros(n, dtype=bool)  # lanes that left for their LaneCore
+
+    def load_program(self, program):
+        self.decoder.load_program(program)
+        code = np.frombuffer(np.asarray(program, dtype='<u4').tobytes(), dtype=np.uint8)
+        self.memory[:, :len(code)] = code
+        self.program_length = len(program)
+        self.code_end = len(program) * 4
+        self.ops.clear()
+        self.cores.clear()
+
+    def load_elf(self, elf):
+        """the same executable in every instance, all starting at its entry"""
+        elf.load(self.decoder)
+        size = self.memory.shape[1]
+        self.memory[:] = np.frombuffer(bytes(self.decoder.memory.read_bytes(0, size)), dtype=np.uint8)
+        self.program_length = self.decoder.program_length
+        self.code_end = self.decoder.code_end
+        self.pc[:] = self.decoder.pc
+        self.ops.clear()
+        self.cores.clear()
+
+    def load_memory(self, memory_vectors):
+        """same .apo data section in every instance"""
+        self.decoder.load_memory(memory_vectors)
+        self.memory[:, 512:] = np.frombuffer(bytes(self.decoder.memory.read_bytes(512, self.memory.shape[1] - 512)), dtype=np.uint8)
+
+    def load_data(self, address, values, size=4):
+        """per instance data: row i of values (n, k) goes to instance i at address"""
+        values = np.asarray(values, dtype=np.int64) & ((1 << (size * 8)) - 1)
+        raw = values.astype(f'<u{size}').view(np.uint8).reshape(self.n, -1)
+        self.memory[:, address:address + raw.shape[1]] = raw
+
+    def set_register(self, reg, values):
+        self.registers[reg] = values
+
+    def op(self, pc):
+        entry = self.ops.get(pc)
+        if entry is None:
+            handler, operands = self.decoder.resolve(self.decoder.decode(self.decoder.memory.words[pc]))
+            name = handler.__name__
+            scalar = name.startswith('exec_v') or name in ATOMICS or name in SYSTEM
+            entry = self.ops[pc] = (getattr(self.handlers, name), operands, name in CONTROL, scalar)
+        return entry
+
+    def core(self, lane):
+        core = self.cores.get(lane)
+        if core is None:
+            core = self.cores[lane] = LaneCore(self, lane)
+        return core
+
+    def scalar_step(self, pc, lanes, budget):
+        """
+        the instruction at pc lane by lane on the LaneCores. A lane that
+        wrote its code or outgrew int64 goes solo and runs on for budget
+        instructions (None for to the end).
+        """
+        for lane in lanes.tolist():
+            core = self.core(lane)
+            core.registers[:] = self.registers[:, lane].tolist()
+            core.pc = pc
+            core.run(1)
+            self.retired[lane] += 1
+            if core.wrote_code or not core.fits():
+                self.solo[lane] = True
+                core.icache.clear()  # it only decoded for the step it ran
+                self.run_solo(lane, budget)
+            else:
+                self.registers[:, lane] = core.registers
+                self.pc[lane] = core.pc
+
+    def run_solo(self, lane, budget):
+        core = self.cores[lane]
+        before = core.instret
+        core.run(budget)
+        self.retired[lane] += core.instret - before
+        self.pc[lane] = core.pc
+
+    def run(self, max_steps=None):
+        """step until every instance has run off the end of the program"""
+        for lane in np.flatnonzero(self.solo & (self.pc < self.program_length)).tolist():
+            self.run_solo(lane, max_steps)
+        steps = 0
+        converged = True
+        while max_steps is None or steps < max_steps:
+            live = self.pc < self.program_length
+            if self.cores:
+                live &= ~self.solo
+            if converged:
+                if not live.all():
+                    converged = False
+                    continue
+                # everyone at the same pc: work straight on the full arrays
+                pc = int(self.pc[0])
+                handler, operands, control, scalar = self.op(pc)
+                try:
+                    if scalar:
+                        raise LaneFallback
+                    group = LaneGroup(self, self.lanes, self.registers, self.pc + 1)
+                    handler(group, *operands)
+                    self.pc = np.asarray(group.pc, dtype=np.int64)
+                    self.retired += 1
+                except LaneFallback:
+                    self.scalar_step(pc, self.lanes, None if max_steps is None else max_steps - steps)
+                    control = True
+                if control:
+                    converged = bool((self.pc == self.pc[0]).all()) and not self.solo.any()
+            else:
+                if not live.any():
+                    break
+                pc = int(self.pc[live].min())
+                lanes = np.flatnonzero(live & (self.pc == pc))
+                if len(lanes) == self.n:
+                    converged = True
+                    continue
+                handler, operands, control, scalar = self.op(pc)
+                try:
+                    if scalar:
+                        raise LaneFallback
+                    group = LaneGroup(self, lanes, self.registers[:, lanes], self.pc[lanes] + 1)
+                    handler(group, *operands)
+                    self.registers[:, lanes] = group.registers
+                    self.pc[lanes] = group.pc
+                    self.retired[lanes] += 1
+                except LaneFallback:
+                    self.scalar_step(pc, lanes, None if max_steps is None else max_steps - steps)
+            steps += 1
+        self.registers[0] = 0
+        return steps
+
+    def results(self):
+        """final state of every instance, solo lanes as their LaneCore has it"""
+        results = []
+        for i in range(self.n):
+            core = self.cores.get(i)
+            registers = core.registers if self.solo[i] else self.registers[:, i].tolist()
+            results.append({'registers': list(registers), 'pc': int(self.pc[i]), 'retired': int(self.retired[i]),
+                            'exit_code': None if core is None else core.exit_code})
+        return results
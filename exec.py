@@ -4,6 +4,169 @@
 Implementation of RISC-V instruction handlers.
 These functions implement the behavior of each instruction.
 """
+import numpy as np
+from constants import vector_funct3, vsew_codes, vlmul_codes
+
+def signed32(value):
+    """low 32 bits of a register as a signed value"""
+    value &= 0xFFFFFFFF
+    return value - 0x100000000 if value & 0x80000000 else value
+
+def atomic_update(processor, rd, rs1, rs2, op):
+    """
+    AMO: rd = mem[rs1], mem[rs1] = op(mem[rs1], rs2) as one step. Both
+    values are signed 32 bit; processor.atomic is the lock shared by harts
+    that run at the same time, a no-op context otherwise.
+    """
+    address = processor.registers[rs1]
+    with processor.atomic:
+        old = processor.memory.load_signed(address, 4)
+        processor.memory.store(address, op(old, signed32(processor.registers[rs2])), 4)
+    if address < processor.code_end:
+        processor.invalidate_code(address, 4)
+    if rd != 0:
+        processor.registers[rd] = old
+
+# Vector helpers, every op works on whole numpy slices of the register file
+
+def unsigned_dtype(dtype):
+    return np.dtype(f'<u{dtype.itemsize}')
+
+def vector_length(processor):
+    """vl clamped to the elements one register holds at this SEW"""
+    return min(processor.vl, processor.vreg.shape[1])
+
+def vector_mask(processor, vm, vl):
+    """None when unmasked (vm=1), otherwise the v0.t mask bits as bools"""
+    if vm:
+        return None
+    vlenb = processor.VLEN // 8
+    return np.unpackbits(processor.vrf[:vlenb], bitorder='little')[:vl].astype(bool)
+
+def vector_operand(processor, funct3, rs1, dtype, vl):
+    """second operand of a vector op: a register slice or a splatted scalar"""
+    if funct3 == vector_funct3['OPIVV'] or funct3 == vector_funct3['OPMVV']:
+        return processor.vreg[rs1][:vl]
+    if funct3 == vector_funct3['OPIVI']:
+        value = rs1 - 32 if rs1 & 0x10 else rs1  # simm5
+    else:
+        value = processor.registers[rs1]
+    bits = dtype.itemsize * 8
+    value &= (1 << bits) - 1
+    if value >> (bits - 1):
+        value -= 1 << bits
+    return np.asarray(value, dtype=dtype)
+
+def vector_write(dest, result, mask):
+    """store result into dest, only where mask is set when masked"""
+    if mask is None:
+        dest[:] = result
+    else:
+        np.copyto(dest, result, where=mask, casting='unsafe')
+
+def vector_binop(processor, vd, rs1, vs2, vm, funct3, op, unsigned=False):
+    vl = vector_length(processor)
+    a = processor.vreg[vs2][:vl]
+    b = vector_operand(processor, funct3, rs1, a.dtype, vl)
+    if unsigned:
+        a = a.view(unsigned_dtype(a.dtype))
+        b = b.view(unsigned_dtype(b.dtype))
+    with np.errstate(all='ignore'):
+        result = op(a, b)
+    dest = processor.vreg[vd][:vl]
+    vector_write(dest, result.astype(dest.dtype, copy=False), vector_mask(processor, vm, vl))
+
+def vector_compare(processor, vd, rs1, vs2, vm, funct3, op, unsigned=False):
+    vl = vector_length(processor)
+    a = processor.vreg[vs2][:vl]
+    b = vector_operand(processor, funct3, rs1, a.dtype, vl)
+    if unsigned:
+        a = a.view(unsigned_dtype(a.dtype))
+        b = b.view(unsigned_dtype(b.dtype))
+    vlenb = processor.VLEN // 8
+    dest = processor.vrf[vd * vlenb:(vd + 1) * vlenb]
+    bits = np.unpackbits(dest, bitorder='little').astype(bool)
+    vector_write(bits[:vl], op(a, b), vector_mask(processor, vm, vl))
+    dest[:] = np.packbits(bits, bitorder='little')
+
+def vector_reduce(processor, vd, rs1, vs2, vm, op, unsigned=False):
+    vl = vector_length(processor)
+    values = processor.vreg[vs2][:vl]
+    start = processor.vreg[rs1][:1]
+    if unsigned:
+        values = values.view(unsigned_dtype(values.dtype))
+        start = start.view(unsigned_dtype(start.dtype))
+    mask = vector_mask(processor, vm, vl)
+    if mask is not None:
+        values = values[mask]
+    result = op.reduce(np.concatenate((start, values)), dtype=start.dtype)
+    processor.vreg[vd][0] = np.asarray(result).view(processor.vreg.dtype)
+
+def vector_config(processor, rd, avl, vtypei):
+    """apply a vtype and set vl = min(AVL, VLMAX), avl None means ask for VLMAX"""
+    vsew = (vtypei >> 3) & 0x7
+    vlmul = vtypei & 0x7
+    sew = next((s for s, code in vsew_codes.items() if code == vsew), None)
+    lmul = next((m for m, code in vlmul_codes.items() if code == vlmul), None)
+    if sew is None or lmul is None:
+        raise Exception(f"Illegal vtype 0x{vtypei:x}")
+    processor.set_vtype(sew, lmul)
+    processor.vl = processor.VLMAX if avl is None else min(avl, processor.VLMAX)
+    if rd != 0:
+        processor.registers[rd] = processor.vl
+
+def vector_gather(processor, vd, addresses, vm):
+    """load one element per address into vd, a single batched gather"""
+    vl = len(addresses)
+    dest = processor.vreg[vd][:vl]
+    mask = vector_mask(processor, vm, vl)
+    if mask is not None:
+        addresses = addresses[mask]
+    values = processor.memory.gather(addresses, dest.itemsize).view(dest.dtype).ravel()
+    if mask is None:
+        dest[:] = values
+    else:
+        dest[mask] = values
+
+def vector_scatter(processor, vs3, addresses, vm):
+    """store one element of vs3 per address, a single batched scatter"""
+    vl = len(addresses)
+    values = processor.vreg[vs3][:vl]
+    mask = vector_mask(processor, vm, vl)
+    if mask is not None:
+        addresses = addresses[mask]
+        values = values[mask]
+    if len(addresses) == 0:
+        return
+    size = values.itemsize
+    processor.memory.scatter(addresses, values.view(np.uint8).reshape(-1, size))
+    if int(addresses.min()) < processor.code_end:
+        for address in addresses[addresses < processor.code_end].tolist():
+            processor.invalidate_code(address, size)
+
+def vector_div(a, b):
+    """signed division the RISC-V way: truncates, x/0 = -1, MIN/-1 = MIN"""
+    zero = b == 0
+    divisor = np.where(zero, 1, b)
+    q = a // divisor
+    q += ((a % divisor) != 0) & ((a < 0) != (divisor < 0))
+    return np.where(zero, -1, q)
+
+def vector_divu(a, b):
+    zero = b == 0
+    return np.where(zero, np.iinfo(a.dtype).max, a // np.where(zero, 1, b))
+
+def vector_rem(a, b):
+    """signed remainder with the sign of the dividend, x%0 = x"""
+    zero = b == 0
+    divisor = np.where(zero, 1, b)
+    r = np.fmod(a, divisor)
+    return np.where(zero, a, r)
+
+def vector_remu(a, b):
+    zero = b == 0
+    return np.where(zero, a, a % np.where(zero, 1, b))
+
 
 class InstructionHandlers:
     """
@@ -87,6 +250,158 @@ class InstructionHandlers:
         if rd != 0:
             processor.registers[rd] = processor.registers[rs1] & processor.registers[rs2]
     
+    # M extension, the high halves and division work on the 32 bit values
+    @staticmethod
+    def exec_mul(processor, rd, rs1, rs2, imm):
+        """Execute MUL instruction: rd = rs1 * rs2"""
+        if rd != 0:
+            processor.registers[rd] = processor.registers[rs1] * processor.registers[rs2]
+    
+    @staticmethod
+    def exec_mulh(processor, rd, rs1, rs2, imm):
+        """Execute MULH instruction: rd = (rs1 * rs2) >> 32 (signed x signed)"""
+        if rd != 0:
+            processor.registers[rd] = (signed32(processor.registers[rs1]) * signed32(processor.registers[rs2])) >> 32
+    
+    @staticmethod
+    def exec_mulhsu(processor, rd, rs1, rs2, imm):
+        """Execute MULHSU instruction: rd = (rs1 * rs2) >> 32 (signed x unsigned)"""
+        if rd != 0:
+            processor.registers[rd] = (signed32(processor.registers[rs1]) * (processor.registers[rs2] & 0xFFFFFFFF)) >> 32
+    
+    @staticmethod
+    def exec_mulhu(processor, rd, rs1, rs2, imm):
+        """Execute MULHU instruction: rd = (rs1 * rs2) >> 32 (unsigned x unsigned)"""
+        if rd != 0:
+            processor.registers[rd] = ((processor.registers[rs1] & 0xFFFFFFFF) * (processor.registers[rs2] & 0xFFFFFFFF)) >> 32
+    
+    @staticmethod
+    def exec_div(processor, rd, rs1, rs2, imm):
+        """Execute DIV instruction: rd = rs1 / rs2 (signed, rounds toward zero, -1 on divide by zero)"""
+        if rd != 0:
+            dividend = signed32(processor.registers[rs1])
+            divisor = signed32(processor.registers[rs2])
+            if divisor == 0:
+                processor.registers[rd] = -1
+            else:
+                quotient = abs(dividend) // abs(divisor)
+                # -2**31 / -1 overflows back to -2**31
+                processor.registers[rd] = signed32(quotient if (dividend < 0) == (divisor < 0) else -quotient)
+    
+    @staticmethod
+    def exec_divu(processor, rd, rs1, rs2, imm):
+        """Execute DIVU instruction: rd = rs1 / rs2 (unsigned, all ones on divide by zero)"""
+        if rd != 0:
+            divisor = processor.registers[rs2] & 0xFFFFFFFF
+            processor.registers[rd] = (processor.registers[rs1] & 0xFFFFFFFF) // divisor if divisor else 0xFFFFFFFF
+    
+    @staticmethod
+    def exec_rem(processor, rd, rs1, rs2, imm):
+        """Execute REM instruction: rd = rs1 % rs2 (sign of the dividend, rs1 on divide by zero)"""
+        if rd != 0:
+            dividend = signed32(processor.registers[rs1])
+            divisor = signed32(processor.registers[rs2])
+            if divisor == 0:
+                processor.registers[rd] = dividend
+            else:
+                remainder = abs(dividend) % abs(divisor)
+                processor.registers[rd] = -remainder if dividend < 0 else remainder
+    
+    @staticmethod
+    def exec_remu(processor, rd, rs1, rs2, imm):
+        """Execute REMU instruction: rd = rs1 % rs2 (unsigned, rs1 on divide by zero)"""
+        if rd != 0:
+            dividend = processor.registers[rs1] & 0xFFFFFFFF
+            divisor = processor.registers[rs2] & 0xFFFFFFFF
+            processor.registers[rd] = dividend % divisor if divisor else dividend
+    
+    # SYSTEM
+    @staticmethod
+    def exec_ecall(processor, rd, rs1, rs2, imm):
+        """Execute ECALL instruction: host call number in x5, arguments in x10-x13, result in x10"""
+        if processor.host is None:
+            raise Exception(f"ECALL at {(processor.pc - 1) * 4} with no host attached")
+        processor.host.call(processor)
+    
+    @staticmethod
+    def exec_ebreak(processor, rd, rs1, rs2, imm):
+        """Execute EBREAK instruction: stop the run, remember where"""
+        processor.breakpoint = (processor.pc - 1) * 4
+        processor.halt()
+    
+    # A extension, word sized. The reservation LR takes is the address and
+    # the value read; SC succeeds while the word still holds that value and
+    # no other hart's store has dropped the reservation (harts.ReservationWatch)
+    @staticmethod
+    def exec_lr(processor, rd, rs1, rs2, imm):
+        """Execute LR.W instruction: rd = memory[rs1], reserve it"""
+        address = processor.registers[rs1]
+        value = processor.memory.load_signed(address, 4)
+        processor.reservation = (address, value)
+        if rd != 0:
+            processor.registers[rd] = value
+    
+    @staticmethod
+    def exec_sc(processor, rd, rs1, rs2, imm):
+        """Execute SC.W instruction: memory[rs1] = rs2 if still reserved, rd = 0 on success, 1 on failure"""
+        address = processor.registers[rs1]
+        reservation, processor.reservation = processor.reservation, None
+        failed = 1
+        if reservation is not None and reservation[0] == address:
+            with processor.atomic:
+                if processor.memory.load_signed(address, 4) == reservation[1]:
+                    processor.memory.store(address, processor.registers[rs2], 4)
+                    failed = 0
+            if not failed and address < processor.code_end:
+                processor.invalidate_code(address, 4)
+        if rd != 0:
+            processor.registers[rd] = failed
+    
+    @staticmethod
+    def exec_amoswap(processor, rd, rs1, rs2, imm):
+        """Execute AMOSWAP.W instruction: rd = memory[rs1], memory[rs1] = rs2"""
+        atomic_update(processor, rd, rs1, rs2, lambda old, value: value)
+    
+    @staticmethod
+    def exec_amoadd(processor, rd, rs1, rs2, imm):
+        """Execute AMOADD.W instruction: rd = memory[rs1], memory[rs1] += rs2"""
+        atomic_update(processor, rd, rs1, rs2, lambda old, value: old + value)
+    
+    @staticmethod
+    def exec_amoxor(processor, rd, rs1, rs2, imm):
+        """Execute AMOXOR.W instruction: rd = memory[rs1], memory[rs1] ^= rs2"""
+        atomic_update(processor, rd, rs1, rs2, lambda old, value: old ^ value)
+    
+    @staticmethod
+    def exec_amoand(processor, rd, rs1, rs2, imm):
+        """Execute AMOAND.W instruction: rd = memory[rs1], memory[rs1] &= rs2"""
+        atomic_update(processor, rd, rs1, rs2, lambda old, value: old & value)
+    
+    @staticmethod
+    def exec_amoor(processor, rd, rs1, rs2, imm):
+        """Execute AMOOR.W instruction: rd = memory[rs1], memory[rs1] |= rs2"""
+        atomic_update(processor, rd, rs1, rs2, lambda old, value: old | value)
+    
+    @staticmethod
+    def exec_amomin(processor, rd, rs1, rs2, imm):
+        """Execute AMOMIN.W instruction: rd = memory[rs1], memory[rs1] = min(memory[rs1], rs2) signed"""
+        atomic_update(processor, rd, rs1, rs2, min)
+    
+    @staticmethod
+    def exec_amomax(processor, rd, rs1, rs2, imm):
+        """Execute AMOMAX.W instruction: rd = memory[rs1], memory[rs1] = max(memory[rs1], rs2) signed"""
+        atomic_update(processor, rd, rs1, rs2, max)
+    
+    @staticmethod
+    def exec_amominu(processor, rd, rs1, rs2, imm):
+        """Execute AMOMINU.W instruction: rd = memory[rs1], memory[rs1] = min(memory[rs1], rs2) unsigned"""
+        atomic_update(processor, rd, rs1, rs2, lambda old, value: min(old & 0xFFFFFFFF, value & 0xFFFFFFFF))
+    
+    @staticmethod
+    def exec_amomaxu(processor, rd, rs1, rs2, imm):
+        """Execute AMOMAXU.W instruction: rd = memory[rs1], memory[rs1] = max(memory[rs1], rs2) unsigned"""
+        atomic_update(processor, rd, rs1, rs2, lambda old, value: max(old & 0xFFFFFFFF, value & 0xFFFFFFFF))
+    
     # I-type instructions
     @staticmethod
     def exec_addi(processor, rd, rs1, rs2, imm):
@@ -153,7 +468,7 @@ class InstructionHandlers:
         """Execute LB instruction: rd = sign_extend(memory[rs1 + imm][7:0])"""
         if rd != 0:
             address = processor.registers[rs1] + imm
-            value = processor.memory[address] & 0xFF
+            value = processor.memory.load(address, 1)
             # Sign extend from 8 bits
             if value & 0x80:
                 value |= 0xFFFFFF00
@@ -164,7 +479,7 @@ class InstructionHandlers:
         """Execute LH instruction: rd = sign_extend(memory[rs1 + imm][15:0])"""
         if rd != 0:
             address = processor.registers[rs1] + imm
-            value = processor.memory[address] & 0xFFFF
+            value = processor.memory.load(address, 2)
             # Sign extend from 16 bits
             if value & 0x8000:
                 value |= 0xFFFF0000
@@ -175,40 +490,46 @@ class InstructionHandlers:
         """Execute LW instruction: rd = memory[rs1 + imm]"""
         if rd != 0:
             address = processor.registers[rs1] + imm
-            processor.registers[rd] = processor.memory[address]
+            processor.registers[rd] = processor.memory.load_signed(address, 4)
     
     @staticmethod
     def exec_lbu(processor, rd, rs1, rs2, imm):
         """Execute LBU instruction: rd = zero_extend(memory[rs1 + imm][7:0])"""
         if rd != 0:
             address = processor.registers[rs1] + imm
-            processor.registers[rd] = processor.memory[address] & 0xFF
+            processor.registers[rd] = processor.memory.load(address, 1)
     
     @staticmethod
     def exec_lhu(processor, rd, rs1, rs2, imm):
         """Execute LHU instruction: rd = zero_extend(memory[rs1 + imm][15:0])"""
         if rd != 0:
             address = processor.registers[rs1] + imm
-            processor.registers[rd] = processor.memory[address] & 0xFFFF
+            processor.registers[rd] = processor.memory.load(address, 2)
     
     # Store instructions
     @staticmethod
     def exec_sb(processor, rd, rs1, rs2, imm):
         """Execute SB instruction: memory[rs1 + imm] = rs2[7:0]"""
         address = processor.registers[rs1] + imm
-        processor.memory[address] = processor.registers[rs2] & 0xFF
+        processor.memory.store(address, processor.registers[rs2], 1)
+        if address < processor.code_end:
+            processor.invalidate_code(address, 1)
     
     @staticmethod
     def exec_sh(processor, rd, rs1, rs2, imm):
         """Execute SH instruction: memory[rs1 + imm] = rs2[15:0]"""
         address = processor.registers[rs1] + imm
-        processor.memory[address] = processor.registers[rs2] & 0xFFFF
+        processor.memory.store(address, processor.registers[rs2], 2)
+        if address < processor.code_end:
+            processor.invalidate_code(address, 2)
     
     @staticmethod
     def exec_sw(processor, rd, rs1, rs2, imm):
         """Execute SW instruction: memory[rs1 + imm] = rs2"""
         address = processor.registers[rs1] + imm
-        processor.memory[address] = processor.registers[rs2]
+        processor.memory.store(address, processor.registers[rs2], 4)
+        if address < processor.code_end:
+            processor.invalidate_code(address, 4)
     
     # Branch instructions
     @staticmethod
@@ -219,54 +540,61 @@ class InstructionHandlers:
             word_offset = imm // 4
             processor.pc = processor.pc + word_offset - 1  # -1 for word increment
     @staticmethod
-    def exec_bne(processor, rd, rs1, rs2, imm):
+    def exec_beqi(processor, rs1, rs2, imm):
+        """Execute BEQI instruction: if rs1 == simm5 then pc += imm, the 5 bit immediate sits in the rs2 field"""
+        value = rs2 - 32 if rs2 & 0x10 else rs2
+        if processor.registers[rs1] == value:
+            processor.pc = processor.pc + imm // 4 - 1
+
+    @staticmethod
+    def exec_bne(processor, rs1, rs2, imm):
         """Execute BNE instruction: if rs1 != rs2 then pc += imm"""
         if processor.registers[rs1] != processor.registers[rs2]:
-            processor.pc = processor.pc + imm - 4
+            processor.pc = processor.pc + imm // 4 - 1
     
     @staticmethod
-    def exec_blt(processor, rd, rs1, rs2, imm):
+    def exec_blt(processor, rs1, rs2, imm):
         """Execute BLT instruction: if rs1 < rs2 then pc += imm (signed)"""
         if processor.registers[rs1] < processor.registers[rs2]:
-            processor.pc = processor.pc + imm - 4
+            processor.pc = processor.pc + imm // 4 - 1
     
     @staticmethod
-    def exec_bge(processor, rd, rs1, rs2, imm):
+    def exec_bge(processor, rs1, rs2, imm):
         """Execute BGE instruction: if rs1 >= rs2 then pc += imm (signed)"""
         if processor.registers[rs1] >= processor.registers[rs2]:
-            processor.pc = processor.pc + imm - 4
+            processor.pc = processor.pc + imm // 4 - 1
     
     @staticmethod
-    def exec_bltu(processor, rd, rs1, rs2, imm):
+    def exec_bltu(processor, rs1, rs2, imm):
         """Execute BLTU instruction: if rs1 < rs2 then pc += imm (unsigned)"""
         unsigned_rs1 = processor.registers[rs1] & 0xFFFFFFFF
         unsigned_rs2 = processor.registers[rs2] & 0xFFFFFFFF
         if unsigned_rs1 < unsigned_rs2:
-            processor.pc = processor.pc + imm - 4
+            processor.pc = processor.pc + imm // 4 - 1
     
     @staticmethod
-    def exec_bgeu(processor, rd, rs1, rs2, imm):
+    def exec_bgeu(processor, rs1, rs2, imm):
         """Execute BGEU instruction: if rs1 >= rs2 then pc += imm (unsigned)"""
         unsigned_rs1 = processor.registers[rs1] & 0xFFFFFFFF
         unsigned_rs2 = processor.registers[rs2] & 0xFFFFFFFF
         if unsigned_rs1 >= unsigned_rs2:
-            processor.pc = processor.pc + imm - 4
+            processor.pc = processor.pc + imm // 4 - 1
     
-    # Jump instructions
+    # Jump instructions, rd gets the byte address of the next instruction
     @staticmethod
     def exec_jal(processor, rd, rs1, rs2, imm):
         """Execute JAL instruction: rd = pc + 4; pc += imm"""
         if rd != 0:
-            processor.registers[rd] = processor.pc + 4
-        processor.pc = processor.pc + imm - 4
+            processor.registers[rd] = processor.pc * 4
+        processor.pc = processor.pc + imm // 4 - 1
     
     @staticmethod
     def exec_jalr(processor, rd, rs1, rs2, imm):
         """Execute JALR instruction: rd = pc + 4; pc = (rs1 + imm) & ~1"""
-        next_pc = (processor.registers[rs1] + imm) & ~1
+        target = (processor.registers[rs1] + imm) & ~1
         if rd != 0:
-            processor.registers[rd] = processor.pc + 4
-        processor.pc = next_pc - 4
+            processor.registers[rd] = processor.pc * 4
+        processor.pc = target >> 2
     
     # U-type instructions
     @staticmethod
@@ -279,38 +607,226 @@ class InstructionHandlers:
     def exec_auipc(processor, rd, rs1, rs2, imm):
         """Execute AUIPC instruction: rd = pc + (imm << 12)"""
         if rd != 0:
-            processor.registers[rd] = processor.pc + (imm << 12)
+            processor.registers[rd] = (processor.pc - 1) * 4 + (imm << 12)
     @staticmethod
     def exec_vs(processor, vs3, rs1, imm, vm):  # 4 parameters after processor
+        """Execute SV (unit stride): memory[rs1 + imm ...] = vs3[0:vl], one block copy"""
         base = processor.registers[rs1] + imm
-        SEW = processor.vtype['SEW'] // 8
-                
-        for i in range(processor.vl):
-            value = processor.vreg[vs3][i]
-            processor.write_memory(base + i * SEW, value, SEW)
+        vl = vector_length(processor)
+        source = processor.vreg[vs3]
+        if not vm:
+            # masked, only the active elements reach memory
+            vector_scatter(processor, vs3, base + np.arange(vl, dtype=np.int64) * source.itemsize, vm)
+            return
+        data = source[:vl].tobytes()
+        processor.memory.write_bytes(base, data)
+        if base < processor.code_end:
+            processor.invalidate_code(base, len(data))
         
     @staticmethod
     def exec_vl(processor, vd, rs1, imm, vm):  # ← Fixed parameter names
+        """Execute LV (unit stride): vd[0:vl] = memory[rs1 + imm ...], one block copy"""
         base_address = processor.registers[rs1] + imm
         
         elements_to_load = processor.vl
-        if elements_to_load == 0:
-            elements_to_load = processor.VLEN // processor.vtype['SEW']
-        
-        SEW_bytes = processor.vtype['SEW'] // 8
+        dest = processor.vreg[vd]
+        elements_to_load = min(elements_to_load, len(dest))
+        if not vm:
+            # masked, inactive elements of vd are left as they were
+            vector_gather(processor, vd, base_address + np.arange(elements_to_load, dtype=np.int64) * dest.itemsize, vm)
+            return
         
-        for j in range(elements_to_load):
-            if j >= len(processor.vreg[vd]):
-                break
-            
-            addr = base_address + j * SEW_bytes
-            value = processor.read_memory(addr, SEW_bytes)
-            
-            processor.vreg[vd][j] = value
-    @staticmethod
-    def exec_vadd(processor, rd,rs1,rs2):  # 4 parameters after processor
-        for i in range(processor.vl):
-            processor.vreg[rd][i]= processor.vreg[rs1][i]+processor.vreg[rs2][i]
+        raw = processor.memory.read_bytes(base_address, elements_to_load * dest.itemsize)
+        dest[:elements_to_load] = np.frombuffer(raw, dtype=dest.dtype)
+
+    @staticmethod
+    def exec_vlse(processor, vd, rs1, rs2, vm):
+        """Execute VLSE (strided): vd[i] = memory[rs1 + i * rs2]"""
+        vl = vector_length(processor)
+        stride = processor.registers[rs2]
+        vector_gather(processor, vd, processor.registers[rs1] + np.arange(vl, dtype=np.int64) * stride, vm)
+
+    @staticmethod
+    def exec_vsse(processor, vs3, rs1, rs2, vm):
+        """Execute VSSE (strided): memory[rs1 + i * rs2] = vs3[i]"""
+        vl = vector_length(processor)
+        stride = processor.registers[rs2]
+        vector_scatter(processor, vs3, processor.registers[rs1] + np.arange(vl, dtype=np.int64) * stride, vm)
+
+    @staticmethod
+    def exec_vluxei(processor, vd, rs1, vs2, vm):
+        """Execute VLUXEI (indexed): vd[i] = memory[rs1 + vs2[i]], byte offsets at SEW"""
+        vl = vector_length(processor)
+        offsets = processor.vreg[vs2][:vl]
+        offsets = offsets.view(unsigned_dtype(offsets.dtype)).astype(np.int64)
+        vector_gather(processor, vd, processor.registers[rs1] + offsets, vm)
+
+    @staticmethod
+    def exec_vsuxei(processor, vs3, rs1, vs2, vm):
+        """Execute VSUXEI (indexed): memory[rs1 + vs2[i]] = vs3[i], byte offsets at SEW"""
+        vl = vector_length(processor)
+        offsets = processor.vreg[vs2][:vl]
+        offsets = offsets.view(unsigned_dtype(offsets.dtype)).astype(np.int64)
+        vector_scatter(processor, vs3, processor.registers[rs1] + offsets, vm)
+
+    # Vector configuration
+    @staticmethod
+    def exec_vsetvli(processor, rd, rs1, vtypei):
+        """Execute VSETVLI: vtype = vtypei, rd = vl = min(rs1, VLMAX)"""
+        if rs1 != 0:
+            avl = processor.registers[rs1] & 0xFFFFFFFF
+        elif rd != 0:
+            avl = None  # rs1 = x0 asks for VLMAX
+        else:
+            avl = processor.vl  # both x0: keep vl, change vtype
+        vector_config(processor, rd, avl, vtypei)
+
+    @staticmethod
+    def exec_vsetivli(processor, rd, uimm, vtypei):
+        """Execute VSETIVLI: vtype = vtypei, rd = vl = min(uimm, VLMAX)"""
+        vector_config(processor, rd, uimm, vtypei)
+
+    @staticmethod
+    def exec_vsetvl(processor, rd, rs1, rs2):
+        """Execute VSETVL: like VSETVLI with vtype taken from rs2"""
+        if rs1 != 0:
+            avl = processor.registers[rs1] & 0xFFFFFFFF
+        elif rd != 0:
+            avl = None
+        else:
+            avl = processor.vl
+        vector_config(processor, rd, avl, processor.registers[rs2] & 0xFF)
+
+    # Vector arithmetic
+    # vs2 is the first source operand, rs1 the second: a vector register (.vv),
+    # a scalar register (.vx) or a 5 bit immediate (.vi) depending on funct3.
+    # vm=0 means masked by v0, masked off elements are left as they were.
+    @staticmethod
+    def exec_vadd(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VADD: vd = vs2 + rs1, wraps at SEW"""
+        vector_binop(processor, vd, rs1, vs2, vm, funct3, np.add)
+
+    @staticmethod
+    def exec_vsub(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VSUB: vd = vs2 - rs1, wraps at SEW"""
+        vector_binop(processor, vd, rs1, vs2, vm, funct3, np.subtract)
+
+    @staticmethod
+    def exec_vmul(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VMUL: vd = low SEW bits of vs2 * rs1"""
+        vector_binop(processor, vd, rs1, vs2, vm, funct3, np.multiply)
+
+    @staticmethod
+    def exec_vdiv(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VDIV: vd = vs2 / rs1 (signed, rounds toward zero)"""
+        vector_binop(processor, vd, rs1, vs2, vm, funct3, vector_div)
+
+    @staticmethod
+    def exec_vdivu(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VDIVU: vd = vs2 / rs1 (unsigned)"""
+        vector_binop(processor, vd, rs1, vs2, vm, funct3, vector_divu, unsigned=True)
+
+    @staticmethod
+    def exec_vrem(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VREM: vd = vs2 % rs1 (signed, sign follows the dividend)"""
+        vector_binop(processor, vd, rs1, vs2, vm, funct3, vector_rem)
+
+    @staticmethod
+    def exec_vremu(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VREMU: vd = vs2 % rs1 (unsigned)"""
+        vector_binop(processor, vd, rs1, vs2, vm, funct3, vector_remu, unsigned=True)
+
+    @staticmethod
+    def exec_vmin(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VMIN: vd = min(vs2, rs1) (signed)"""
+        vector_binop(processor, vd, rs1, vs2, vm, funct3, np.minimum)
+
+    @staticmethod
+    def exec_vminu(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VMINU: vd = min(vs2, rs1) (unsigned)"""
+        vector_binop(processor, vd, rs1, vs2, vm, funct3, np.minimum, unsigned=True)
+
+    @staticmethod
+    def exec_vmax(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VMAX: vd = max(vs2, rs1) (signed)"""
+        vector_binop(processor, vd, rs1, vs2, vm, funct3, np.maximum)
+
+    @staticmethod
+    def exec_vmaxu(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VMAXU: vd = max(vs2, rs1) (unsigned)"""
+        vector_binop(processor, vd, rs1, vs2, vm, funct3, np.maximum, unsigned=True)
+
+    @staticmethod
+    def exec_vand(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VAND: vd = vs2 & rs1"""
+        vector_binop(processor, vd, rs1, vs2, vm, funct3, np.bitwise_and)
+
+    @staticmethod
+    def exec_vor(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VOR: vd = vs2 | rs1"""
+        vector_binop(processor, vd, rs1, vs2, vm, funct3, np.bitwise_or)
+
+    @staticmethod
+    def exec_vxor(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VXOR: vd = vs2 ^ rs1"""
+        vector_binop(processor, vd, rs1, vs2, vm, funct3, np.bitwise_xor)
+
+    # Vector compares write one mask bit per element into vd
+    @staticmethod
+    def exec_vmseq(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VMSEQ: vd.mask[i] = vs2[i] == rs1"""
+        vector_compare(processor, vd, rs1, vs2, vm, funct3, np.equal)
+
+    @staticmethod
+    def exec_vmsne(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VMSNE: vd.mask[i] = vs2[i] != rs1"""
+        vector_compare(processor, vd, rs1, vs2, vm, funct3, np.not_equal)
+
+    @staticmethod
+    def exec_vmslt(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VMSLT: vd.mask[i] = vs2[i] < rs1 (signed)"""
+        vector_compare(processor, vd, rs1, vs2, vm, funct3, np.less)
+
+    @staticmethod
+    def exec_vmsltu(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VMSLTU: vd.mask[i] = vs2[i] < rs1 (unsigned)"""
+        vector_compare(processor, vd, rs1, vs2, vm, funct3, np.less, unsigned=True)
+
+    @staticmethod
+    def exec_vmsle(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VMSLE: vd.mask[i] = vs2[i] <= rs1 (signed)"""
+        vector_compare(processor, vd, rs1, vs2, vm, funct3, np.less_equal)
+
+    @staticmethod
+    def exec_vmsleu(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VMSLEU: vd.mask[i] = vs2[i] <= rs1 (unsigned)"""
+        vector_compare(processor, vd, rs1, vs2, vm, funct3, np.less_equal, unsigned=True)
+
+    # Reductions: vd[0] = vs1[0] op reduce(vs2[active elements])
+    @staticmethod
+    def exec_vredsum(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VREDSUM: vd[0] = vs1[0] + sum(vs2), wraps at SEW"""
+        vector_reduce(processor, vd, rs1, vs2, vm, np.add)
+
+    @staticmethod
+    def exec_vredmax(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VREDMAX: vd[0] = max(vs1[0], vs2...) (signed)"""
+        vector_reduce(processor, vd, rs1, vs2, vm, np.maximum)
+
+    @staticmethod
+    def exec_vredmaxu(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VREDMAXU: vd[0] = max(vs1[0], vs2...) (unsigned)"""
+        vector_reduce(processor, vd, rs1, vs2, vm, np.maximum, unsigned=True)
+
+    @staticmethod
+    def exec_vredmin(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VREDMIN: vd[0] = min(vs1[0], vs2...) (signed)"""
+        vector_reduce(processor, vd, rs1, vs2, vm, np.minimum)
+
+    @staticmethod
+    def exec_vredminu(processor, vd, rs1, vs2, vm, funct3):
+        """Execute VREDMINU: vd[0] = min(vs1[0], vs2...) (unsigned)"""
+        vector_reduce(processor, vd, rs1, vs2, vm, np.minimum, unsigned=True)
 
 
 
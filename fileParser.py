@@ -6,12 +6,74 @@ import re
 import argparse
 from constants import *
 from cpu import *
+from cache import DEFAULT_SPEC
+from sampling import parse_sample
+
+# bump whenever the same source would assemble to different words, cached
+# objects (objcache.py) of older versions are then ignored
+ASSEMBLER_VERSION = 1
+
+# separators between operands, 'LW x1, 16(x0)' -> LW x1 16 x0
+TOKENS = re.compile(r"[,\s()]+")
+LABEL = re.compile(r"(\w+):")
+
+class Registers(dict):
+  def __missing__(self, name):
+    raise ValueError(f"unknown register '{name}'")
+
+XREG = Registers({f'{prefix}{n}': n for n in range(16) for prefix in 'xX'})
+VREG = Registers({f'{prefix}{n}': n for n in range(16) for prefix in 'vV'})
+
+# assembler format of every scalar opcode, Parser.parse_<format> reads its operands
+FORMATS = {
+  opCodes['ALU_REG']: 'r',
+  opCodes['ALU_IMM']: 'i',
+  opCodes['LOAD']: 'load',
+  opCodes['JALR']: 'load',
+  opCodes['STORE']: 's',
+  opCodes['BRANCH']: 'b',
+  opCodes['LUI']: 'u',
+  opCodes['AUIPC']: 'u',
+  opCodes['JAL']: 'j',
+  opCodes['AMO']: 'amo',
+  opCodes['SYSTEM']: 'system',
+}
+# words that encode an offset from their own pc
+PC_RELATIVE = (opCodes['BRANCH'], opCodes['JAL'])
+VECTOR_FORMATS = {
+  'LV': 'vmem', 'SV': 'vmem',
+  'VLSE': 'vstride', 'VSSE': 'vstride', 'VLUXEI': 'vstride', 'VSUXEI': 'vstride',
+  'VSETVLI': 'vsetvli', 'VSETIVLI': 'vsetivli', 'VSETVL': 'vsetvl',
+}
+
+def instruction_format(mnemonic, info):
+  if mnemonic in VECTOR_FORMATS:
+    return VECTOR_FORMATS[mnemonic]
+  if info['opcode'] == opCodes['ALU_IMM'] and 'funct7' in info:
+    return 'shift'
+  return FORMATS.get(info['opcode'], 'v')
+
+def immediate(token):
+  try:
+    return int(token, 0)
+  except ValueError:
+    return int(token)  # leading zeros, 010
+
+def signed(token, bits):
+  value = immediate(token)
+  if not -(1 << (bits - 1)) <= value < (1 << (bits - 1)):
+    raise ValueError(f"immediate {value} does not fit in {bits} bits")
+  return value
+
+def masked(args, index):
+  """vm bit: 0 with a trailing v0.t, 1 otherwise"""
+  return 0 if len(args) > index and args[index].lower() == 'v0.t' else 1
+
 class Parser():
   def __init__(self):
       self.core = ApocaCore()
       self.filename = None
       self.errors = 0 
-      self.lines = []
       self.commands = []
       self.symbols = {}
       self.debug = False
@@ -19,136 +81,375 @@ class Parser():
       self.opcode_map = instruction_map
       self.data_name= None
       self.data = []
-      self.jump_address = {}
+      self.jump_address = self.symbols
+      self.source = []
+      self.obj_cache = None  # an objcache.ObjectCache, assemble goes through it when set
+      # mnemonic -> (operand parser, instruction_map entry)
+      self.table = {mnemonic: (getattr(self, 'parse_' + instruction_format(mnemonic, info)), info)
+                    for mnemonic, info in self.opcode_map.items()}
   def arguments(self):
     parser =argparse.ArgumentParser(description='parser for the assembly of the custom processor')
-    parser.add_argument('-f',required=True,help='Input file')
+    parser.add_argument('-f',required=False,help='Input file')
     parser.add_argument('-r',required=False,help='Run mode')
     parser.add_argument('-d',required=False,help='debug')
+    parser.add_argument('-e',required=False,default='interp',choices=['interp','block'],help='execution engine')
+    parser.add_argument('-m',required=False,type=lambda v: int(v,0),default=1024,help='memory size in bytes')
+    parser.add_argument('--paged',action='store_true',help='sparse memory, pages mapped on first touch')
+    parser.add_argument('--vlen',required=False,type=int,default=256,help='vector register length in bits (up to 4096)')
+    parser.add_argument('--harts',required=False,type=int,default=1,help='harts sharing the memory, each starts with its hart id in x10')
+    parser.add_argument('--quantum',required=False,type=int,default=1000,help='instructions a hart runs before the next one gets a turn')
+    parser.add_argument('--ensemble',required=False,type=int,default=0,help='run this many copies of the program in lockstep, copy i starts with i in x10 (see ensemble.py)')
+    parser.add_argument('--hart-processes',required=False,type=int,default=0,help='run the harts in this many processes over shared memory (SC across processes only compares values, see harts.py)')
+    parser.add_argument('--devices',action='store_true',help='map a timer, a UART and a DMA engine (see devices.py)')
+    parser.add_argument('--uart-out',required=False,default='-',help='host file the UART writes to, - for stdout')
+    parser.add_argument('--uart-in',required=False,default=None,help='host file the UART reads from, - for stdin')
+    parser.add_argument('--dma-file',required=False,default=None,help='host file DMA commands 2 and 3 read and write')
+    parser.add_argument('--device-slice',required=False,type=int,default=1000,help='instructions between timer updates with --devices')
+    parser.add_argument('--checkpoint-every',required=False,type=int,default=None,help='write a checkpoint every N instructions, full first then incremental')
+    parser.add_argument('--checkpoint-prefix',required=False,default='checkpoint',help='checkpoint files are PREFIX.0000.snap, PREFIX.0001.snap, ...')
+    parser.add_argument('--checkpoint-compress',action='store_true',help='zlib compress the pages in checkpoints')
+    parser.add_argument('--restore',required=False,nargs='+',default=None,help='start from a full checkpoint and its increments instead of instruction zero')
+    parser.add_argument('--batch',required=False,help='directory or glob of .apo files to run in parallel')
+    parser.add_argument('-j',required=False,type=int,default=None,help='batch worker processes (default: all cores)')
+    parser.add_argument('--max-instructions',required=False,type=int,default=10000000,help='per program instruction budget in batch mode')
+    parser.add_argument('--timeout',required=False,type=float,default=10.0,help='per program wall time limit in seconds in batch mode')
+    parser.add_argument('--obj-cache',required=False,default='.apocache',help='directory of cached assembled objects')
+    parser.add_argument('--no-obj-cache',action='store_true',help='always assemble from source')
+    parser.add_argument('--profile',action='store_true',help='count executions per pc and mnemonic, print the hot spots')
+    parser.add_argument('--profile-out',required=False,help='write the profile report as JSON to this file')
+    parser.add_argument('--top',required=False,type=int,default=10,help='rows in the hot spot tables')
+    parser.add_argument('--trace',required=False,help='write a binary execution trace to this file')
+    parser.add_argument('--trace-compress',action='store_true',help='zlib compress the trace chunk by chunk')
+    parser.add_argument('--cache',nargs='?',const=DEFAULT_SPEC,default=None,
+                        help=f'model caches, e.g. {DEFAULT_SPEC} (size:assoc:line[:lru|fifo|random[:wb|wt[:hit time]]])')
+    parser.add_argument('--pipeline',action='store_true',help='time the run on a 5-stage in-order pipeline')
+    parser.add_argument('--forwarding',required=False,default='full',choices=['full','mem','none'],help='pipeline forwarding paths')
+    parser.add_argument('--branch-stage',required=False,default='ex',choices=['ex','id'],help='pipeline stage branches resolve in')
+    parser.add_argument('--predictor',required=False,default=None,
+                        choices=['static-taken','static-not-taken','btfn','bimodal','gshare','tournament'],
+                        help='model branch prediction (feeds the pipeline model when --pipeline is on)')
+    parser.add_argument('--predictor-bits',required=False,type=int,default=10,help='log2 of the predictor table size')
+    parser.add_argument('--history',required=False,type=int,default=8,help='global history bits for gshare / tournament')
+    parser.add_argument('--btb',required=False,type=int,default=64,help='branch target buffer entries')
+    parser.add_argument('--ooo',action='store_true',help='time the run on an out-of-order superscalar model')
+    parser.add_argument('--width',required=False,type=int,default=4,help='out-of-order fetch/issue/commit width')
+    parser.add_argument('--rob',required=False,type=int,default=64,help='reorder buffer entries')
+    parser.add_argument('--rs',required=False,type=int,default=32,help='reservation station entries')
+    parser.add_argument('--units',required=False,default=None,help='functional units as name=count:latency, e.g. alu=4:1,lsu=2:3,valu=1:2,vmul=1:6')
+    parser.add_argument('--ilp',action='store_true',help='dataflow limit: critical path, ideal IPC, ILP per window')
+    parser.add_argument('--sample',nargs='?',const='1000000:10000:10000',default=None,
+                        help='run --cache or --pipeline/--ooo only on samples, FF:WARM:MEASURE instructions (default 1000000:10000:10000)')
+    parser.add_argument('--simpoints',required=False,type=int,default=None,help='with --sample, measure up to K representative intervals picked from basic block vectors')
+    parser.add_argument('--confidence',required=False,type=float,default=0.95,help='confidence level of the sampled estimates')
+    parser.add_argument('--windows',required=False,default='16,64,256,1024',help='window sizes for the ILP histograms')
     args = parser.parse_args()
+    if args.f is None and args.batch is None:
+      parser.error('one of -f or --batch is required')
+    # these all watch ApocaCore.run and can be combined, harts run without them
+    observers = [args.profile or args.profile_out, args.trace, args.cache,
+                 args.pipeline or args.ooo or args.ilp or args.predictor]
+    if args.harts > 1 and (any(observers) or args.d == 'debug'):
+      parser.error('--harts runs plain harts, no --profile, --trace, --cache, timing models or -d debug')
+    if args.harts > 1 and args.devices:
+      parser.error('--devices needs a single hart')
+    if args.checkpoint_every is not None and (args.devices or args.harts > 1):
+      parser.error('--checkpoint-every cannot be combined with --devices or --harts')
+    if args.restore and args.harts > 1:
+      parser.error('--restore needs a single hart')
+    if args.ensemble and (args.harts > 1 or any(observers) or args.d == 'debug' or args.devices or args.paged
+                          or args.checkpoint_every is not None or args.restore or args.sample is not None or args.simpoints is not None):
+      parser.error('--ensemble runs plain copies over flat memory, no --harts, observers, --devices, --paged, checkpoints or --sample')
+    if args.simpoints is not None and args.sample is None:
+      args.sample = '1000000:10000:10000'
+    if args.sample is not None:
+      try:
+        args.sample = parse_sample(args.sample)
+      except ValueError as e:
+        parser.error(str(e))
+      if not (args.cache or args.pipeline or args.ooo):
+        parser.error('--sample needs a detailed model: --cache, --pipeline or --ooo')
+      if args.harts > 1 or args.devices or args.checkpoint_every is not None or args.d == 'debug':
+        parser.error('--sample cannot be combined with --harts, --devices, --checkpoint-every or -d debug')
+      if args.simpoints is not None and args.simpoints < 1:
+        parser.error('--simpoints needs at least one cluster')
+      if not 0 < args.confidence < 1:
+        parser.error('--confidence is a level between 0 and 1, e.g. 0.95')
+    if args.harts < 1:
+      parser.error('--harts needs at least one hart')
     self.run =args.r
     self.debug =args.d
+    self.engine =args.e
+    self.memory_size =args.m
+    self.paged =args.paged
+    self.vlen =args.vlen
+    self.harts =args.harts
+    self.quantum =args.quantum
+    self.hart_processes =args.hart_processes
+    self.ensemble =args.ensemble
+    self.devices =args.devices
+    self.uart_out =args.uart_out
+    self.uart_in =args.uart_in
+    self.dma_file =args.dma_file
+    self.device_slice =args.device_slice
+    self.checkpoint_every =args.checkpoint_every
+    self.checkpoint_prefix =args.checkpoint_prefix
+    self.checkpoint_compress =args.checkpoint_compress
+    self.restore =args.restore
+    self.batch =args.batch
+    self.jobs =args.j
+    self.max_instructions =args.max_instructions
+    self.timeout =args.timeout
+    self.obj_cache_dir =None if args.no_obj_cache else args.obj_cache
+    self.profile =args.profile or args.profile_out is not None
+    self.profile_out =args.profile_out
+    self.top =args.top
+    self.trace =args.trace
+    self.trace_compress =args.trace_compress
+    self.cache =args.cache
+    self.pipeline =args.pipeline
+    self.forwarding =args.forwarding
+    self.branch_stage =args.branch_stage
+    self.predictor =args.predictor
+    self.predictor_bits =args.predictor_bits
+    self.history =args.history
+    self.btb =args.btb
+    self.ooo =args.ooo
+    self.width =args.width
+    self.rob =args.rob
+    self.rs =args.rs
+    self.units =args.units
+    self.ilp =args.ilp
+    self.windows =[int(size) for size in args.windows.split(',')]
+    self.sample =args.sample
+    self.simpoints =args.simpoints
+    self.confidence =args.confidence
     return args.f
-  def load(self, filename):
-    self.filename = filename
-    with open(filename , 'r') as f:
-      self.lines = [line.strip() for line in f if line.strip() and not line.startswith('#')]
-    if self.debug=='debug':
-      print(f"loaded {len(self.lines)} lines from {filename}")
-  
-  def first_pass(self):
-    pc=0
-    i=0
-    for line in self.lines:
-      i=i+1
-      section =re.match(r"data:",line)
-      m = re.match(r"^(\w+):",line)
-      if section:
-        section = m.group(1)
-        self.parse_data(line, int(i))
-      if m:
-        label =m.group(1)
-        self.symbols[label] = pc
-        self.jump_address[label] = pc
-        if self.debug=='debug':
-          print(f"label {label} at adress {pc}")
-      else:
-        pc+=4
-  def second_pass(self):
-    pc = 0
-    for line in self.lines:
-      if re.match(r"^\w+:",line):
-        continue
-      word = self.parse_line(line,pc)
-      self.commands.append(word)
-      pc+=4
-
-  def parse_data(self, line, i):
-    parts = [tok for tok in re.split(r"[,\s()]+", line) if tok]
-    self.data_name= parts[0]
-    self.data = parts[1:]
-    self.data.pop(0)
+  def statements(self, f):
+    """(line number, text) of every line with something on it, comments dropped"""
+    for number, line in enumerate(f, 1):
+      if '#' in line:
+        line = line[:line.index('#')]
+      line = line.strip()
+      if line:
+        yield number, line
+
+  def read(self, f):
+    """
+    one pass over the source: labels are defined as they come, instructions
+    encoded straight away. A branch or jump to a label further down gets a
+    placeholder word and is encoded again once every label is known.
+    """
+    debug = self.debug == 'debug'
+    commands, source, symbols = self.commands, self.source, self.symbols
+    fixups = []
+    encoded = {}  # unrolled code repeats itself, line -> word unless it depends on the pc
+    for number, line in self.statements(f):
+      pc = len(commands) * 4
+      if ':' in line:
+        m = LABEL.match(line)
+        if m:
+          label = m.group(1)
+          symbols[label] = pc
+          if debug:
+            print(f"label {label} at adress {pc}")
+          if label == 'data':
+            self.parse_data(line)
+            continue
+          line = line[m.end():].lstrip()
+          if not line:
+            continue
+      word = encoded.get(line)
+      if word is None:
+        try:
+          word = self.parse_line(line, pc)
+        except (ValueError, IndexError) as error:
+          raise ValueError(f"{self.filename}:{number}: {line}: {error}") from None
+        if word is None:
+          fixups.append((len(commands), number, line))
+          word = 0
+        elif word & 0x7F not in PC_RELATIVE:
+          encoded[line] = word
+      commands.append(word)
+      source.append((number, line))  # source line of every instruction word
+    for index, number, line in fixups:
+      word = self.parse_line(line, index * 4)
+      if word is None:
+        raise ValueError(f"{self.filename}:{number}: {line}: undefined label")
+      commands[index] = word
+    if debug:
+      print(f"assembled {len(commands)} words from {self.filename}")
+
+  def parse_data(self, line):
+    # data: name v1 v2 ...
+    parts = [tok for tok in TOKENS.split(line) if tok]
+    self.data_name= parts[1]
+    self.data = parts[2:]
     self.var_dict.append(self.data)
 
+  def parse_line(self, line, pc):
+    """encode one instruction at byte address pc, None while a label it needs is still undefined"""
+    parts = TOKENS.split(line)
+    if not parts[-1]:
+      parts.pop()  # after a closing parenthesis
+    mnemonic = parts[0].upper()
+    entry = self.table.get(mnemonic)
+    if entry is None:
+      raise ValueError(f"Unknown instruction '{mnemonic}' at PC {pc}")
+    if self.debug=='debug':
+      print(f"[MNEMONIC]:{mnemonic} [PARTS]:{parts[1:]}")
+    parse, info = entry
+    return parse(info, parts[1:], pc)
 
+  # operands of each format, 'ADDI x1, x0, 5' arrives as ['x1', 'x0', '5']
+  # and 'LW x1, 16(x0)' as ['x1', '16', 'x0']
+  def parse_r(self, info, args, pc):
+    rd, rs1, rs2 = args
+    return self.encode_r_type(XREG[rd], XREG[rs1], XREG[rs2], info['funct3'], info['funct7'], info['opcode'])
 
+  def parse_i(self, info, args, pc):
+    rd, rs1, imm = args
+    return self.encode_i_type(XREG[rd], XREG[rs1], signed(imm, 12), info['funct3'], info['opcode'])
 
-  def parse_line(self, line, pc):
-        # split tokens, filter empties
-        parts = [tok for tok in re.split(r"[,\s()]+", line) if tok]
-        mnemonic = parts[0].upper()
-        args = parts[1:]
-
-        info = self.opcode_map.get(mnemonic)
-        if not info:
-            raise ValueError(f"Unknown instruction '{mnemonic}' at PC {pc}")
-        if self.debug=='debug':
-           print(f"[MNEMONIC]:{mnemonic} [PARTS]:{args}")
-        # I-type: ADDI, LW, add more later, vectors probably
-        if mnemonic == 'ADDI' or mnemonic == 'LW':
-            rd = args[0]
-            # offset(base)
-            if mnemonic == 'LW':
-                # args: rd, offset, base
-                offset, base = args[1], args[2]
-            else:
-                # ADDI args: rd, rs, imm
-                base = args[1]; offset = args[2]
-            return self.encode_i_type(int(rd[1:]), int(base[1:]), int(offset), info['funct3'], info['opcode'])
-
-        # R-type: ADD, need to add more later
-        if mnemonic == 'ADD':
-            rd, rs1, rs2 = args
-            return self.encode_r_type(int(rd[1:]), int(rs1[1:]), int(rs2[1:]), info['funct3'], info['funct7'], info['opcode'])
-
-        # S-type: SW
-        if mnemonic == 'SW':
-            rs2 = args[0]
-            offset = args[1]
-            rs1 = args[2]
-            return self.encode_s_type(int(rs2[1:]), int(rs1[1:]), int(offset), info['funct3'], info['opcode'])
-        
-                # Vector instructions: LV, SV, itd
-        if mnemonic == 'LV' or mnemonic == 'SV':
-                # LV v1, 512(x0) -> args = ['v1', '512', 'x0']
-                vs3 = args[0]
-                offset = args[1]
-                rs1 = args[2]
-
-                vs3_num = int(vs3[1:])  # v1 -> 1
-                rs1_num = int(rs1[1:])  # x0 -> 0
-                imm = int(offset)       # 512 -> 512
-                
-
-                # Use I-type encoding for vector load/store
-                return self.encode_i_type(vs3_num, rs1_num, imm, info['funct3'], info['opcode'])
-        if mnemonic =='VADD':
-           rd = args[0]
-           rs1 = args[1]
-           rs2 = args[2]
-           rd_num = int(rd[1:])
-           rs1_num = int(rs1[1:])
-           rs2_num = int(rs2[1:])
-           encoded = self.encode_v_type(info['funct6'], 1, rs2_num, rs1_num, info['funct3'], rd_num, info['opcode'])
-           return encoded
-        if mnemonic =='BEQ':
-           rs1=args[0]
-           rs2=args[1]
-           rs1_num = int(rs1[1:])
-           rs2_num = int(rs2[1:])
-           label=args[2]
-           target=self.jump_address[label]
-           offset=target-pc
-           imm = (offset >> 1) & 0xFFF  # 12-bit immediate
-           encoded = self.encode_b_type(imm,rs1_num,rs2_num,info['funct3'],info['opcode'])
-           return encoded
-
-
-
-        raise NotImplementedError(f"Encoding for '{mnemonic}' not implemented at PC {pc}")
+  def parse_shift(self, info, args, pc):
+    rd, rs1, shamt = args
+    shamt = immediate(shamt)
+    if not 0 <= shamt < 32:
+      raise ValueError(f"shift amount {shamt} out of range")
+    return self.encode_i_type(XREG[rd], XREG[rs1], (info['funct7'] << 5) | shamt, info['funct3'], info['opcode'])
+
+  def parse_load(self, info, args, pc):
+    # LW rd, imm(rs1); JALR also takes rd, rs1, imm and rd, rs1
+    if len(args) == 2:
+      rd, rs1, imm = args[0], args[1], '0'
+    elif args[1] in XREG:
+      rd, rs1, imm = args
+    else:
+      rd, imm, rs1 = args
+    return self.encode_i_type(XREG[rd], XREG[rs1], signed(imm, 12), info['funct3'], info['opcode'])
+
+  def parse_s(self, info, args, pc):
+    rs2, imm, rs1 = args
+    return self.encode_s_type(XREG[rs2], XREG[rs1], signed(imm, 12), info['funct3'], info['opcode'])
+
+  def parse_amo(self, info, args, pc):
+    # LR.W rd, (rs1) / SC.W rd, rs2, (rs1) / AMOADD.W rd, rs2, (rs1), a 0( ) offset is allowed
+    if len(args) >= 3 and args[-2] not in XREG:
+      if immediate(args[-2]) != 0:
+        raise ValueError("atomics take no offset")
+      del args[-2]
+    if len(args) == 2:
+      rd, rs1, rs2 = args[0], args[1], 'x0'
+    else:
+      rd, rs2, rs1 = args
+    return self.encode_r_type(XREG[rd], XREG[rs1], XREG[rs2], info['funct3'], info['funct5'] << 2, info['opcode'])
+
+  def parse_system(self, info, args, pc):
+    if args:
+      raise ValueError("ECALL / EBREAK take no operands")
+    return self.encode_i_type(0, 0, info['funct12'], info['funct3'], info['opcode'])
+
+  def parse_b(self, info, args, pc):
+    # BEQ rs1, rs2, label / BEQI rs1, simm5, label, the target may also be a byte offset
+    rs1, rs2, target = args
+    offset = self.offset(target, pc)
+    if offset is None:
+      return None
+    if info['funct3'] == funct3_codes['BEQI']:
+      rs2 = signed(rs2, 5) & 0x1F
+    else:
+      rs2 = XREG[rs2]
+    if not -0x1000 <= offset < 0x1000:
+      raise ValueError(f"branch target {target} is {offset} bytes away, out of range")
+    return self.encode_b_type((offset >> 1) & 0xFFF, XREG[rs1], rs2, info['funct3'], info['opcode'])
+
+  def parse_u(self, info, args, pc):
+    rd, imm = args
+    imm = immediate(imm)
+    if not -0x80000 <= imm < 0x100000:
+      raise ValueError(f"immediate {imm} does not fit in 20 bits")
+    return self.encode_u_type(XREG[rd], imm & 0xFFFFF, info['opcode'])
+
+  def parse_j(self, info, args, pc):
+    # JAL rd, label, or JAL label linking through x1
+    rd, target = args if len(args) == 2 else ('x1', args[0])
+    offset = self.offset(target, pc)
+    if offset is None:
+      return None
+    if not -0x100000 <= offset < 0x100000:
+      raise ValueError(f"jump target {target} is {offset} bytes away, out of range")
+    return self.encode_j_type(XREG[rd], (offset >> 1) & 0xFFFFF, info['opcode'])
+
+  def parse_vmem(self, info, args, pc):
+    # LV v1, 512(x0) -> args = ['v1', '512', 'x0'], I-type encoding
+    vd, imm, rs1 = args
+    return self.encode_i_type(VREG[vd], XREG[rs1], signed(imm, 12), info['funct3'], info['opcode'])
+
+  def parse_vstride(self, info, args, pc):
+    # strided / indexed: VLSE v1, (x5), x6 / VLUXEI v1, (x5), v2, with an optional v0.t
+    vd, rs1, rs2 = args[:3]
+    rs2 = VREG[rs2] if info['funct3'] == vector_mop['INDEXED'] else XREG[rs2]
+    return self.encode_v_type(0, masked(args, 3), XREG[rs1], rs2, info['funct3'], VREG[vd], info['opcode'])
+
+  # VSETVLI rd, rs1, e32, m2 / VSETIVLI rd, 8, e16, mf2 / VSETVL rd, rs1, rs2
+  def parse_vsetvli(self, info, args, pc):
+    vtypei = self.encode_vtype(args[2:])
+    return (vtypei << 20) | (XREG[args[1]] << 15) | (info['funct3'] << 12) | (XREG[args[0]] << 7) | info['opcode']
+
+  def parse_vsetivli(self, info, args, pc):
+    vtypei = self.encode_vtype(args[2:])
+    uimm = immediate(args[1]) & 0x1F
+    return (0b11 << 30) | (vtypei << 20) | (uimm << 15) | (info['funct3'] << 12) | (XREG[args[0]] << 7) | info['opcode']
+
+  def parse_vsetvl(self, info, args, pc):
+    rd, rs1, rs2 = args
+    return (0b1000000 << 25) | self.encode_r_type(XREG[rd], XREG[rs1], XREG[rs2], info['funct3'], 0, info['opcode'])
+
+  def parse_v(self, info, args, pc):
+    # VADD vd, vs2, vs1 / VADD.VX vd, vs2, x1 / VADD.VI vd, vs2, imm
+    # with an optional trailing v0.t to mask by v0
+    vd, vs2, src = args[:3]
+    funct3 = info['funct3']
+    if funct3 == vector_funct3['OPIVI']:
+      src = immediate(src) & 0x1F
+    elif funct3 == vector_funct3['OPIVX'] or funct3 == vector_funct3['OPMVX']:
+      src = XREG[src]
+    else:
+      src = VREG[src]
+    return self.encode_v_type(info['funct6'], masked(args, 3), src, VREG[vs2], funct3, VREG[vd], info['opcode'])
+
+  def offset(self, target, pc):
+    """byte offset from pc to a label or a literal offset, None for a label not seen yet"""
+    address = self.symbols.get(target)
+    if address is not None:
+      return address - pc
+    if target[0].isdigit() or target[0] in '+-':
+      return immediate(target)
+    return None
+
+  def encode_vtype(self, fields):
+     # e8/e16/e32/e64, m1/m2/m4/m8/mf2/mf4/mf8, ta/tu, ma/mu in any order
+     sew, lmul, ta, ma = 32, 1, 0, 0
+     for field in fields:
+        field = field.lower()
+        if field.startswith('mf'):
+           lmul = 1 / int(field[2:])
+        elif field.startswith('m') and field[1:].isdigit():
+           lmul = int(field[1:])
+        elif field.startswith('e'):
+           sew = int(field[1:])
+        elif field in ('ta', 'ma'):
+           ta, ma = (1, ma) if field == 'ta' else (ta, 1)
+     return (ma << 7) | (ta << 6) | (vsew_codes[sew] << 3) | vlmul_codes[lmul]
   def encode_b_type(self,imm,rs1,rs2,funct3,opcode):
-     encoded = imm<<20|rs1<<15|rs2<<10|funct3<<7|opcode
+     # [imm[12:1]][rs2][rs1][funct3][opcode], the fields cpu.decode reads
+     encoded = imm<<20|rs2<<15|rs1<<10|funct3<<7|opcode
      return encoded
+  def encode_u_type(self, rd, imm, opcode):
+      # [imm[31:12]][rd][opcode]
+      return (imm << 12) | (rd << 7) | opcode
+  def encode_j_type(self, rd, imm, opcode):
+      # [offset[20:1]][rd][opcode]
+      return (imm << 12) | (rd << 7) | opcode
   def encode_r_type(self, rd, rs1, rs2, funct3, funct7, opcode):
       # [funct7][rs2][rs1][funct3][rd][opcode]
       return (funct7 << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12) | (rd << 7) | opcode
@@ -170,9 +471,11 @@ class Parser():
 
 
   def assemble(self, filename):
-      self.load(filename)
-      self.first_pass()
-      self.second_pass()
+      if self.obj_cache is not None:
+        return self.obj_cache.assemble(self, filename)
+      self.filename = filename
+      with open(filename, 'r') as f:
+        self.read(f)
       return self.commands, self.var_dict
 
   def parse(self, filename):
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# harts.py
+"""
+Multi-hart systems.
+A System is N harts (each an ApocaCore with its own registers, pc and
+vector state) over one memory. Harts start at the same entry with their
+hart id in x10 (a0) and are interleaved round robin, quantum instructions
+at a time. Every hart runs its turn on the ordinary fast path; the only
+extra work is the turn itself, so a bigger quantum costs less and a
+smaller one interleaves finer.
+
+With processes=P the memory lives in a multiprocessing.shared_memory block
+and the harts are dealt out over P worker processes that each run their
+share with the same scheduler, so throughput grows with host cores. AMOs
+and SC take one lock shared by all workers; plain loads and stores go
+straight to the shared block like they would on real hardware. A store
+into the program only invalidates the predecoded code of the harts in the
+same process, so self-modifying programs need processes=0.
+
+An LR reservation is lost when another hart stores to the reserved word.
+In one process the harts that run while someone else holds a reservation
+go through the interpreter with a ReservationWatch, which sees every
+store, SC and AMO they make. With processes=P a worker only watches its
+own harts: against a hart in another process SC just checks that the
+word still holds the value LR read, so a store that writes the same
+value back (ABA) goes unnoticed. Lock free code that relies on that
+needs processes=0.
+"""
+import gc
+import queue
+import multiprocessing
+import numpy as np
+from multiprocessing.shared_memory import SharedMemory
+from cpu import ApocaCore
+from exec import vector_length
+from memory import Memory, PagedMemory
+from timing import ATOMIC_WRITES
+
+DEFAULT_QUANTUM = 1000
+HARTID_REGISTER = 10  # a0, like a boot loader hands it over
+POLL = 0.5  # seconds between looks at the worker processes while waiting on their results
+
+
+class Hart(ApocaCore):
+    """one hardware thread of a System, sharing the system's memory"""
+    def __init__(self, hartid, system, **options):
+        super().__init__(memory=system.memory, **options)
+        self.hartid = hartid
+        self.system = system
+        self.registers[HARTID_REGISTER] = hartid
+
+    def invalidate_code(self, address, size=1):
+        # every hart predecodes the same words
+        for hart in self.system.harts:
+            ApocaCore.invalidate_code(hart, address, size)
+
+
+# plain stores by access size
+WORD_STORES = {'exec_sw': 4, 'exec_sh': 2, 'exec_sb': 1}
+
+
+class ReservationWatch:
+    """
+    observer for harts that run while another hart holds a reservation,
+    clears every reservation a store of theirs lands on
+    """
+    def __init__(self, harts):
+        self.harts = harts
+
+    def before(self, pc, op):
+        name = op.func.__name__
+        hart, args = op.args[0], op.args[1:]
+        if name in WORD_STORES:
+            address, size = hart.registers[args[1]] + args[3], WORD_STORES[name]
+        elif name in ATOMIC_WRITES:
+            address, size = hart.registers[args[1]], 4
+        elif name == 'exec_vs':
+            address, size = hart.registers[args[1]] + args[2], vector_length(hart) * hart.vreg.itemsize
+        elif name in ('exec_vsse', 'exec_vsuxei'):
+            address, size = 0, 1 << 64  # anywhere, drop them all
+        else:
+            return
+        for other in self.harts:
+            reservation = other.reservation
+            if other is not hart and reservation is not None \
+                    and address < reservation[0] + 4 and reservation[0] < address + size:
+                other.reservation = None
+
+
+def hart_state(hart):
+    """what a worker process hands back for a hart: registers, pc, counters and vector state"""
+    return {'hartid': hart.hartid, 'registers': list(hart.registers), 'pc': hart.pc,
+            'instret': hart.instret, 'vl': hart.vl, 'vtype': (hart.vtype['SEW'], hart.vtype['LMUL']),
+            'vrf': hart.vrf.tobytes()}
+
+
+def restore_hart(hart, state):
+    hart.registers[:] = state['registers']
+    hart.pc = state['pc']
+    hart.instret = state['instret']
+    hart.vrf[:] = np.frombuffer(state['vrf'], dtype=np.uint8)
+    hart.set_vtype(*state['vtype'])
+    hart.vl = state['vl']
+
+
+class System:
+    """
+    harts harts over one memory of memory_size bytes (paged like ApocaCore),
+    switched every quantum instructions. vlen and engine go to every hart.
+    processes > 0 runs the harts in that many worker processes over shared
+    memory, which needs flat memory.
+    """
+    def __init__(self, harts=1, quantum=DEFAULT_QUANTUM, memory_size=1024, paged=False,
+                 vlen=256, engine='interp', processes=0, memory=None):
+        if quantum < 1:
+            raise ValueError(f"quantum has to be at least 1 instruction, got {quantum}")
+        if processes and paged:
+            raise ValueError("harts in separate processes need flat memory, not --paged")
+        self.quantum = quantum
+        self.processes = processes
+        self.options = {'vlen': vlen, 'engine': engine}
+        self.shared = None
+        if memory is None and processes:
+            self.shared = SharedMemory(create=True, size=memory_size)
+            memory = Memory(memory_size, self.shared.buf)
+        elif memory is None:
+            memory = PagedMemory(memory_size) if paged else Memory(memory_size)
+        self.memory = memory
+        self.harts = []
+        for hartid in range(harts):
+            self.add_hart(hartid)
+        self.switches = 0
+
+    def add_hart(self, hartid):
+        hart = Hart(hartid, self, **self.options)
+        self.harts.append(hart)
+        return hart
+
+    def load_program(self, program, data=()):
+        """load an assembled program through hart 0, everyone starts at 0"""
+        boot = self.harts[0]
+        boot.load_memory(data)
+        boot.load_program(program)
+        self.boot(boot.code_end, 0)
+
+    def load_elf(self, elf):
+        boot = self.harts[0]
+        elf.load(boot)
+        self.boot(boot.code_end, boot.pc)
+
+    def boot(self, code_end, pc):
+        for hart in self.harts:
+            hart.set_code_end(code_end)
+            hart.pc = pc
+
+    @property
+    def instret(self):
+        return sum(hart.instret for hart in self.harts)
+
+    def run(self, max_instructions=None):
+        """
+        run until every hart has left the program, or has retired
+        max_instructions of its own
+        """
+        if self.processes:
+            return self.run_processes(max_instructions)
+        quantum = self.quantum
+        watch = ReservationWatch(self.harts)
+        live = [hart for hart in self.harts if hart.pc < hart.program_length]
+        while live:
+            for hart in live:
+                # someone else's LR is waiting for its SC, watch our stores
+                watched = any(other.reservation is not None for other in live if other is not hart)
+                if watched:
+                    hart.observe(watch)
+                if max_instructions is None:
+                    hart.run(quantum)
+                else:
+                    hart.run(min(quantum, max_instructions - hart.instret))
+                if watched:
+                    hart.unobserve(watch)
+                self.switches += 1
+            live = [hart for hart in live if hart.pc < hart.program_length
+                    and (max_instructions is None or hart.instret < max_instructions)]
+
+    def run_processes(self, max_instructions=None):
+        """deal the harts out over the worker processes, wait for all of them and take their state back"""
+        lock = multiprocessing.Lock()
+        results = multiprocessing.Queue()
+        workers = []
+        for worker in range(min(self.processes, len(self.harts))):
+            states = [hart_state(hart) for hart in self.harts[worker::self.processes]]
+            process = multiprocessing.Process(
+                target=run_worker, args=(worker, self.shared.name, self.memory.size, self.harts[0].code_end, states,
+                                         self.options, self.quantum, max_instructions, lock, results))
+            process.start()
+            workers.append(process)
+        harts = {hart.hartid: hart for hart in self.harts}
+        pending = dict(enumerate(workers))
+        gone = set()  # pending workers that had already exited at the last timeout
+        while pending:
+            try:
+                worker, error, switches, states = results.get(timeout=POLL)
+            except queue.Empty:
+                # a worker killed or crashed outside Python never reports, give
+                # its result one more poll to come through the pipe, then stop
+                exited = {worker for worker, process in pending.items() if process.exitcode is not None}
+                lost = exited & gone
+                if lost:
+                    worker = min(lost)
+                    for process in workers:
+                        process.terminate()
+                    raise RuntimeError(f"hart worker {worker} exited with code {pending[worker].exitcode} "
+                                       f"without reporting back")
+                gone = exited
+                continue
+            del pending[worker]
+            if error is not None:
+                for process in workers:
+                    process.terminate()
+                raise RuntimeError(f"hart worker failed: {error}")
+            self.switches += switches
+            for state in states:
+                restore_hart(harts[state['hartid']], state)
+        for process in workers:
+            process.join()
+
+    def detach(self):
+        """drop every view of the shared block and unmap it, the harts keep their registers"""
+        for hart in self.harts:
+            hart.memory = hart.translator = None
+            hart.icache.clear()
+        self.memory = None
+        gc.collect()  # the views sit in reference cycles through the cores
+        self.shared.close()
+
+    def close(self):
+        """release the shared memory block, harts can be looked at but not run afterwards"""
+        if self.shared is not None:
+            self.detach()
+            self.shared.unlink()
+            self.shared = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run_worker(worker, name, size, code_end, states, options, quantum, max_instructions, lock, results):
+    """worker process: attach to the shared memory, rebuild its harts and run them"""
+    try:
+        shared = SharedMemory(name=name)
+        system = System(0, quantum, memory=Memory(size, shared.buf), **options)
+        system.shared = shared
+        for state in states:
+            hart = system.add_hart(state['hartid'])
+            hart.atomic = lock
+            hart.set_code_end(code_end)
+            restore_hart(hart, state)
+        system.run(max_instructions)
+        results.put((worker, None, system.switches, [hart_state(hart) for hart in system.harts]))
+        system.detach()
+    except Exception as e:
+        results.put((worker, f'{type(e).__name__}: {e}', 0, []))
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# hostcall.py
+"""
+Host calls behind ECALL, newlib / Linux style.
+The call number is in x5 (t0, the RV32E convention since there is no a7
+with 16 registers), the arguments in x10-x13 and the result goes back in
+x10, a negative errno on failure. Numbers are the RISC-V Linux ones newlib
+and the proxy kernel use:
+
+    56 openat   57 close   62 lseek   63 read   64 write
+    93 exit     94 exit_group   214 brk   1024 open
+
+read and write move data straight between the host file and a memoryview
+of simulated memory, no per byte work and no copy on flat memory. Output,
+stdout and stderr included, sits in large host buffers until the file is
+closed, the program exits or the run ends.
+"""
+import io
+import os
+import sys
+import errno
+from memory import Memory
+from exec import signed32
+
+OUTPUT_BUFFER = 1 << 20
+AT_FDCWD = -100
+PATH_MAX = 4096
+
+# open flags of the RISC-V Linux ABI
+O_ACCMODE = 0o3
+O_CREAT = 0o100
+O_EXCL = 0o200
+O_TRUNC = 0o1000
+O_APPEND = 0o2000
+ACCESS = {0: os.O_RDONLY, 1: os.O_WRONLY, 2: os.O_RDWR}
+FLAGS = ((O_CREAT, os.O_CREAT), (O_EXCL, os.O_EXCL), (O_TRUNC, os.O_TRUNC), (O_APPEND, os.O_APPEND))
+
+SYSCALLS = {
+    56: 'openat', 57: 'close', 62: 'lseek', 63: 'read', 64: 'write',
+    93: 'exit', 94: 'exit', 214: 'brk', 1024: 'open',
+}
+
+
+def output_stream(stream):
+    """a big buffered writer over a standard stream, or the stream itself when it has no fd"""
+    try:
+        fd = stream.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return stream
+    return open(fd, 'wb', buffering=OUTPUT_BUFFER, closefd=False)
+
+
+class HostCalls:
+    """
+    File descriptor table and program break for one program (harts of a
+    System can share one). stdin / stdout / stderr default to the host's.
+    """
+    def __init__(self, stdin=None, stdout=None, stderr=None):
+        self.files = {
+            0: stdin if stdin is not None else sys.stdin.buffer,
+            1: stdout if stdout is not None else output_stream(sys.stdout),
+            2: stderr if stderr is not None else output_stream(sys.stderr),
+        }
+        self.standard = {fd: self.files[fd] for fd in (0, 1, 2)}
+        self.brk = None  # starts at the core's image_end on first use
+        self.calls = {}  # name -> count
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def attach(self, core):
+        core.host = self
+        return self
+
+    def call(self, core):
+        r = core.registers
+        name = SYSCALLS.get(r[5])
+        if name is None:
+            r[10] = -errno.ENOSYS
+            return
+        self.calls[name] = self.calls.get(name, 0) + 1
+        try:
+            result = getattr(self, 'sys_' + name)(core, r[10], r[11], r[12], r[13])
+        except OSError as e:
+            result = -(e.errno or errno.EBADF)  # errno-less ones are writes to read only files and the like
+        except (KeyError, ValueError):
+            result = -errno.EBADF
+        if result is not None:
+            r[10] = result
+
+    def string(self, core, address):
+        """NUL terminated string out of simulated memory"""
+        memory = core.memory
+        out = bytearray()
+        while len(out) < PATH_MAX:
+            chunk = bytes(memory.read_bytes(address + len(out), 256))
+            end = chunk.find(b'\0')
+            if end >= 0:
+                return (out + chunk[:end]).decode()
+            if not chunk:
+                break
+            out += chunk
+        raise OSError(errno.ENAMETOOLONG, "path runs off")
+
+    def buffer(self, core, address, count):
+        """count bytes of memory at address as a view, checked against the end of flat memory"""
+        if isinstance(core.memory, Memory) and (address < 0 or address + count > len(core.memory)):
+            raise OSError(errno.EFAULT, "buffer outside memory")
+        return core.memory.read_bytes(address, count)
+
+    def sys_open(self, core, path, flags, mode, _):
+        return self.sys_openat(core, AT_FDCWD, path, flags, mode)
+
+    def sys_openat(self, core, dirfd, path, flags, mode):
+        if flags & O_ACCMODE not in ACCESS:
+            raise OSError(errno.EINVAL, "bad access mode")
+        host = ACCESS[flags & O_ACCMODE]
+        for guest, bit in FLAGS:
+            if flags & guest:
+                host |= bit
+        name = self.string(core, path)
+        if signed32(dirfd) != AT_FDCWD and not os.path.isabs(name):
+            raise OSError(errno.ENOTSUP, "openat relative to a directory fd")
+        fd = os.open(name, host, mode or 0o644)
+        access = flags & O_ACCMODE
+        if access == 0:
+            f = open(fd, 'rb', buffering=0)  # reads go to the file directly
+        else:
+            f = open(fd, 'r+b' if access == 2 else 'ab' if flags & O_APPEND else 'wb', buffering=OUTPUT_BUFFER)
+        guest = 3
+        while guest in self.files:
+            guest += 1
+        self.files[guest] = f
+        return guest
+
+    def sys_close(self, core, fd, *_):
+        f = self.files.pop(fd)
+        if fd in self.standard and f is self.standard[fd]:
+            if fd:
+                f.flush()
+        else:
+            f.close()
+        return 0
+
+    def sys_lseek(self, core, fd, offset, whence, _):
+        f = self.files[fd]
+        if f.writable():
+            f.flush()
+        return f.seek(signed32(offset), whence)
+
+    def sys_read(self, core, fd, address, count, _):
+        f = self.files[fd]
+        if isinstance(core.memory, Memory):
+            got = f.readinto(self.buffer(core, address, count)) or 0
+        else:
+            data = f.read(count) or b''
+            core.memory.write_bytes(address, data)
+            got = len(data)
+        if got and address < core.code_end:
+            core.invalidate_code(address, got)
+        self.bytes_read += got
+        return got
+
+    def sys_write(self, core, fd, address, count, _):
+        self.files[fd].write(self.buffer(core, address, count))
+        self.bytes_written += count
+        return count
+
+    def sys_exit(self, core, code, *_):
+        self.flush()
+        core.exit_code = signed32(code)
+        core.halt()
+
+    def sys_brk(self, core, address, *_):
+        """the break only moves inside memory, a failed move returns the old one"""
+        if self.brk is None:
+            self.brk = core.image_end
+        if address and core.image_end <= address <= len(core.memory):
+            self.brk = address
+        return self.brk
+
+    def flush(self):
+        """write out everything buffered, print() output of the host first"""
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for f in self.files.values():
+            if f.writable():
+                f.flush()
+
+    def close(self):
+        self.flush()
+        for fd, f in list(self.files.items()):
+            if self.standard.get(fd) is not f:
+                f.close()
+        self.files = dict(self.standard)
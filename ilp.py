@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# ilp.py
+"""
+Dataflow limit analysis.
+Schedules the executed instruction stream with unlimited resources and
+perfect branch prediction, so the only thing holding an instruction back
+is its producers (registers, and stores to the same word for loads; SC
+and the AMOs are both). The
+length of the longest dependency chain gives the ideal IPC.
+
+Every value remembers the chain that produced it, a Link per instruction
+back to its critical producer, so the pcs on the path that really ends at
+the critical path length can be ranked. Chains fold every FOLD links into
+per pc totals, and only the last STORED_WORDS stored words are tracked (a
+load from a word stored longer ago than that does not wait for it), so
+memory stays bounded however long the run. Accesses with no address (old
+traces of vector ops) get no memory dependency.
+
+Run it live with --ilp, or over a trace written with --trace:
+    python ilp.py run.trace
+"""
+import argparse
+from functools import partial
+from collections import OrderedDict
+from timing import KIND_NAMES, LOAD, STORE, VLOAD, VSTORE, AMO, STORED_WORDS, describe
+
+DEFAULT_WINDOWS = (16, 64, 256, 1024)
+LATENCY_BOUND = 2.0  # ideal IPC below this: the kernel is one long chain
+FOLD = 256  # links a chain keeps before they are folded into totals
+
+
+class Link:
+    """one instruction on a dependency chain, parent is its critical producer"""
+    __slots__ = ('pc', 'cycles', 'parent', 'length')
+
+    def __init__(self, pc, cycles, parent, length):
+        self.pc = pc
+        self.cycles = cycles
+        self.parent = parent  # a Link, a Folded or None
+        self.length = length  # links back to the next Folded or the start
+
+
+class Folded:
+    """the start of a chain folded into cycles per pc"""
+    __slots__ = ('totals',)
+    length = 0
+
+    def __init__(self, totals):
+        self.totals = totals
+
+
+def chain_totals(node):
+    """cycles per pc along the chain ending at node"""
+    totals = {}
+    while isinstance(node, Link):
+        totals[node.pc] = totals.get(node.pc, 0) + node.cycles
+        node = node.parent
+    if node is not None:
+        for pc, cycles in node.totals.items():
+            totals[pc] = totals.get(pc, 0) + cycles
+    return totals
+
+
+def extend(pc, cycles, parent):
+    """the Link for an instruction whose critical producer is parent"""
+    if parent is not None and parent.length >= FOLD:
+        parent = Folded(chain_totals(parent))
+    return Link(pc, cycles, parent, 1 if parent is None else parent.length + 1)
+
+
+class Window:
+    """dataflow depth inside consecutive, non overlapping blocks of size instructions"""
+    def __init__(self, size):
+        self.size = size
+        self.ready = [0] * 32
+        self.tag = [-1] * 32  # which block ready[slot] was written in
+        self.stored = {}
+        self.block = 0
+        self.count = 0
+        self.depth = 0
+        self.histogram = {}  # int(ILP) -> blocks
+        self.total = 0.0
+        self.blocks = 0
+
+    def add(self, op, latency, word):
+        ready, tag, block = self.ready, self.tag, self.block
+        start = 0
+        for src in op.srcs:
+            if tag[src] == block and ready[src] > start:
+                start = ready[src]
+        if word is not None:
+            kind = op.kind
+            if kind == LOAD or kind == VLOAD or kind == AMO:
+                start = max(start, self.stored.get(word, 0))
+        done = start + latency
+        if op.dst is not None:
+            ready[op.dst] = done
+            tag[op.dst] = block
+        if word is not None and (op.kind == STORE or op.kind == VSTORE or op.kind == AMO):
+            self.stored[word] = done
+        if done > self.depth:
+            self.depth = done
+        self.count += 1
+        if self.count == self.size:
+            self.close()
+
+    def close(self):
+        if not self.count:
+            return
+        ilp = self.count / self.depth
+        self.histogram[int(ilp)] = self.histogram.get(int(ilp), 0) + 1
+        self.total += ilp
+        self.blocks += 1
+        self.block += 1
+        self.count = 0
+        self.depth = 0
+        self.stored.clear()
+
+    def report(self):
+        """the closed blocks plus the one still filling, which stays open"""
+        histogram, total, blocks = dict(self.histogram), self.total, self.blocks
+        if self.count:
+            ilp = self.count / self.depth
+            histogram[int(ilp)] = histogram.get(int(ilp), 0) + 1
+            total += ilp
+            blocks += 1
+        return {'blocks': blocks, 'mean_ilp': total / blocks if blocks else 0.0,
+                'histogram': dict(sorted(histogram.items()))}
+
+
+class ILPAnalyzer:
+    """
+    Timing model for timing.Retirement (or fed from a trace by
+    analyze_trace). latencies maps instruction kind names ('alu', 'load',
+    'valu', ...) to cycles, everything not given takes 1.
+    """
+    def __init__(self, windows=DEFAULT_WINDOWS, latencies=None):
+        self.latency = [1] * len(KIND_NAMES)
+        for name, cycles in (latencies or {}).items():
+            self.latency[KIND_NAMES.index(name)] = cycles
+        self.ready = [0] * 32  # register slot -> cycle its value is there
+        self.chain = [None] * 32  # register slot -> Link of the instruction that produced it
+        self.stored = OrderedDict()  # word address -> (cycle the last store to it is done, its Link)
+        self.depth = 0  # longest chain so far
+        self.tail = None  # Link of the instruction that ends it
+        self.instructions = 0
+        self.windows = [Window(size) for size in windows]
+
+    def retire(self, pc, op, next_pc, address):
+        ready = self.ready
+        kind = op.kind
+        latency = self.latency[kind]
+        memory = kind == LOAD or kind == STORE or kind == VLOAD or kind == VSTORE or kind == AMO
+        word = address >> 2 if memory and address is not None else None
+        start = 0
+        parent = None
+        for src in op.srcs:
+            if ready[src] > start:
+                start = ready[src]
+                parent = self.chain[src]
+        stored = self.stored
+        if word is not None and (kind == LOAD or kind == VLOAD or kind == AMO):
+            last = stored.get(word)
+            if last is not None and last[0] > start:
+                start, parent = last
+        done = start + latency
+        link = extend(pc, latency, parent)
+        if op.dst is not None:
+            ready[op.dst] = done
+            self.chain[op.dst] = link
+        if word is not None and (kind == STORE or kind == VSTORE or kind == AMO):
+            stored[word] = (done, link)
+            stored.move_to_end(word)
+            if len(stored) > STORED_WORDS:
+                stored.popitem(last=False)
+        if done > self.depth:
+            self.depth = done
+            self.tail = link
+        for window in self.windows:
+            window.add(op, latency, word)
+        self.instructions += 1
+
+    def report(self, top=10):
+        ipc = self.instructions / self.depth if self.depth else 0.0
+        ranked = sorted(chain_totals(self.tail).items(), key=lambda item: item[1], reverse=True)
+        return {
+            'instructions': self.instructions,
+            'critical_path': self.depth,
+            'ideal_ipc': ipc,
+            'bound': 'latency' if ipc < LATENCY_BOUND else 'throughput',
+            'windows': {window.size: window.report() for window in self.windows},
+            'critical_pcs': [{'address': pc * 4, 'cycles': cycles, 'share': cycles / self.depth}
+                             for pc, cycles in ranked[:top]],
+        }
+
+    def table(self, top=10):
+        report = self.report(top)
+        lines = [f"dataflow limit: {report['instructions']} instructions, critical path "
+                 f"{report['critical_path']} cycles, ideal IPC {report['ideal_ipc']:.2f} "
+                 f"({report['bound']} bound)",
+                 f"  {'window':>7} {'mean ILP':>9}  histogram (ILP: blocks)"]
+        for size, window in report['windows'].items():
+            histogram = ' '.join(f"{ilp}:{blocks}" for ilp, blocks in window['histogram'].items())
+            lines.append(f"  {size:>7} {window['mean_ilp']:>9.2f}  {histogram}")
+        lines.append("  critical path by pc:")
+        for spot in report['critical_pcs']:
+            lines.append(f"  {spot['address']:>8} {spot['cycles']:>10} cycles {100 * spot['share']:>6.2f}%")
+        return '\n'.join(lines)
+
+
+def analyze_trace(path, analyzer):
+    """feed a tracing.py trace through analyzer, one record of lookahead for next_pc"""
+    from cpu import ApocaCore
+    from tracing import read_trace, MEM_READ, MEM_WRITE
+    core = ApocaCore()
+    ops = {}
+    previous = None
+    for record in read_trace(path):
+        if previous is not None:
+            analyzer.retire(previous[0], previous[1], record.pc >> 2, previous[2])
+        key = (record.pc, record.instruction)
+        op = ops.get(key)
+        if op is None:
+            pc = record.pc >> 2
+            handler, operands = core.resolve(core.decode(record.instruction))
+            op = ops[key] = describe(core, pc, partial(handler, core, *operands), record.instruction)
+        # records of memory ops without a memory flag do not know the address
+        address = record.address if record.flags & (MEM_READ | MEM_WRITE) else None
+        previous = (record.pc >> 2, op, address)
+    if previous is not None:
+        analyzer.retire(previous[0], previous[1], previous[0] + 1, previous[2])
+    return analyzer
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='dataflow limit of an apocacore execution trace')
+    parser.add_argument('trace', help='trace file written with core.py --trace')
+    parser.add_argument('--windows', default=','.join(map(str, DEFAULT_WINDOWS)),
+                        help='comma separated window sizes for the ILP histograms')
+    parser.add_argument('--top', type=int, default=10, help='critical path pcs to list')
+    args = parser.parse_args()
+    windows = [int(size) for size in args.windows.split(',')]
+    print(analyze_trace(args.trace, ILPAnalyzer(windows)).table(args.top))
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# memory.py
+"""
+Byte addressable memory for ApocaCore.
+Everything (program words and data) lives in one bytearray, multi byte
+accesses are little endian and go through struct instead of byte loops.
+"""
+import struct
+from array import array
+import numpy as np
+
+# unsigned / signed accessors by access size in bytes
+UNSIGNED = {1: struct.Struct('<B'), 2: struct.Struct('<H'), 4: struct.Struct('<I'), 8: struct.Struct('<Q')}
+SIGNED = {1: struct.Struct('<b'), 2: struct.Struct('<h'), 4: struct.Struct('<i'), 8: struct.Struct('<q')}
+
+
+def to_signed(value, size):
+    if value >> (size * 8 - 1):
+        value -= 1 << (size * 8)
+    return value
+
+
+class Memory:
+    """
+    Flat memory backed by a bytearray, or by buffer when one is given (a
+    shared memory block harts in other processes see as well).
+    `words` is a memoryview of the same buffer cast to 32 bit words, which is
+    what instruction fetch indexes with the (word sized) pc.
+    """
+    def __init__(self, size, buffer=None):
+        self.size = size
+        self.data = bytearray(size) if buffer is None else memoryview(buffer).cast('B')[:size]
+        self.view = memoryview(self.data)
+        self.words = self.view[:size & ~3].cast('I')  # host order, little endian hosts
+        self.array = np.frombuffer(self.data, dtype=np.uint8)  # for gathers / scatters
+        self.bus = None  # a devices.Bus, only asked about accesses past the end of RAM
+
+    def __len__(self):
+        return self.size
+
+    def load(self, address, size):
+        """read size bytes as an unsigned value"""
+        if size in UNSIGNED:
+            try:
+                return UNSIGNED[size].unpack_from(self.data, address)[0]
+            except struct.error:
+                if self.bus is None:
+                    raise
+                return self.bus.read(address, size)
+        return int.from_bytes(self.data[address:address + size], 'little')
+
+    def load_signed(self, address, size):
+        """read size bytes as a two's complement value"""
+        if size in SIGNED:
+            try:
+                return SIGNED[size].unpack_from(self.data, address)[0]
+            except struct.error:
+                if self.bus is None:
+                    raise
+                return to_signed(self.bus.read(address, size), size)
+        return int.from_bytes(self.data[address:address + size], 'little', signed=True)
+
+    def store(self, address, value, size):
+        """write the low size bytes of value"""
+        if size in UNSIGNED:
+            try:
+                UNSIGNED[size].pack_into(self.data, address, value & ((1 << (size * 8)) - 1))
+            except struct.error:
+                if self.bus is None:
+                    raise
+                self.bus.write(address, value & ((1 << (size * 8)) - 1), size)
+        else:
+            value &= (1 << (size * 8)) - 1
+            self.data[address:address + size] = value.to_bytes(size, 'little')
+
+    def read_bytes(self, address, length):
+        """zero copy view of length bytes starting at address"""
+        return self.view[address:address + length]
+
+    def write_bytes(self, address, data):
+        self.data[address:address + len(data)] = data
+
+    def load_words(self, address, words):
+        """copy 32 bit words in starting at a word aligned address, a list or a buffer of them"""
+        if isinstance(words, list):
+            words = array('I', words)
+        self.write_bytes(address, memoryview(words).cast('B'))
+
+    def gather(self, addresses, size):
+        """size bytes from every address at once, an (n, size) uint8 array"""
+        return self.array[addresses[:, None] + np.arange(size)]
+
+    def scatter(self, addresses, rows):
+        """write row i of an (n, size) uint8 array to addresses[i]"""
+        self.array[addresses[:, None] + np.arange(rows.shape[1])] = rows
+
+
+PAGE_BITS = 12
+PAGE_SIZE = 1 << PAGE_BITS  # 4 KiB
+PAGE_MASK = PAGE_SIZE - 1
+ZERO_PAGE = bytes(PAGE_SIZE)  # what reads of never written pages see
+
+
+class WordView:
+    """words[i] for memories that have no flat buffer to cast"""
+    def __init__(self, memory):
+        self.memory = memory
+
+    def __getitem__(self, index):
+        return self.memory.load(index << 2, 4)
+
+
+class PagedMemory:
+    """
+    Sparse memory for big address spaces.
+    Pages are 4 KiB bytearrays kept in a page table (dict keyed by page
+    number) and only allocated when something is first written to them;
+    reading a page that was never written gives zeros without allocating.
+    The last page used is cached so runs of accesses to the same page skip
+    the table lookup. Addresses wrap at size, which has to be a power of two,
+    so a stack just below 0 sits at the top of the space.
+    """
+    def __init__(self, size=1 << 32):
+        if size & (size - 1):
+            raise ValueError(f"paged memory size must be a power of two, got {size}")
+        self.size = size
+        self.mask = size - 1
+        self.pages = {}
+        self.touched = set()  # every page number read or written
+        self.last_number = -1
+        self.last_page = None
+        self.words = WordView(self)
+        self.bus = None  # a devices.Bus, asked on a page miss
+
+    def __len__(self):
+        return self.size
+
+    def read_page(self, number):
+        """the page to read from, ZERO_PAGE if it was never written, None if a device has it"""
+        page = self.pages.get(number)
+        self.touched.add(number)
+        if page is None:
+            if self.bus is not None and number in self.bus.pages:
+                return None
+            return ZERO_PAGE
+        self.last_number = number
+        self.last_page = page
+        return page
+
+    def write_page(self, number):
+        page = self.pages.get(number)
+        self.touched.add(number)
+        if page is None:
+            if self.bus is not None and number in self.bus.pages:
+                return None
+            page = self.pages[number] = bytearray(PAGE_SIZE)
+        self.last_number = number
+        self.last_page = page
+        return page
+
+    def ram_page(self, number, get):
+        """read_page / write_page for the bulk paths, which only work on RAM"""
+        page = get(number)
+        if page is None:
+            raise ValueError(f"bulk access to device page at {number << PAGE_BITS:#x}")
+        return page
+
+    def load(self, address, size):
+        """read size bytes as an unsigned value"""
+        address &= self.mask
+        offset = address & PAGE_MASK
+        if offset + size <= PAGE_SIZE and size in UNSIGNED:
+            number = address >> PAGE_BITS
+            if number == self.last_number:
+                page = self.last_page
+            else:
+                page = self.read_page(number)
+                if page is None:
+                    return self.bus.read(address, size)
+            return UNSIGNED[size].unpack_from(page, offset)[0]
+        return int.from_bytes(self.read_bytes(address, size), 'little')
+
+    def load_signed(self, address, size):
+        """read size bytes as a two's complement value"""
+        return to_signed(self.load(address, size), size)
+
+    def store(self, address, value, size):
+        """write the low size bytes of value"""
+        address &= self.mask
+        offset = address & PAGE_MASK
+        value &= (1 << (size * 8)) - 1
+        if offset + size <= PAGE_SIZE and size in UNSIGNED:
+            number = address >> PAGE_BITS
+            if number == self.last_number:
+                page = self.last_page
+            else:
+                page = self.write_page(number)
+                if page is None:
+                    return self.bus.write(address, value, size)
+            UNSIGNED[size].pack_into(page, offset, value)
+        else:
+            self.write_bytes(address, value.to_bytes(size, 'little'))
+
+    def read_bytes(self, address, length):
+        """bytes at address, a view into the page when it does not cross one"""
+        address &= self.mask
+        offset = address & PAGE_MASK
+        if offset + length <= PAGE_SIZE:
+            page = self.ram_page(address >> PAGE_BITS, self.read_page)
+            return memoryview(page)[offset:offset + length]
+        out = bytearray(length)
+        done = 0
+        while done < length:
+            chunk = min(PAGE_SIZE - offset, length - done)
+            page = self.ram_page(address >> PAGE_BITS, self.read_page)
+            out[done:done + chunk] = page[offset:offset + chunk]
+            done += chunk
+            address = (address + chunk) & self.mask
+            offset = 0
+        return out
+
+    def write_bytes(self, address, data):
+        data = memoryview(data).cast('B')
+        address &= self.mask
+        offset = address & PAGE_MASK
+        done = 0
+        while done < len(data):
+            chunk = min(PAGE_SIZE - offset, len(data) - done)
+            page = self.ram_page(address >> PAGE_BITS, self.write_page)
+            page[offset:offset + chunk] = data[done:done + chunk]
+            done += chunk
+            address = (address + chunk) & self.mask
+            offset = 0
+
+    def load_words(self, address, words):
+        """copy 32 bit words in starting at a word aligned address, a list or a buffer of them"""
+        if isinstance(words, list):
+            words = array('I', words)
+        self.write_bytes(address, memoryview(words).cast('B'))
+
+    def map_pages(self, address, buffer):
+        """
+        copy buffer in at address, except that the whole pages in the middle
+        become views of buffer itself instead of copies. buffer has to be
+        writable and stay private to this memory, an ACCESS_COPY mmap of a
+        file gives copy on write pages that cost nothing until touched.
+        """
+        view = memoryview(buffer).cast('B')
+        head = min(-address & PAGE_MASK, len(view))
+        self.write_bytes(address, view[:head])
+        done = head
+        while len(view) - done >= PAGE_SIZE:
+            self.pages[((address + done) & self.mask) >> PAGE_BITS] = view[done:done + PAGE_SIZE]
+            done += PAGE_SIZE
+        self.write_bytes(address + done, view[done:])
+        self.last_number = -1
+        self.last_page = None
+
+    def gather(self, addresses, size):
+        """size bytes from every address at once, batched page by page"""
+        addresses = addresses & self.mask
+        out = np.empty((len(addresses), size), dtype=np.uint8)
+        numbers = addresses >> PAGE_BITS
+        offsets = addresses & PAGE_MASK
+        crossing = offsets + size > PAGE_SIZE
+        lanes = np.arange(size)
+        for number in np.unique(numbers[~crossing]):
+            sel = (numbers == number) & ~crossing
+            page = np.frombuffer(self.ram_page(int(number), self.read_page), dtype=np.uint8)
+            out[sel] = page[offsets[sel][:, None] + lanes]
+        for i in np.flatnonzero(crossing):
+            out[i] = np.frombuffer(bytes(self.read_bytes(int(addresses[i]), size)), dtype=np.uint8)
+        return out
+
+    def scatter(self, addresses, rows):
+        """write row i of an (n, size) uint8 array to addresses[i]"""
+        addresses = addresses & self.mask
+        size = rows.shape[1]
+        numbers = addresses >> PAGE_BITS
+        offsets = addresses & PAGE_MASK
+        crossing = offsets + size > PAGE_SIZE
+        lanes = np.arange(size)
+        for number in np.unique(numbers[~crossing]):
+            sel = (numbers == number) & ~crossing
+            page = np.frombuffer(self.ram_page(int(number), self.write_page), dtype=np.uint8)
+            page[offsets[sel][:, None] + lanes] = rows[sel]
+        for i in np.flatnonzero(crossing):
+            self.write_bytes(int(addresses[i]), rows[i].tobytes())
+
+    def resident_pages(self):
+        """sorted page numbers that have memory behind them"""
+        return sorted(self.pages)
+
+    def stats(self):
+        return {
+            'page_size': PAGE_SIZE,
+            'resident_pages': len(self.pages),
+            'resident_bytes': len(self.pages) * PAGE_SIZE,
+            'touched_pages': len(self.touched),
+            'address_space': self.size,
+        }
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# objcache.py
+"""
+Assembled object files and the on-disk cache of them.
+An object holds everything Parser.assemble produces: the code words, the
+data segments, the symbol table and the source line of every word. Objects
+are cached under a key made of a hash of the .apo source and the assembler
+version, so a repeat run of an unchanged program maps the object with mmap
+and copies the code straight out of the mapping, nothing gets parsed.
+
+Layout, little endian (the u32 sections are read in host order like memory.py), every section 8 byte aligned:
+    header    magic, version, counts and string table sizes
+    code      u32 per word
+    lines     u32 source line number per word
+    segments  u32 length per data segment
+    values    u64 per data value, segments back to back
+    symbols   u32 address per symbol
+    names     symbol names, newline separated
+    texts     source text per word, newline separated
+"""
+import os
+import mmap
+import struct
+import hashlib
+import tempfile
+from array import array
+from fileParser import ASSEMBLER_VERSION, immediate
+
+MAGIC = b'APOCAOBJ'
+VERSION = 1
+# magic, version, flags, words, segments, values, symbols, names size, texts size
+HEADER = struct.Struct('<8sHHIIIIII')
+DEFAULT_DIR = '.apocache'
+
+
+def align(offset):
+    return (offset + 7) & ~7
+
+
+def layout(words, segments, values, symbols):
+    """byte offset of every section, and the end of the fixed size ones"""
+    offsets = {}
+    offset = align(HEADER.size)
+    for name, size in (('code', 4 * words), ('lines', 4 * words), ('segments', 4 * segments),
+                       ('values', 8 * values), ('symbols', 4 * symbols)):
+        offsets[name] = offset
+        offset = align(offset + size)
+    offsets['names'] = offset
+    return offsets
+
+
+def source_key(path):
+    """hash of the source bytes and the assembler version"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(ASSEMBLER_VERSION.to_bytes(4, 'little'))
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_object(path, code, data, symbols, source):
+    """write an object file, through a temporary file so readers never see half of one"""
+    values = [immediate(value) & 0xFFFFFFFFFFFFFFFF if isinstance(value, str) else value & 0xFFFFFFFFFFFFFFFF
+              for segment in data for value in segment]
+    names = '\n'.join(symbols).encode()
+    texts = '\n'.join(text for _, text in source).encode()
+    offsets = layout(len(code), len(data), len(values), len(symbols))
+    image = bytearray(offsets['names'] + len(names) + len(texts))
+    HEADER.pack_into(image, 0, MAGIC, VERSION, 0, len(code), len(data), len(values),
+                     len(symbols), len(names), len(texts))
+    image[offsets['code']:offsets['code'] + 4 * len(code)] = array('I', code).tobytes()
+    image[offsets['lines']:offsets['lines'] + 4 * len(source)] = array('I', (number for number, _ in source)).tobytes()
+    struct.pack_into(f'<{len(data)}I', image, offsets['segments'], *(len(segment) for segment in data))
+    struct.pack_into(f'<{len(values)}Q', image, offsets['values'], *values)
+    struct.pack_into(f'<{len(symbols)}I', image, offsets['symbols'], *symbols.values())
+    image[offsets['names']:offsets['names'] + len(names)] = names
+    image[offsets['names'] + len(names):] = texts
+    directory = os.path.dirname(path) or '.'
+    fd, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(image)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+class SourceMap:
+    """Parser.source read out of an object, the text is only split on first use"""
+    def __init__(self, lines, texts):
+        self.lines = lines
+        self.texts = texts
+        self.split = None
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, pc):
+        if self.split is None:
+            self.split = bytes(self.texts).decode().split('\n')
+        return self.lines[pc], self.split[pc]
+
+
+class ObjectFile:
+    """
+    An object mapped read only. code and the line numbers are memoryviews
+    of u32 over the mapping, the rest is small and decoded on open.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            words, segments, values, symbols, names_size, texts_size, offsets = self.check(path)
+        except ValueError:
+            self.map.close()
+            raise
+        view = memoryview(self.map)
+        self.code = view[offsets['code']:offsets['code'] + 4 * words].cast('I')
+        lines = view[offsets['lines']:offsets['lines'] + 4 * words].cast('I')
+        lengths = struct.unpack_from(f'<{segments}I', self.map, offsets['segments'])
+        flat = struct.unpack_from(f'<{values}Q', self.map, offsets['values'])
+        self.data = []
+        start = 0
+        for length in lengths:
+            self.data.append(list(flat[start:start + length]))
+            start += length
+        addresses = struct.unpack_from(f'<{symbols}I', self.map, offsets['symbols'])
+        names = bytes(view[offsets['names']:offsets['names'] + names_size]).decode().split('\n') if symbols else []
+        if len(names) != symbols:
+            raise ValueError(f"{path}: corrupt symbol table")
+        self.symbols = dict(zip(names, addresses))
+        texts = view[offsets['names'] + names_size:offsets['names'] + names_size + texts_size]
+        self.source = SourceMap(lines, texts)
+
+
+    def check(self, path):
+        """the header counts, if the header and the file size agree with each other"""
+        if len(self.map) < HEADER.size:
+            raise ValueError(f"{path}: truncated object")
+        magic, version, flags, words, segments, values, symbols, names_size, texts_size = \
+            HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not an apocacore object (version {VERSION})")
+        offsets = layout(words, segments, values, symbols)
+        if len(self.map) != offsets['names'] + names_size + texts_size:
+            raise ValueError(f"{path}: truncated object")
+        return words, segments, values, symbols, names_size, texts_size, offsets
+
+
+class ObjectCache:
+    """
+    Parser.assemble goes through here when the parser has one: a hit fills
+    the parser in from the mapped object, a miss assembles the source and
+    stores the object for next time.
+    """
+    def __init__(self, directory=DEFAULT_DIR):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.apobj')
+
+    def assemble(self, parser, filename):
+        path = self.path(source_key(filename))
+        parser.filename = filename
+        try:
+            obj = ObjectFile(path)
+        except (OSError, ValueError):
+            obj = None
+        if obj is not None:
+            self.hits += 1
+            parser.symbols.update(obj.symbols)
+            parser.source = obj.source
+            parser.var_dict = obj.data
+            parser.commands = obj.code
+            if parser.debug == 'debug':
+                print(f"loaded {len(obj.code)} words for {filename} from {path}")
+            return parser.commands, parser.var_dict
+        self.misses += 1
+        with open(filename, 'r') as f:
+            parser.read(f)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            write_object(path, parser.commands, parser.var_dict, parser.symbols, parser.source)
+        except (OSError, ValueError):
+            pass  # read only checkout or data load_memory will complain about, runs uncached
+        return parser.commands, parser.var_dict
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# ooo.py
+"""
+Out-of-order superscalar timing model.
+Works one retired instruction at a time and computes its fetch, dispatch,
+issue, complete and commit cycles straight away from a handful of arrays,
+nothing is stepped cycle by cycle:
+  - renaming leaves only true dependencies, ready[reg] is the cycle the
+    latest producer of reg completes
+  - the ROB is a ring of commit cycles, an instruction cannot dispatch
+    before the one rob_size older has committed
+  - reservation station entries are a heap of issue cycles
+  - issue ports are per cycle counters in ring arrays, per unit and total
+  - loads wait for the last store to their word, for the last STORED_WORDS
+    words stored, so memory stays bounded however long the run
+"""
+import math
+import heapq
+from array import array
+from collections import OrderedDict
+from timing import ALU, LOAD, STORE, BRANCH, JUMP, VALU, VLOAD, VSTORE, VCFG, NOP, AMO, STORED_WORDS
+
+HORIZON = 1 << 16  # cycles the port rings cover, far more than a ROB can spread over
+
+# functional unit: (count, latency)
+DEFAULT_UNITS = {
+    'alu': (2, 1),
+    'lsu': (1, 3),  # loads take the full latency, stores complete after 1
+    'valu': (1, 2),
+    'vmul': (1, 6),  # vector multiply / divide / remainder
+}
+
+UNIT_OF_KIND = {ALU: 'alu', BRANCH: 'alu', JUMP: 'alu', NOP: 'alu', VCFG: 'alu',
+                LOAD: 'lsu', STORE: 'lsu', VLOAD: 'lsu', VSTORE: 'lsu', AMO: 'lsu', VALU: 'valu'}
+VMUL_OPS = ('exec_vmul', 'exec_vdiv', 'exec_vdivu', 'exec_vrem', 'exec_vremu')
+
+STALL_CAUSES = ('mispredict', 'rob_full', 'rs_full', 'dependency', 'ports')
+
+
+def parse_units(spec):
+    """'alu=4:1,lsu=2:4' -> {'alu': (4, 1), 'lsu': (2, 4)}, count:latency per unit"""
+    units = {}
+    for part in spec.split(','):
+        name, _, value = part.strip().partition('=')
+        if name not in DEFAULT_UNITS:
+            raise ValueError(f"unknown unit {name!r}, one of {', '.join(DEFAULT_UNITS)}")
+        count, _, latency = value.partition(':')
+        units[name] = (int(count), int(latency) if latency else DEFAULT_UNITS[name][1])
+    return units
+
+
+class OutOfOrder:
+    """
+    width instructions are fetched / dispatched per cycle, issue_width
+    issued and commit_width committed. units maps unit name to (count,
+    latency). Branches are predicted perfectly unless a predictor.BranchUnit
+    is passed as branches; a misprediction restarts fetch the cycle after
+    the branch completes.
+    """
+    def __init__(self, width=4, issue_width=None, commit_width=None, rob_size=64, rs_size=32,
+                 front_depth=2, units=None, vector_lanes=4, branches=None):
+        self.width = width
+        self.issue_width = issue_width or width
+        self.commit_width = commit_width or width
+        self.rob_size = rob_size
+        self.rs_size = rs_size
+        self.front_depth = front_depth  # fetch to dispatch (decode, rename)
+        self.units = dict(DEFAULT_UNITS)
+        self.units.update(units or {})
+        self.vector_lanes = vector_lanes
+        self.branches = branches
+        self.core = None
+        self.ready = array('q', [0]) * 32  # register slot -> cycle the value is there
+        self.stored = OrderedDict()  # word address -> cycle the last store to it completes
+        self.rob = array('q', [0]) * rob_size  # commit cycle of the instruction rob_size back
+        self.stations = []  # heap of issue cycles of instructions holding an RS entry
+        # ring arrays of per cycle issue counts, tagged with the cycle they belong to
+        self.port_cycle = array('q', [-1]) * HORIZON
+        self.port_used = array('H', [0]) * HORIZON
+        self.unit_cycle = {name: array('q', [-1]) * HORIZON for name in self.units}
+        self.unit_used = {name: array('H', [0]) * HORIZON for name in self.units}
+        self.fetch_cycle = 0
+        self.fetched = 0  # instructions fetched in fetch_cycle
+        self.commit_cycle = 0
+        self.committed = 0  # instructions committed in commit_cycle
+        self.instructions = 0
+        self.stalls = dict.fromkeys(STALL_CAUSES, 0)
+        self.by_unit = dict.fromkeys(self.units, 0)
+
+    def bind(self, core):
+        self.core = core
+
+    def issue_slot(self, cycle, unit):
+        """first cycle from cycle on with a free issue slot and a free unit"""
+        count = self.units[unit][0]
+        port_cycle, port_used = self.port_cycle, self.port_used
+        unit_cycle, unit_used = self.unit_cycle[unit], self.unit_used[unit]
+        while True:
+            slot = cycle % HORIZON
+            if port_cycle[slot] != cycle:
+                port_cycle[slot] = cycle
+                port_used[slot] = 0
+            if unit_cycle[slot] != cycle:
+                unit_cycle[slot] = cycle
+                unit_used[slot] = 0
+            if port_used[slot] < self.issue_width and unit_used[slot] < count:
+                port_used[slot] += 1
+                unit_used[slot] += 1
+                return cycle
+            cycle += 1
+
+    def retire(self, pc, op, next_pc, address):
+        stalls = self.stalls
+        kind = op.kind
+        index = self.instructions
+        # fetch, width per cycle
+        fetch = self.fetch_cycle
+        if self.fetched == self.width:
+            fetch += 1
+            self.fetched = 0
+        # dispatch once the ROB and the reservation stations have room
+        dispatch = fetch + self.front_depth
+        oldest = self.rob[index % self.rob_size]
+        if index >= self.rob_size and oldest > dispatch:
+            stalls['rob_full'] += oldest - dispatch
+            dispatch = oldest
+        stations = self.stations
+        while stations and stations[0] < dispatch:
+            heapq.heappop(stations)
+        while len(stations) >= self.rs_size:
+            freed = heapq.heappop(stations)
+            if freed + 1 > dispatch:
+                stalls['rs_full'] += freed + 1 - dispatch
+                dispatch = freed + 1
+        if dispatch - self.front_depth > fetch:
+            # a full back end holds the front end up too
+            fetch = dispatch - self.front_depth
+            self.fetched = 0
+        # wait for the operands (renamed, so only true dependencies)
+        ready = dispatch + 1
+        for src in op.srcs:
+            if self.ready[src] > ready:
+                ready = self.ready[src]
+        if kind == LOAD or kind == VLOAD or kind == AMO:
+            stored = self.stored.get(address >> 2)
+            if stored is not None and stored > ready:
+                ready = stored
+        stalls['dependency'] += ready - dispatch - 1
+        unit = 'vmul' if op.name in VMUL_OPS else UNIT_OF_KIND[kind]
+        issue = self.issue_slot(ready, unit)
+        stalls['ports'] += issue - ready
+        heapq.heappush(stations, issue)
+        latency = self.units[unit][1]
+        if kind == STORE:
+            latency = 1
+        if kind in (VALU, VLOAD, VSTORE):
+            latency += max(1, math.ceil(self.core.vl / self.vector_lanes)) - 1
+        complete = issue + latency
+        self.by_unit[unit] += 1
+        if op.dst is not None:
+            self.ready[op.dst] = complete
+        if kind == STORE or kind == VSTORE or kind == AMO:
+            word = address >> 2
+            self.stored[word] = complete
+            self.stored.move_to_end(word)
+            if len(self.stored) > STORED_WORDS:
+                self.stored.popitem(last=False)
+        # in order commit, commit_width per cycle
+        commit = max(complete + 1, self.commit_cycle)
+        if commit == self.commit_cycle:
+            if self.committed == self.commit_width:
+                commit += 1
+                self.committed = 0
+        else:
+            self.committed = 0
+        self.commit_cycle = commit
+        self.committed += 1
+        self.rob[index % self.rob_size] = commit
+        # control flow: a taken branch ends the fetch group, a mispredicted
+        # one sends fetch back once it has resolved
+        self.fetch_cycle = fetch
+        self.fetched += 1
+        if kind == BRANCH or kind == JUMP:
+            correct = True if self.branches is None else self.branches.retire(pc, op, next_pc, address)
+            if not correct:
+                stalls['mispredict'] += max(0, complete - fetch)
+                self.fetch_cycle = max(fetch + 1, complete + 1)
+                self.fetched = 0
+            elif next_pc != pc + 1:
+                self.fetch_cycle = fetch + 1
+                self.fetched = 0
+        self.instructions += 1
+
+    def report(self):
+        cycles = self.commit_cycle + 1 if self.instructions else 0
+        return {
+            'width': self.width, 'issue_width': self.issue_width, 'commit_width': self.commit_width,
+            'rob_size': self.rob_size, 'rs_size': self.rs_size,
+            'units': {name: {'count': count, 'latency': latency, 'issued': self.by_unit[name]}
+                      for name, (count, latency) in self.units.items()},
+            'instructions': self.instructions,
+            'cycles': cycles,
+            'ipc': self.instructions / cycles if cycles else 0.0,
+            'stalls': dict(self.stalls),
+            'branches': self.branches.report() if self.branches is not None else None,
+        }
+
+    def table(self):
+        report = self.report()
+        lines = [f"out of order: {report['instructions']} instructions, {report['cycles']} cycles, "
+                 f"IPC {report['ipc']:.3f} (width {self.width}/{self.issue_width}/{self.commit_width}, "
+                 f"ROB {self.rob_size}, RS {self.rs_size})",
+                 "  instruction-cycles waiting on:"]
+        for cause, cycles in report['stalls'].items():
+            lines.append(f"  {cause:<11} {cycles:>12}")
+        lines.append("  issued per unit:")
+        for name, unit in report['units'].items():
+            lines.append(f"  {name:<11} {unit['issued']:>12}  ({unit['count']} x {unit['latency']} cycles)")
+        if self.branches is not None:
+            lines += ['', self.branches.table()]
+        return '\n'.join(lines)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# pipeline.py
+"""
+5-stage in-order pipeline timing model (IF ID EX MEM WB).
+Instead of moving latches around, every register has a ready cycle: the
+first cycle an instruction reading it can be in EX. An instruction enters
+EX one cycle after the one before it, later if a source is not ready yet
+(RAW hazard / load-use stall), if the EX stage is still busy with a multi
+cycle vector op, or if a taken branch flushed the front end.
+"""
+import math
+from timing import LOAD, BRANCH, JUMP, VALU, VLOAD, VSTORE, AMO
+
+# cycles after the producer's last EX cycle until a consumer can be in EX
+FORWARDING = {
+    # EX->EX and MEM->EX paths
+    'full': {'alu': 1, 'load': 2},
+    # only the MEM/WB latch feeds EX
+    'mem': {'alu': 2, 'load': 2},
+    # through the register file, written in the first half of WB
+    'none': {'alu': 3, 'load': 3},
+}
+
+STALL_CAUSES = ('raw', 'load_use', 'structural', 'branch', 'jump')
+
+
+class Pipeline:
+    """
+    Scoreboard timing model, attach it with timing.Retirement(Pipeline()).
+    branch_stage is where branches resolve, 'ex' (2 cycle flush on a taken
+    branch) or 'id' (1 cycle). Branches are predicted not taken unless a
+    predictor.BranchUnit is passed as branches, then only its mispredictions
+    flush.
+    """
+    def __init__(self, forwarding='full', branch_stage='ex', vector_lanes=4, branches=None):
+        if forwarding not in FORWARDING:
+            raise ValueError(f"forwarding is one of {', '.join(FORWARDING)}, got {forwarding!r}")
+        if branch_stage not in ('ex', 'id'):
+            raise ValueError(f"branch_stage is 'ex' or 'id', got {branch_stage!r}")
+        self.forwarding = forwarding
+        self.alu_delay = FORWARDING[forwarding]['alu']
+        self.load_delay = FORWARDING[forwarding]['load']
+        self.branch_stage = branch_stage
+        self.branch_penalty = 2 if branch_stage == 'ex' else 1
+        self.vector_lanes = vector_lanes  # elements a vector op gets through per EX cycle
+        self.branches = branches
+        if branches is not None:
+            branches.penalty = self.branch_penalty
+        self.core = None
+        self.ready = [0] * 32  # register slot -> first cycle a reader can be in EX
+        self.from_load = [False] * 32  # was the pending value produced by a load
+        self.next_ex = 2  # first instruction: IF in cycle 0, ID 1, EX 2
+        self.last_ex = 0
+        self.bubble = 0  # front end cycles lost to the last control transfer
+        self.bubble_cause = None
+        self.instructions = 0
+        self.stalls = dict.fromkeys(STALL_CAUSES, 0)
+
+    def bind(self, core):
+        self.core = core
+
+    def retire(self, pc, op, next_pc, address):
+        stalls = self.stalls
+        ex = self.next_ex
+        if self.bubble:
+            ex += self.bubble
+            stalls[self.bubble_cause] += self.bubble
+            self.bubble = 0
+        # RAW hazards, wait for the latest source
+        ready = self.ready
+        need = ex
+        load = False
+        for src in op.srcs:
+            if ready[src] > need:
+                need = ready[src]
+                load = self.from_load[src]
+        if need > ex:
+            stalls['load_use' if load else 'raw'] += need - ex
+            ex = need
+        kind = op.kind
+        cycles = 1
+        if kind in (VALU, VLOAD, VSTORE):
+            cycles = max(1, math.ceil(self.core.vl / self.vector_lanes))
+            stalls['structural'] += cycles - 1
+        end = ex + cycles - 1
+        if op.dst is not None:
+            loaded = kind in (LOAD, VLOAD, AMO)
+            ready[op.dst] = end + (self.load_delay if loaded else self.alu_delay)
+            self.from_load[op.dst] = loaded
+        if kind == BRANCH:
+            if self.branches is not None:
+                missed = not self.branches.retire(pc, op, next_pc, address)
+            else:
+                missed = next_pc != pc + 1
+            if missed:
+                self.bubble = self.branch_penalty
+                self.bubble_cause = 'branch'
+        elif kind == JUMP:
+            if self.branches is None or not self.branches.retire(pc, op, next_pc, address):
+                # JAL knows its target in ID, JALR needs rs1 out of EX
+                self.bubble = 1 if op.name == 'exec_jal' else 2
+                self.bubble_cause = 'jump'
+        self.next_ex = end + 1
+        self.last_ex = end
+        self.instructions += 1
+
+    def cycles(self):
+        """the last instruction still has MEM and WB after its EX"""
+        return self.last_ex + 3 if self.instructions else 0
+
+    def report(self):
+        cycles = self.cycles()
+        return {
+            'forwarding': self.forwarding,
+            'branch_stage': self.branch_stage,
+            'instructions': self.instructions,
+            'cycles': cycles,
+            'cpi': cycles / self.instructions if self.instructions else 0.0,
+            'stalls': dict(self.stalls),
+            'branches': self.branches.report() if self.branches is not None else None,
+        }
+
+    def table(self):
+        report = self.report()
+        lines = [f"pipeline: {report['instructions']} instructions, {report['cycles']} cycles, "
+                 f"CPI {report['cpi']:.3f} (forwarding {self.forwarding}, branches resolve in {self.branch_stage.upper()})"]
+        for cause, cycles in report['stalls'].items():
+            share = 100 * cycles / report['cycles'] if report['cycles'] else 0.0
+            lines.append(f"  {cause:<11} {cycles:>10} stall cycles {share:>6.2f}%")
+        if self.branches is not None:
+            lines += ['', self.branches.table()]
+        return '\n'.join(lines)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# predictor.py
+"""
+Branch prediction models.
+Direction predictors (static, bimodal, gshare, tournament) keep their 2-bit
+counters in bytearrays indexed by the word pc; a direct mapped BTB with
+array backed tags and targets predicts where JAL / JALR go. BranchUnit
+runs them over the retired instruction stream (see timing.py) and counts
+mispredictions per branch pc.
+"""
+from array import array
+from timing import BRANCH, JUMP
+
+
+class StaticPredictor:
+    """always taken, never taken, or backward taken / forward not taken"""
+    def __init__(self, mode='btfn'):
+        if mode not in ('taken', 'not-taken', 'btfn'):
+            raise ValueError(f"static prediction is taken, not-taken or btfn, got {mode!r}")
+        self.mode = mode
+        self.name = f'static-{mode}' if mode != 'btfn' else 'btfn'
+
+    def predict(self, pc, target):
+        if self.mode == 'btfn':
+            return target is not None and target <= pc
+        return self.mode == 'taken'
+
+    def update(self, pc, target, taken):
+        pass
+
+
+class BimodalPredictor:
+    """a table of 2-bit saturating counters indexed by pc"""
+    name = 'bimodal'
+
+    def __init__(self, bits=10):
+        self.mask = (1 << bits) - 1
+        self.counters = bytearray([1]) * (1 << bits)  # weakly not taken
+
+    def predict(self, pc, target):
+        return self.counters[pc & self.mask] >= 2
+
+    def update(self, pc, target, taken):
+        index = pc & self.mask
+        counter = self.counters[index]
+        if taken:
+            if counter < 3:
+                self.counters[index] = counter + 1
+        elif counter > 0:
+            self.counters[index] = counter - 1
+
+
+class GSharePredictor:
+    """2-bit counters indexed by pc xor the global history of outcomes"""
+    name = 'gshare'
+
+    def __init__(self, bits=10, history=8):
+        self.mask = (1 << bits) - 1
+        self.history_mask = (1 << history) - 1
+        self.history = 0
+        self.counters = bytearray([1]) * (1 << bits)
+
+    def index(self, pc):
+        return (pc ^ self.history) & self.mask
+
+    def predict(self, pc, target):
+        return self.counters[self.index(pc)] >= 2
+
+    def update(self, pc, target, taken):
+        index = self.index(pc)
+        counter = self.counters[index]
+        if taken:
+            if counter < 3:
+                self.counters[index] = counter + 1
+        elif counter > 0:
+            self.counters[index] = counter - 1
+        self.history = ((self.history << 1) | taken) & self.history_mask
+
+
+class TournamentPredictor:
+    """bimodal and gshare side by side, a per pc 2-bit chooser picks one"""
+    name = 'tournament'
+
+    def __init__(self, bits=10, history=8):
+        self.local = BimodalPredictor(bits)
+        self.global_ = GSharePredictor(bits, history)
+        self.mask = (1 << bits) - 1
+        self.choosers = bytearray([2]) * (1 << bits)  # weakly prefer gshare
+
+    def predict(self, pc, target):
+        if self.choosers[pc & self.mask] >= 2:
+            return self.global_.predict(pc, target)
+        return self.local.predict(pc, target)
+
+    def update(self, pc, target, taken):
+        local = self.local.predict(pc, target) == taken
+        global_ = self.global_.predict(pc, target) == taken
+        index = pc & self.mask
+        chooser = self.choosers[index]
+        if global_ and not local and chooser < 3:
+            self.choosers[index] = chooser + 1
+        elif local and not global_ and chooser > 0:
+            self.choosers[index] = chooser - 1
+        self.local.update(pc, target, taken)
+        self.global_.update(pc, target, taken)
+
+
+class BTB:
+    """direct mapped branch target buffer for jumps"""
+    def __init__(self, entries=64):
+        if entries & (entries - 1):
+            raise ValueError(f"BTB entries has to be a power of two, got {entries}")
+        self.mask = entries - 1
+        self.tags = array('q', [-1]) * entries
+        self.targets = array('q', [0]) * entries
+
+    def lookup(self, pc):
+        """predicted target, None on a miss"""
+        index = pc & self.mask
+        return self.targets[index] if self.tags[index] == pc else None
+
+    def update(self, pc, target):
+        index = pc & self.mask
+        self.tags[index] = pc
+        self.targets[index] = target
+
+
+PREDICTORS = {
+    'static-taken': lambda bits, history: StaticPredictor('taken'),
+    'static-not-taken': lambda bits, history: StaticPredictor('not-taken'),
+    'btfn': lambda bits, history: StaticPredictor('btfn'),
+    'bimodal': lambda bits, history: BimodalPredictor(bits),
+    'gshare': lambda bits, history: GSharePredictor(bits, history),
+    'tournament': lambda bits, history: TournamentPredictor(bits, history),
+}
+
+
+def make_predictor(name, bits=10, history=8):
+    if name not in PREDICTORS:
+        raise ValueError(f"unknown predictor {name!r}, one of {', '.join(PREDICTORS)}")
+    return PREDICTORS[name](bits, history)
+
+
+class BranchUnit:
+    """
+    Timing model for the retired stream: conditional branches go through
+    the direction predictor, JAL / JALR through the BTB. retire returns
+    whether the control transfer was predicted right (None for anything
+    else) so the pipeline model can charge flushes only on mispredictions.
+    """
+    def __init__(self, predictor, btb=None, penalty=2):
+        self.predictor = predictor
+        self.btb = btb if btb is not None else BTB()
+        self.penalty = penalty  # cycles lost per misprediction
+        self.branches = {}  # pc -> [executed, taken, mispredicted]
+        self.jumps = 0
+        self.jump_misses = 0
+
+    def retire(self, pc, op, next_pc, address):
+        kind = op.kind
+        if kind == BRANCH:
+            taken = next_pc != pc + 1
+            correct = self.predictor.predict(pc, op.target) == taken
+            self.predictor.update(pc, op.target, taken)
+            stats = self.branches.get(pc)
+            if stats is None:
+                stats = self.branches[pc] = [0, 0, 0]
+            stats[0] += 1
+            stats[1] += taken
+            stats[2] += not correct
+            return correct
+        if kind == JUMP:
+            correct = self.btb.lookup(pc) == next_pc
+            if not correct:
+                self.btb.update(pc, next_pc)
+                self.jump_misses += 1
+            self.jumps += 1
+            return correct
+        return None
+
+    def totals(self):
+        executed = sum(stats[0] for stats in self.branches.values())
+        missed = sum(stats[2] for stats in self.branches.values())
+        return executed, missed
+
+    def report(self):
+        executed, missed = self.totals()
+        return {
+            'predictor': self.predictor.name,
+            'branches': executed,
+            'mispredicted': missed,
+            'accuracy': 1 - missed / executed if executed else 1.0,
+            'jumps': self.jumps,
+            'btb_misses': self.jump_misses,
+            'penalty_cycles': (missed + self.jump_misses) * self.penalty,
+            'per_pc': {
+                pc * 4: {'executed': e, 'taken': t, 'mispredicted': m, 'accuracy': 1 - m / e}
+                for pc, (e, t, m) in sorted(self.branches.items())
+            },
+        }
+
+    def table(self, top=10):
+        report = self.report()
+        lines = [f"branch prediction ({report['predictor']}): {report['branches']} branches, "
+                 f"{report['mispredicted']} mispredicted, accuracy {100 * report['accuracy']:.2f}%",
+                 f"jumps: {report['jumps']}, BTB misses {report['btb_misses']}; "
+                 f"penalty {report['penalty_cycles']} cycles at {self.penalty} per miss",
+                 f"  {'address':>8} {'executed':>10} {'taken':>10} {'missed':>8} {'accuracy':>9}"]
+        worst = sorted(report['per_pc'].items(), key=lambda item: item[1]['mispredicted'], reverse=True)
+        for address, stats in worst[:top]:
+            lines.append(f"  {address:>8} {stats['executed']:>10} {stats['taken']:>10} "
+                         f"{stats['mispredicted']:>8} {100 * stats['accuracy']:>8.2f}%")
+        return '\n'.join(lines)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# profiler.py
+"""
+Execution profiler for ApocaCore.
+Counts how often every pc executes and derives everything else from that
+at report time: per mnemonic and per opcode class counts, hot spots mapped
+back to .apo source lines, instructions retired and simulated
+instructions/sec. It only counts while attached to the core (it is one of
+the core's observers), a plain run pays nothing for it.
+"""
+import json
+import bisect
+from constants import *
+
+# opcode -> class name, for the per class totals
+OPCODE_CLASSES = {code: name for name, code in {**opCodes, **opCodes_vector}.items()}
+
+
+def mnemonic(handler):
+    """exec_addi -> ADDI"""
+    name = handler.__name__
+    return name[5:].upper() if name.startswith('exec_') else name
+
+
+class Profiler:
+    """
+    Attach with Profiler(core, parser.source).attach(), core.run() then
+    counts every instruction it retires. source is Parser.source, the
+    (line number, text) of every instruction word. symbols (name -> byte
+    address, Parser.symbols or ElfFile.symbols) name the pcs as symbol+offset.
+    """
+    def __init__(self, core, source=None, symbols=None):
+        self.core = core
+        self.source = source or []
+        ordered = sorted((address, name) for name, address in (symbols or {}).items())
+        self.symbol_addresses = [address for address, _ in ordered]
+        self.symbol_names = [name for _, name in ordered]
+        self.heat = []  # pc -> times executed
+        self.mnemonics = {}  # counts of instructions that were overwritten since
+        self.decoded_at = {}  # pc -> (mnemonic, opcode class, heat when decoded)
+        self.instructions = 0
+        self.wall_time = 0.0
+
+    def attach(self):
+        core = self.core
+        core.profiler = self
+        core.observe(self)
+        for pc, op in list(core.icache.items()):
+            self.decoded(pc, op)
+        return self
+
+    def after(self, pc, op):
+        self.heat[pc] += 1
+
+    def finish(self, count, seconds):
+        self.instructions += count
+        self.wall_time += seconds
+
+    def decoded(self, pc, op):
+        if pc >= len(self.heat):
+            self.heat.extend([0] * (max(pc + 1, self.core.program_length) - len(self.heat)))
+        # a pc decoded again was overwritten, book what the old instruction ran
+        old = self.decoded_at.get(pc)
+        if old is not None:
+            name, _, since = old
+            self.mnemonics[name] = self.mnemonics.get(name, 0) + self.heat[pc] - since
+        opcode = self.core.memory.words[pc] & 0x7F
+        self.decoded_at[pc] = (mnemonic(op.func), OPCODE_CLASSES.get(opcode, hex(opcode)), self.heat[pc])
+
+    def counts(self):
+        """(per mnemonic, per opcode class) execution counts"""
+        mnemonics = dict(self.mnemonics)
+        classes = {}
+        for pc, (name, cls, since) in self.decoded_at.items():
+            mnemonics[name] = mnemonics.get(name, 0) + self.heat[pc] - since
+            classes[cls] = classes.get(cls, 0) + self.heat[pc]
+        return mnemonics, classes
+
+    def symbol(self, address):
+        """'name+offset' of the closest symbol at or below address, None without one"""
+        i = bisect.bisect_right(self.symbol_addresses, address) - 1
+        if i < 0:
+            return None
+        offset = address - self.symbol_addresses[i]
+        return f"{self.symbol_names[i]}+{offset:#x}" if offset else self.symbol_names[i]
+
+    def by_symbol(self):
+        """executions per symbol, everything from one symbol up to the next"""
+        totals = {}
+        for pc, count in enumerate(self.heat):
+            if count:
+                i = bisect.bisect_right(self.symbol_addresses, pc * 4) - 1
+                name = self.symbol_names[i] if i >= 0 else '?'
+                totals[name] = totals.get(name, 0) + count
+        return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+    def hot_spots(self, top=None):
+        """executed pcs, hottest first"""
+        spots = []
+        for pc, count in enumerate(self.heat):
+            if count:
+                line, text = self.source[pc] if pc < len(self.source) else (None, None)
+                spots.append({'pc': pc, 'address': pc * 4, 'count': count, 'symbol': self.symbol(pc * 4),
+                              'mnemonic': self.decoded_at[pc][0], 'line': line, 'source': text})
+        spots.sort(key=lambda spot: spot['count'], reverse=True)
+        return spots[:top] if top else spots
+
+    def report(self):
+        mnemonics, classes = self.counts()
+        ordered = lambda d: dict(sorted(d.items(), key=lambda item: item[1], reverse=True))
+        return {
+            'instructions': self.instructions,
+            'wall_time': self.wall_time,
+            'instructions_per_second': self.instructions / self.wall_time if self.wall_time else 0.0,
+            'mnemonics': ordered(mnemonics),
+            'classes': ordered(classes),
+            'symbols': self.by_symbol() if self.symbol_names else {},
+            'pcs': self.hot_spots(),
+        }
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def table(self, top=10):
+        """the top hot spots and mnemonics as text"""
+        total = self.instructions or 1
+        rate = self.instructions / self.wall_time if self.wall_time else 0.0
+        lines = [f"{self.instructions} instructions in {self.wall_time:.3f}s ({rate:,.0f} instructions/s)",
+                 "", f"{'count':>10} {'%':>6}  {'pc':>6}  {'line':>5}  source"]
+        for spot in self.hot_spots(top):
+            line = '' if spot['line'] is None else spot['line']
+            source = spot['source'] or f"{spot['mnemonic']:<8} {spot['symbol'] or ''}"
+            lines.append(f"{spot['count']:>10} {100 * spot['count'] / total:>6.2f}  {spot['address']:>6}  {line:>5}  {source}")
+        if self.symbol_names:
+            lines += ["", f"{'count':>10} {'%':>6}  symbol"]
+            for name, count in list(self.by_symbol().items())[:top]:
+                lines.append(f"{count:>10} {100 * count / total:>6.2f}  {name}")
+        mnemonics, _ = self.counts()
+        lines += ["", f"{'count':>10} {'%':>6}  mnemonic"]
+        for name, count in sorted(mnemonics.items(), key=lambda item: item[1], reverse=True)[:top]:
+            lines.append(f"{count:>10} {100 * count / total:>6.2f}  {name}")
+        return '\n'.join(lines)
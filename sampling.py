@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+# sampling.py
+"""
+Sampled simulation.
+A Sampler takes a core whose detailed model is already attached (a
+timing.Retirement or a cache.CacheHierarchy) and only runs that model on
+small parts of the program:
+
+    fast forward  N instructions with the model detached
+    warm          W instructions with the model on, not counted
+    measure       M instructions with the model on, one sample
+    ... repeat until the program ends
+
+Every sample gives a CPI per timing model that counts cycles (and misses
+per 1000 instructions per cache level). The estimate is the mean over the
+samples with a confidence interval from their spread, and extrapolated
+cycles are that CPI times every instruction the program retired.
+
+Fast forward runs on the block engine (a core made with the interpreter
+gets a BlockTranslator and keeps it), which stops on the exact instruction
+by finishing the last few in the interpreter.
+
+simpoints() picks the samples instead of taking them every N: one
+functional pass records a basic block vector per interval of M
+instructions (instructions run per straight-line run, keyed by the pc it
+was entered at), k-means over randomly projected vectors groups similar
+intervals, and the interval nearest each centre is measured and weighted
+by the instructions its cluster covers. The profiling pass starts from a
+snapshot and the core is put back afterwards; host output in that pass
+goes nowhere, host input is read again in the measured pass.
+"""
+import io
+import os
+import math
+import time
+import statistics
+import numpy as np
+from hostcall import HostCalls
+from translator import BlockTranslator
+
+DEFAULT_SAMPLE = (1000000, 10000, 10000)  # fast forward, warm, measure
+PROJECTED = 15  # dimensions basic block vectors are projected down to
+KMEANS_ROUNDS = 50
+KMEANS_SEEDS = 3  # k-means++ starts per k, the best one is kept
+
+
+def parse_sample(spec):
+    """'FF:WARM:MEASURE' instruction counts, e.g. '1000000:10000:10000'"""
+    fields = spec.split(':')
+    if len(fields) != 3:
+        raise ValueError(f"sample is fast forward:warm:measure, got {spec!r}")
+    fast_forward, warm, measure = (int(field, 0) for field in fields)
+    if fast_forward < 0 or warm < 0 or measure < 1:
+        raise ValueError(f"sample needs fast forward and warm >= 0 and measure >= 1, got {spec!r}")
+    return fast_forward, warm, measure
+
+
+def interval(samples, confidence=0.95):
+    """(mean, half width) of the confidence interval, half width None for fewer than two samples"""
+    mean = statistics.fmean(samples)
+    if len(samples) < 2:
+        return mean, None
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    return mean, z * statistics.stdev(samples) / math.sqrt(len(samples))
+
+
+class Sampler:
+    """
+    fast_forward / warm / measure instructions per round, see the module
+    docstring. The core runs its detailed model only while warming and
+    measuring.
+    """
+    def __init__(self, core, fast_forward=DEFAULT_SAMPLE[0], warm=DEFAULT_SAMPLE[1],
+                 measure=DEFAULT_SAMPLE[2], confidence=0.95):
+        if core.timing is None and core.caches is None:
+            raise ValueError("sampling needs a timing model or a cache hierarchy attached to the core")
+        self.core = core
+        self.fast_forward = fast_forward
+        self.warm = warm
+        self.measure = measure
+        self.confidence = confidence
+        self.timing = core.timing
+        self.caches = core.caches
+        self.cached = core.memory  # the CachedMemory in front of RAM when there are caches
+        self.memory = core.memory.memory if self.caches is not None else core.memory
+        if core.translator is None:
+            # made over plain RAM so the blocks poke the bytearray directly
+            cached, core.memory = core.memory, self.memory
+            core.translator = BlockTranslator(core)
+            core.memory = cached
+        self.observers = list(core.observers)
+        # a profiler or tracer keeps watching while the detailed models are off
+        self.watching = [o for o in self.observers if o is not self.timing and o is not self.caches]
+        self.samples = []  # (first instruction, instructions, {metric: value}, weight)
+        self.method = None
+        self.clusters = None
+        self.functional_instructions = 0
+        self.detailed_instructions = 0
+        self.wall_time = 0.0
+
+    def functional(self):
+        core = self.core
+        core.observers = list(self.watching)
+        core.memory = self.memory
+
+    def detailed(self):
+        core = self.core
+        core.observers = list(self.observers)
+        core.memory = self.cached
+
+    def counters(self):
+        """cycles of every model that counts them, misses of every cache level"""
+        counts = {}
+        if self.timing is not None:
+            for model in self.timing.models:
+                report = model.report()
+                if 'cycles' in report:
+                    counts[f'{type(model).__name__} CPI'] = report['cycles']
+        if self.caches is not None:
+            for cache in self.caches.levels():
+                counts[f'{cache.name} MPKI'] = cache.misses * 1000
+        return counts
+
+    def run_functional(self, count):
+        if count > 0:
+            self.functional()
+            before = self.core.instret
+            self.core.run(count)
+            self.functional_instructions += self.core.instret - before
+
+    def run_detailed(self, count):
+        """count instructions on the detailed model, (instructions, {metric: value}) they came to"""
+        core = self.core
+        if count <= 0:
+            return 0, {}
+        self.detailed()
+        before = self.counters()
+        start = core.instret
+        core.run(count)
+        done = core.instret - start
+        self.detailed_instructions += done
+        after = self.counters()
+        self.functional()
+        return done, {name: (after[name] - before[name]) / done for name in after} if done else {}
+
+    def measure_at(self, first, length, weight=None):
+        """warm up to first, measure length instructions from there"""
+        core = self.core
+        self.run_functional(first - self.warm - core.instret)
+        self.run_detailed(first - core.instret)
+        if core.pc >= core.program_length:
+            return
+        done, metrics = self.run_detailed(length)
+        # a short last sample is mostly pipeline drain, only kept when it is all there is
+        if done == length or (done and not self.samples):
+            self.samples.append((first, done, metrics, weight))
+
+    def run(self):
+        """systematic sampling to the end of the program"""
+        core = self.core
+        self.method = 'periodic'
+        start = time.perf_counter()
+        while core.pc < core.program_length:
+            self.measure_at(core.instret + self.fast_forward + self.warm, self.measure)
+        self.functional()
+        self.wall_time += time.perf_counter() - start
+        self.detailed()  # leave the models attached like they were found
+        return self.report()
+
+    def simpoints(self, max_clusters=10, seed=0):
+        """measure the intervals basic block vectors say are representative"""
+        core = self.core
+        self.method = 'simpoint'
+        start = time.perf_counter()
+        self.functional()
+        snapshot = core.snapshot()
+        base = core.instret
+        host = core.host
+        sink = open(os.devnull, 'wb')
+        core.host = HostCalls(stdin=io.BytesIO(), stdout=sink, stderr=sink)
+        try:
+            vectors, lengths = basic_block_vectors(core, self.measure)
+        finally:
+            core.host.close()
+            sink.close()
+            core.host = host
+        self.functional_instructions += sum(lengths)
+        labels, chosen = cluster(vectors, lengths, max_clusters, seed)
+        total = sum(lengths)
+        weights = np.bincount(labels, weights=lengths) / total
+        self.clusters = len(chosen)
+        core.restore(snapshot)
+        for label, index in sorted(enumerate(chosen), key=lambda item: item[1]):
+            self.measure_at(base + index * self.measure, lengths[index], float(weights[label]))
+        # carry on to the end so instret and the program's results are the full run's
+        self.run_functional(base + total - core.instret)
+        self.wall_time += time.perf_counter() - start
+        self.detailed()
+        return self.report()
+
+    def estimates(self):
+        """metric -> (estimate, confidence half width or None)"""
+        names = {name for _, _, metrics, _ in self.samples for name in metrics}
+        estimates = {}
+        for name in sorted(names):
+            values = [(metrics[name], weight) for _, _, metrics, weight in self.samples if name in metrics]
+            if self.method == 'simpoint':
+                # one sample per cluster, there is no spread to take an interval from
+                covered = sum(weight for _, weight in values)
+                estimates[name] = (sum(value * weight for value, weight in values) / covered, None)
+            else:
+                estimates[name] = interval([value for value, _ in values], self.confidence)
+        return estimates
+
+    def report(self):
+        instructions = self.core.instret
+        estimates = {}
+        for name, (mean, half) in self.estimates().items():
+            estimate = {'mean': mean, 'half_width': half, 'confidence': self.confidence,
+                        'relative_error': half / mean if half is not None and mean else None}
+            if name.endswith(' CPI'):
+                estimate['cycles'] = mean * instructions
+            estimates[name] = estimate
+        return {
+            'method': self.method,
+            'fast_forward': self.fast_forward, 'warm': self.warm, 'measure': self.measure,
+            'clusters': self.clusters,
+            'instructions': instructions,
+            'functional_instructions': self.functional_instructions,
+            'detailed_instructions': self.detailed_instructions,
+            'samples': [{'first': first, 'instructions': done, 'weight': weight, 'metrics': metrics}
+                        for first, done, metrics, weight in self.samples],
+            'estimates': estimates,
+            'wall_time': self.wall_time,
+        }
+
+    def table(self):
+        report = self.report()
+        detail = report['detailed_instructions']
+        share = 100 * detail / report['instructions'] if report['instructions'] else 0.0
+        if self.method == 'simpoint':
+            how = f"{report['clusters']} simpoints of {self.measure}, warm {self.warm}"
+        else:
+            how = f"every {self.fast_forward + self.warm + self.measure}: warm {self.warm}, measure {self.measure}"
+        lines = [f"sampled: {len(self.samples)} samples ({how}), {detail} of {report['instructions']} "
+                 f"instructions detailed ({share:.2f}%), {report['wall_time']:.2f}s"]
+        for name, estimate in report['estimates'].items():
+            line = f"  {name:<18} {estimate['mean']:>10.4f}"
+            if estimate['relative_error'] is not None:
+                line += (f" +- {estimate['half_width']:.4f} ({100 * self.confidence:.0f}% confidence, "
+                         f"{100 * estimate['relative_error']:.2f}%)")
+            if 'cycles' in estimate:
+                line += f"  ~{estimate['cycles']:.0f} cycles"
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+class BlockCounter:
+    """
+    observer counting instructions per straight-line run, keyed by the pc
+    the run was entered at; a taken branch or jump starts a new run
+    """
+    def __init__(self, core):
+        self.core = core
+        self.counts = {}
+        self.block = core.pc
+        self.run = 0
+
+    def after(self, pc, op):
+        self.run += 1
+        if self.core.pc != pc + 1:
+            self.counts[self.block] = self.counts.get(self.block, 0) + self.run
+            self.block = self.core.pc
+            self.run = 0
+
+    def take(self):
+        """the counts so far, the next interval starts from the current pc"""
+        if self.run:
+            self.counts[self.block] = self.counts.get(self.block, 0) + self.run
+        counts = self.counts
+        self.counts = {}
+        self.block = self.core.pc
+        self.run = 0
+        return counts
+
+
+def basic_block_vectors(core, length):
+    """
+    run to the end of the program functionally, one {entry pc:
+    instructions} per interval of length instructions, and the interval
+    lengths (the last one can be short)
+    """
+    counter = core.observe(BlockCounter(core))
+    vectors = []
+    lengths = []
+    try:
+        while core.pc < core.program_length:
+            before = core.instret
+            core.run(length)
+            vectors.append(counter.take())
+            lengths.append(core.instret - before)
+    finally:
+        core.unobserve(counter)
+    return vectors, lengths
+
+
+def kmeans(points, k, rng):
+    """(labels, centres, sum of squared distances), k-means++ start and Lloyd rounds"""
+    centres = [points[rng.integers(len(points))]]
+    for _ in range(1, k):
+        distances = ((points[:, None, :] - np.array(centres)[None]) ** 2).sum(axis=2).min(axis=1)
+        total = distances.sum()
+        if total == 0:
+            break  # fewer distinct points than k
+        centres.append(points[rng.choice(len(points), p=distances / total)])
+    centres = np.array(centres)
+    labels = None
+    for _ in range(KMEANS_ROUNDS):
+        distances = ((points[:, None, :] - centres[None]) ** 2).sum(axis=2)
+        new = distances.argmin(axis=1)
+        if labels is not None and (new == labels).all():
+            break
+        labels = new
+        for c in range(len(centres)):
+            members = points[labels == c]
+            if len(members):
+                centres[c] = members.mean(axis=0)
+    distances = ((points - centres[labels]) ** 2).sum(axis=1)
+    return labels, centres, distances.sum()
+
+
+def bic(points, labels, centres, error):
+    """Bayesian information criterion of a spherical gaussian clustering, as in X-means"""
+    n, dims = points.shape
+    k = len(centres)
+    if n <= k:
+        return -math.inf
+    variance = max(error / (n - k), 1e-12)
+    likelihood = 0.0
+    for size in np.bincount(labels, minlength=k):
+        if size:
+            likelihood += (size * math.log(size) - size * math.log(n) - size / 2 * math.log(2 * math.pi)
+                           - size * dims / 2 * math.log(variance) - (size - k) / 2)
+    parameters = (k - 1) + dims * k + 1
+    return likelihood - parameters / 2 * math.log(n)
+
+
+def cluster(vectors, lengths, max_clusters=10, seed=0):
+    """
+    labels per interval and the interval nearest each cluster centre. The
+    number of clusters is the smallest k whose BIC gets 90% of the way
+    from the worst to the best one tried, like SimPoint picks it.
+    """
+    blocks = sorted({pc for counts in vectors for pc in counts})
+    column = {pc: i for i, pc in enumerate(blocks)}
+    matrix = np.zeros((len(vectors), len(blocks)))
+    for row, counts in enumerate(vectors):
+        for pc, count in counts.items():
+            matrix[row, column[pc]] = count
+    matrix /= np.maximum(matrix.sum(axis=1, keepdims=True), 1)
+    rng = np.random.default_rng(seed)
+    if len(blocks) > PROJECTED:
+        matrix = matrix @ rng.uniform(-1, 1, (len(blocks), PROJECTED))
+    runs = []
+    for k in range(1, min(max_clusters, len(vectors)) + 1):
+        best = min((kmeans(matrix, k, rng) for _ in range(KMEANS_SEEDS)), key=lambda result: result[2])
+        runs.append((bic(matrix, *best), best))
+    scores = [score for score, _ in runs]
+    low, high = min(scores), max(scores)
+    labels, centres, _ = next(result for score, result in runs if score >= low + 0.9 * (high - low))
+    chosen = []
+    for c in range(len(centres)):
+        members = np.flatnonzero(labels == c)
+        if len(members):
+            nearest = ((matrix[members] - centres[c]) ** 2).sum(axis=1).argmin()
+            chosen.append(int(members[nearest]))
+    # renumber so cluster c is chosen[c], empty clusters dropped
+    kept = [c for c in range(len(centres)) if (labels == c).any()]
+    labels = np.searchsorted(kept, labels)
+    return labels, chosen
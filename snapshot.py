@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# snapshot.py
+"""
+Snapshots and on-disk checkpoints of a core.
+A Snapshot holds everything a run needs to carry on: x and f registers,
+the vector register file with vtype / vl, pc, instret and memory. It is
+taken with ApocaCore.snapshot() and put back with ApocaCore.restore(),
+which for flat memory is one buffer copy, so thousands of what-if runs can
+be forked from one warmed up state. Predecoded code survives a restore as
+long as the program bytes did not change.
+
+Checkpointer writes a chain of checkpoint files: a full one first, then
+incremental ones with only the pages that differ from the checkpoint
+before. Nothing is tracked per store; the changed pages are found by
+comparing memory against the last checkpoint's copy, 8 bytes at a time
+with numpy for flat memory. load_chain rebuilds the Snapshot from a full
+checkpoint and any number of increments after it.
+
+Layout, little endian:
+    header     magic, version, kind, flags, chain id, sequence, memory size, page count, vrf size, page bytes
+    state      pc, instret, code end, vl, SEW, LMUL, exit code, breakpoint
+    registers  16 x i64, then 16 x f64
+    vrf        the vector register file
+    pages      u32 page number per page, then the pages (zlib when compressed)
+"""
+import os
+import zlib
+import struct
+from array import array
+import numpy as np
+from memory import PagedMemory, PAGE_BITS, PAGE_SIZE
+
+MAGIC = b'APOCASNP'
+VERSION = 1
+FULL, INCREMENTAL = 0, 1
+PAGED, COMPRESSED, EXITED = 1, 2, 4
+HEADER = struct.Struct('<8sHBBQIQIII')
+STATE = struct.Struct('<qqqqIdqq')
+REGISTERS = struct.Struct('<16q')
+F_REGISTERS = struct.Struct('<16d')
+ZERO_PAGE = bytes(PAGE_SIZE)
+
+
+def wrap64(value):
+    return ((value + (1 << 63)) & 0xFFFFFFFFFFFFFFFF) - (1 << 63)
+
+
+class Snapshot:
+    """
+    State of a core at one point. memory is the whole image as bytes for
+    flat memory, page number -> bytes for paged memory.
+    """
+    __slots__ = ('pc', 'instret', 'code_end', 'vl', 'vtype', 'exit_code', 'breakpoint',
+                 'registers', 'f_registers', 'vrf', 'paged', 'memory_size', 'memory')
+
+    def __init__(self, core=None):
+        if core is None:
+            return
+        self.pc = core.pc
+        self.instret = core.instret
+        self.code_end = core.code_end
+        self.vl = core.vl
+        self.vtype = (core.vtype['SEW'], core.vtype['LMUL'])
+        self.exit_code = core.exit_code
+        self.breakpoint = core.breakpoint
+        self.registers = list(core.registers)
+        self.f_registers = list(core.f_registers)
+        self.vrf = core.vrf.tobytes()
+        memory = core.memory
+        self.paged = isinstance(memory, PagedMemory)
+        self.memory_size = len(memory)
+        if self.paged:
+            self.memory = {number: bytes(page) for number, page in memory.pages.items()}
+        else:
+            self.memory = bytes(memory.data)
+
+    def restore(self, core):
+        memory = core.memory
+        if isinstance(memory, PagedMemory) != self.paged or len(memory) != self.memory_size:
+            raise ValueError(f"snapshot of {'paged' if self.paged else 'flat'} memory of "
+                             f"{self.memory_size} bytes does not fit this core's memory")
+        if self.paged:
+            memory.pages = {number: bytearray(page) for number, page in self.memory.items()}
+            memory.touched.update(memory.pages)
+            memory.last_number = -1
+            memory.last_page = None
+            code_same = False
+        else:
+            end = self.code_end
+            code_same = end == core.code_end and memory.data[:end] == memoryview(self.memory)[:end]
+            memory.view[:] = self.memory  # a straight memcpy, bytearray slice assignment is slower
+        if not code_same:
+            core.set_code_end(self.code_end)
+        core.registers[:] = self.registers
+        core.f_registers[:] = self.f_registers
+        core.vrf[:] = np.frombuffer(self.vrf, dtype=np.uint8)
+        core.set_vtype(*self.vtype)
+        core.vl = self.vl
+        core.pc = self.pc
+        core.instret = self.instret
+        core.exit_code = self.exit_code
+        core.breakpoint = self.breakpoint
+        core.reservation = None
+
+
+def changed_pages(memory, base):
+    """
+    page numbers of memory that differ from base (a flat image, a page
+    dict, or None for all zero), with their current bytes
+    """
+    if isinstance(memory, PagedMemory):
+        pages = {}
+        for number, page in memory.pages.items():
+            old = base.get(number, ZERO_PAGE) if base is not None else ZERO_PAGE
+            if page != old:
+                pages[number] = bytes(page)
+        return pages  # PagedMemory never drops a page, so nothing can have gone
+    data = memory.data
+    whole = len(memory) >> PAGE_BITS
+    shape = (whole, PAGE_SIZE // 8)
+    current = np.frombuffer(data, dtype=np.uint64, count=whole * PAGE_SIZE // 8).reshape(shape)
+    if base is None:
+        dirty = current.any(axis=1)
+    else:
+        old = np.frombuffer(base, dtype=np.uint64, count=whole * PAGE_SIZE // 8).reshape(shape)
+        dirty = (current != old).any(axis=1)
+    numbers = np.flatnonzero(dirty).tolist()
+    tail = whole * PAGE_SIZE
+    if tail < len(memory):
+        old = base[tail:] if base is not None else bytes(len(memory) - tail)
+        if data[tail:] != old:
+            numbers.append(whole)
+    return {number: bytes(data[number * PAGE_SIZE:(number + 1) * PAGE_SIZE]) for number in numbers}
+
+
+def write_checkpoint(path, snapshot, pages, kind=FULL, chain=0, sequence=0, compress=False):
+    """one checkpoint file: the snapshot's state plus pages (number -> bytes, short last page padded)"""
+    flags = (PAGED if snapshot.paged else 0) | (COMPRESSED if compress else 0) | \
+            (EXITED if snapshot.exit_code is not None else 0)
+    numbers = sorted(pages)
+    body = b''.join(pages[number].ljust(PAGE_SIZE, b'\0') for number in numbers)
+    if compress:
+        body = zlib.compress(body, 1)
+    breakpoint = -1 if snapshot.breakpoint is None else snapshot.breakpoint
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, kind, flags, chain, sequence, snapshot.memory_size,
+                            len(numbers), len(snapshot.vrf), len(body)))
+        f.write(STATE.pack(snapshot.pc, snapshot.instret, snapshot.code_end, snapshot.vl, snapshot.vtype[0],
+                           snapshot.vtype[1], snapshot.exit_code or 0, breakpoint))
+        f.write(REGISTERS.pack(*(wrap64(value) for value in snapshot.registers)))
+        f.write(F_REGISTERS.pack(*snapshot.f_registers))
+        f.write(snapshot.vrf)
+        f.write(array('I', numbers).tobytes())
+        f.write(body)
+
+
+def read_checkpoint(path):
+    """(kind, chain, sequence, snapshot without memory, pages) of one checkpoint file"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if len(raw) < HEADER.size:
+        raise ValueError(f"{path}: truncated checkpoint")
+    magic, version, kind, flags, chain, sequence, memory_size, count, vrf_size, body_size = \
+        HEADER.unpack_from(raw, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path}: not an apocacore checkpoint (version {VERSION})")
+    offset = HEADER.size
+    pc, instret, code_end, vl, sew, lmul, exit_code, breakpoint = STATE.unpack_from(raw, offset)
+    offset += STATE.size
+    snapshot = Snapshot()
+    snapshot.pc, snapshot.instret, snapshot.code_end, snapshot.vl = pc, instret, code_end, vl
+    snapshot.vtype = (sew, lmul)
+    snapshot.exit_code = exit_code if flags & EXITED else None
+    snapshot.breakpoint = None if breakpoint < 0 else breakpoint
+    snapshot.registers = list(REGISTERS.unpack_from(raw, offset))
+    offset += REGISTERS.size
+    snapshot.f_registers = list(F_REGISTERS.unpack_from(raw, offset))
+    offset += F_REGISTERS.size
+    snapshot.vrf = raw[offset:offset + vrf_size]
+    offset += vrf_size
+    numbers = array('I', raw[offset:offset + 4 * count])
+    offset += 4 * count
+    body = raw[offset:offset + body_size]
+    if len(body) != body_size:
+        raise ValueError(f"{path}: truncated checkpoint")
+    if flags & COMPRESSED:
+        body = zlib.decompress(body)
+    snapshot.paged = bool(flags & PAGED)
+    snapshot.memory_size = memory_size
+    view = memoryview(body)
+    pages = {number: view[i * PAGE_SIZE:(i + 1) * PAGE_SIZE] for i, number in enumerate(numbers)}
+    return kind, chain, sequence, snapshot, pages
+
+
+def load_chain(paths):
+    """Snapshot from a full checkpoint followed by its increments, in order"""
+    snapshot = None
+    for path in paths:
+        kind, chain, sequence, state, pages = read_checkpoint(path)
+        if snapshot is None:
+            if kind != FULL:
+                raise ValueError(f"{path}: a chain has to start with a full checkpoint")
+            first, expected = chain, 0
+            image = {} if state.paged else bytearray(state.memory_size)
+        elif kind != INCREMENTAL or chain != first or sequence != expected:
+            raise ValueError(f"{path}: not checkpoint {expected} of this chain")
+        for number, page in pages.items():
+            if state.paged:
+                image[number] = bytes(page)
+            else:
+                start = number * PAGE_SIZE
+                image[start:start + PAGE_SIZE] = page[:state.memory_size - start]
+        snapshot = state
+        expected = sequence + 1
+    if snapshot is None:
+        raise ValueError("no checkpoints given")
+    snapshot.memory = image if snapshot.paged else bytes(image)
+    return snapshot
+
+
+class Checkpointer:
+    """
+    Writes the checkpoints of one run: the first is full, every later one
+    only has the pages that changed since the one before it.
+    """
+    def __init__(self, core, compress=False):
+        self.core = core
+        self.compress = compress
+        self.chain = int.from_bytes(os.urandom(8), 'little')
+        self.sequence = 0
+        self.base = None  # memory as of the last checkpoint
+        self.pages_written = 0
+
+    def write(self, path):
+        core = self.core
+        pages = changed_pages(core.memory, self.base)
+        snapshot = Snapshot(core)
+        write_checkpoint(path, snapshot, pages, FULL if self.base is None else INCREMENTAL,
+                         self.chain, self.sequence, self.compress)
+        self.base = snapshot.memory
+        self.sequence += 1
+        self.pages_written += len(pages)
+        return len(pages)
@@ -0,0 +1,40 @@
+# conftest.py
+"""
+Shared fixtures. The modules live flat in the repository root, the tests
+import them from there.
+"""
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fileParser import Parser
+from cpu import ApocaCore
+
+
+@pytest.fixture
+def assemble(tmp_path):
+    """assemble(source) -> (program, data) through a scratch .apo file"""
+    def assemble(source, name='prog.apo'):
+        path = tmp_path / name
+        path.write_text(source)
+        return Parser().assemble(str(path))
+    return assemble
+
+
+@pytest.fixture
+def make_core(assemble):
+    """make_core(source or repository .apo name, **options) -> a loaded ApocaCore"""
+    def make_core(source, **options):
+        if source.endswith('.apo'):
+            program, data = Parser().assemble(os.path.join(ROOT, source))
+        else:
+            program, data = assemble(source)
+        options.setdefault('memory_size', 4096)
+        core = ApocaCore(**options)
+        core.load_memory(data)
+        core.load_program(program)
+        return core
+    return make_core
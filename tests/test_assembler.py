@@ -0,0 +1,94 @@
+# test_assembler.py
+"""every instruction_map entry assembles to a word cpu.decode gives back"""
+import pytest
+from constants import instruction_map, vector_funct3
+from fileParser import Parser, instruction_format
+from cpu import ApocaCore
+
+PARSER = Parser()
+CORE = ApocaCore()
+HANDLER_NAMES = {'LV': 'exec_vl', 'SV': 'exec_vs'}
+
+# format -> (operand text, operands the handler should be bound with)
+SCALAR = {
+    'r': ('x3, x4, x5', lambda ops: ops[:3] == (3, 4, 5)),
+    'i': ('x3, x4, -7', lambda ops: (ops[0], ops[1], ops[3]) == (3, 4, -7)),
+    'shift': ('x3, x4, 13', lambda ops: (ops[0], ops[1], ops[3] & 0x1F) == (3, 4, 13)),
+    'load': ('x3, -8(x4)', lambda ops: (ops[0], ops[1], ops[3]) == (3, 4, -8)),
+    's': ('x5, -8(x4)', lambda ops: ops[1:] == (4, 5, -8)),
+    'b': ('x4, x5, -16', lambda ops: ops == (4, 5, -16)),
+    'u': ('x3, -2', lambda ops: (ops[0], ops[3]) == (3, -2)),
+    'j': ('x3, -20', lambda ops: (ops[0], ops[3]) == (3, -20)),
+    'vmem': ('v3, 12(x4)', lambda ops: ops == (3, 4, 12, 1)),
+    'vsetvli': ('x3, x4, e16, m2', lambda ops: ops == (3, 4, PARSER.encode_vtype(['e16', 'm2']))),
+    'vsetivli': ('x3, 9, e16, mf2', lambda ops: ops == (3, 9, PARSER.encode_vtype(['e16', 'mf2']))),
+    'vsetvl': ('x3, x4, x5', lambda ops: ops == (3, 4, 5)),
+    'system': ('', lambda ops: True),
+}
+
+
+def cases():
+    """(mnemonic, source line, check) for every mnemonic, masked forms as well"""
+    for mnemonic, info in instruction_map.items():
+        form = instruction_format(mnemonic, info)
+        if mnemonic == 'BEQI':
+            yield mnemonic, 'BEQI x4, -3, -16', lambda ops: ops == (4, 29, -16)
+        elif mnemonic == 'LR.W':
+            yield mnemonic, 'LR.W x3, (x4)', lambda ops: ops[:3] == (3, 4, 0)
+        elif form == 'amo':
+            yield mnemonic, f'{mnemonic} x3, x5, (x4)', lambda ops: ops[:3] == (3, 4, 5)
+        elif form == 'vstride':
+            index = 'v5' if mnemonic in ('VLUXEI', 'VSUXEI') else 'x5'
+            yield mnemonic, f'{mnemonic} v3, (x4), {index}', lambda ops: ops == (3, 4, 5, 1)
+            yield mnemonic, f'{mnemonic} v3, (x4), {index}, v0.t', lambda ops: ops == (3, 4, 5, 0)
+        elif form == 'v':
+            funct3 = info['funct3']
+            if funct3 == vector_funct3['OPIVI']:
+                source, rs1 = '-3', 29
+            elif funct3 in (vector_funct3['OPIVX'], vector_funct3['OPMVX']):
+                source, rs1 = 'x5', 5
+            else:
+                source, rs1 = 'v5', 5
+            for suffix, vm in (('', 1), (', v0.t', 0)):
+                yield (mnemonic, f'{mnemonic} v3, v4, {source}{suffix}',
+                       lambda ops, rs1=rs1, vm=vm, funct3=funct3: ops == (3, rs1, 4, vm, funct3))
+        else:
+            text, check = SCALAR[form]
+            yield mnemonic, f'{mnemonic} {text}'.strip(), check
+
+
+CASES = list(cases())
+
+
+def test_every_mnemonic_is_covered():
+    assert {mnemonic for mnemonic, _, _ in CASES} == set(instruction_map)
+
+
+@pytest.mark.parametrize('mnemonic, line, check', CASES, ids=[line for _, line, _ in CASES])
+def test_round_trip(mnemonic, line, check):
+    word = PARSER.parse_line(line, 64)
+    assert 0 <= word < 1 << 32
+    handler, operands = CORE.resolve(CORE.decode(word))
+    assert handler.__name__ == HANDLER_NAMES.get(mnemonic, 'exec_' + mnemonic.split('.')[0].lower())
+    assert check(operands), operands
+
+
+def test_labels_forward_and_back(assemble):
+    program, _ = assemble("""
+start:
+    BEQ x1, x2, end
+    JAL x1, start
+end:
+    JAL x0, start
+""")
+    decoded = [CORE.decode(word) for word in program]
+    assert decoded[0][2] == 8  # branch imm, bytes forward
+    assert decoded[1][-1] == -4
+    assert decoded[2][-1] == -8
+
+
+@pytest.mark.parametrize('line', ['ADDI x1, x0, 2048', 'SLLI x1, x1, 32', 'BEQ x1, x2, nowhere',
+                                  'ADD x1, x2', 'FOO x1', 'ADD x1, x2, x16', 'LR.W x1, 4(x2)'])
+def test_rejects(assemble, line):
+    with pytest.raises(ValueError):
+        assemble(line + '\n')
@@ -0,0 +1,109 @@
+# test_batch.py
+"""result records of the batch runner, one program and a whole pool"""
+import io
+import os
+import json
+import pytest
+from batch import run_program, run_batch, find_programs
+
+KEYS = {'file', 'status', 'instructions', 'registers', 'wall_time'}
+
+EXITS = """
+    ADDI x1, x0, 7
+    ADDI x5, x0, 93
+    ADDI x10, x0, 3
+    ECALL
+"""
+
+FOREVER = """
+loop:
+    ADDI x1, x1, 1
+    JAL x0, loop
+"""
+
+# about a million instructions, long enough to finish well after EXITS
+SLOW = """
+    ADDI x1, x0, 300
+    SLLI x1, x1, 10
+loop:
+    ADDI x1, x1, -1
+    BNE x1, x0, loop
+"""
+
+OUT_OF_RANGE = """
+    LUI x1, 0x10000
+    LW x2, 0(x1)
+"""
+
+
+@pytest.fixture
+def program(tmp_path):
+    def program(source, name='prog.apo'):
+        path = tmp_path / name
+        path.write_text(source)
+        return str(path)
+    return program
+
+
+def open_fds():
+    return len(os.listdir('/proc/self/fd')) if os.path.isdir('/proc/self/fd') else None
+
+
+def test_ok_record(program):
+    result = run_program(program(EXITS))
+    assert KEYS <= set(result)
+    assert result['status'] == 'ok'
+    assert result['exit_code'] == 3
+    assert result['instructions'] == 4
+    assert result['registers'][1] == 7 and len(result['registers']) == 16
+    json.dumps(result)
+
+
+def test_budget(program):
+    result = run_program(program(FOREVER), max_instructions=1000)
+    assert result['status'] == 'budget'
+    assert result['instructions'] == 1000
+    assert result['registers'][1] == 500
+
+
+def test_timeout(program):
+    result = run_program(program(FOREVER), max_instructions=1 << 40, timeout=0.05)
+    assert result['status'] == 'timeout'
+    assert result['instructions'] > 0
+    assert 'exit_code' not in result
+
+
+@pytest.mark.parametrize('source', ['    BOGUS x1, x2, x3\n', OUT_OF_RANGE], ids=['assembly', 'run'])
+def test_error_records(program, source):
+    before = open_fds()
+    result = run_program(program(source))
+    assert result['status'] == 'error'
+    assert result['error'].split(':')[0].isidentifier()  # 'ExceptionType: message'
+    assert open_fds() == before  # the devnull sink is closed on the error path too
+
+
+def test_missing_file():
+    result = run_program('/nonexistent/prog.apo')
+    assert result['status'] == 'error'
+
+
+def test_batch_json_lines(program, tmp_path):
+    paths = [program(EXITS, 'a.apo'), program(FOREVER, 'b.apo'), program('    BOGUS\n', 'c.apo')]
+    assert find_programs(str(tmp_path)) == sorted(paths)
+    out = io.StringIO()
+    counts = run_batch(paths, jobs=2, out=out, max_instructions=5000)
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert sorted(record['file'] for record in records) == sorted(paths)
+    assert all(KEYS <= set(record) for record in records)
+    assert {record['file']: record['status'] for record in records} == \
+        {paths[0]: 'ok', paths[1]: 'budget', paths[2]: 'error'}
+    assert counts == {'ok': 1, 'budget': 1, 'error': 1}
+
+
+def test_results_stream_as_programs_finish(program):
+    paths = [program(SLOW, 'slow.apo'), program(EXITS, 'fast.apo')]
+    out = io.StringIO()
+    run_batch(paths, jobs=2, out=out)
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [record['file'] for record in records] == paths[::-1]
+    assert records[1]['instructions'] > 300000
@@ -0,0 +1,125 @@
+# test_cache.py
+"""hit / miss counts, write traffic and AMAT of the cache models"""
+import pytest
+from cache import Cache, CacheHierarchy, MainMemory
+from profiler import Profiler
+
+# three lines that share set 0 of a 2-way, 4-set, 16 byte line cache
+A, B, C = 0, 64, 128
+
+
+def level(policy='lru', write='wb', **options):
+    cache = Cache('L1D', 128, 2, 16, policy=policy, write=write, **options)
+    cache.next = MainMemory(100)
+    return cache
+
+
+def replay(cache, pattern, write=False):
+    return [cache.access(address, write) for address in pattern]
+
+
+def test_lru():
+    cache = level('lru')
+    # A is used again just before C comes in, so B is the one to go
+    assert replay(cache, [A, B, A, C, A, B]) == [False, False, True, False, True, False]
+    assert (cache.hits, cache.misses, cache.evictions) == (2, 4, 2)
+
+
+def test_fifo():
+    cache = level('fifo')
+    # the hit on A does not save it, it was filled first
+    assert replay(cache, [A, B, A, C, A, B]) == [False, False, True, False, False, False]
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 5, 3)
+
+
+def test_random_is_seeded():
+    runs = []
+    for _ in range(2):
+        cache = level('random', seed=7)
+        runs.append(replay(cache, [A, B, C, A, B, C, A, B, C] * 4))
+    assert runs[0] == runs[1]
+    cache = level('random', seed=7)
+    replay(cache, [A, B, C] * 12)
+    assert cache.accesses() == 36
+    assert 0 < cache.hits < 36 - 2  # only the two cold misses are certain
+
+
+def test_spatial_hits_within_a_line():
+    cache = level()
+    assert replay(cache, range(0, 32, 4)) == [False, True, True, True, False, True, True, True]
+
+
+def test_write_back_traffic():
+    cache = level(write='wb')
+    replay(cache, [A] * 10, write=True)
+    memory = cache.next
+    assert (memory.reads, memory.writes) == (1, 0)  # one fill, the writes stay in the cache
+    replay(cache, [B, C])  # C pushes A (dirty) out
+    assert cache.writebacks == 1
+    assert (memory.reads, memory.writes) == (3, 1)
+
+
+def test_write_through_traffic():
+    cache = level(write='wt')
+    replay(cache, [A] * 10, write=True)
+    memory = cache.next
+    assert (memory.reads, memory.writes) == (0, 10)  # no allocation on a write miss
+    assert cache.misses == 10
+    replay(cache, [A, A], write=False)
+    replay(cache, [A] * 3, write=True)  # write hits still go through
+    assert (memory.reads, memory.writes, cache.writebacks) == (1, 13, 0)
+
+
+def test_amat():
+    cache = level()
+    replay(cache, [A, B, A, C, A, B])
+    assert cache.amat() == pytest.approx(1 + 4 / 6 * 100)
+    l2 = Cache('L2', 1024, 4, 16, hit_time=10)
+    l2.next = MainMemory(100)
+    l1 = Cache('L1D', 128, 2, 16)
+    l1.next = l2
+    replay(l1, [A, B, A, C, A, B])
+    # L2 sees the 4 L1 misses: A, B, C cold and B again, which it still has
+    assert (l2.hits, l2.misses) == (1, 3)
+    assert l1.amat() == pytest.approx(1 + 4 / 6 * (10 + 3 / 4 * 100))
+
+
+def test_from_spec():
+    caches = CacheHierarchy.from_spec('l1i=1k:1:16,l1d=2k:4:32:fifo:wt,l2=8k:8:64:lru:wb:12,mem=80')
+    assert (caches.l1i.sets, caches.l1d.policy, caches.l1d.write_back) == (64, 'fifo', False)
+    assert (caches.l2.hit_time, caches.memory.latency) == (12, 80)
+    assert caches.l1i.next is caches.l2 and caches.l2.next is caches.memory
+    with pytest.raises(ValueError):
+        CacheHierarchy.from_spec('l3=1k:1:16')
+    with pytest.raises(ValueError):
+        CacheHierarchy.from_spec('l1d=1k:3:16')
+
+
+LOOP = """
+    ADDI x1, x0, 8
+    ADDI x2, x0, 256
+loop:
+    LW x3, 0(x2)
+    SW x3, 512(x2)
+    ADDI x2, x2, 4
+    ADDI x1, x1, -1
+    BNE x1, x0, loop
+"""
+
+
+def test_observed_run(make_core):
+    core = make_core(LOOP)
+    caches = CacheHierarchy.from_spec('l1i=1k:1:16,l1d=1k:2:16,mem=50').attach(core)
+    Profiler(core, [], {}).attach()  # another observer alongside
+    core.run()
+    assert core.instret == 2 + 8 * 5 == sum(core.profiler.heat)
+    assert caches.l1i.accesses() == core.instret
+    assert caches.l1i.misses == 2  # 7 instructions, 28 bytes, two 16 byte lines
+    # 8 word loads over two lines, 8 word stores over two others (write-back allocates)
+    assert (caches.l1d.accesses(), caches.l1d.misses) == (16, 4)
+    assert core.registers[3] == core.memory.load(256 + 7 * 4, 4)
+    report = caches.report()
+    assert report['levels']['MEM']['reads'] == 2 + 4
+    total = caches.l1i.accesses() + caches.l1d.accesses()
+    assert report['amat'] == pytest.approx((caches.l1i.accesses() * caches.l1i.amat()
+                                            + caches.l1d.accesses() * caches.l1d.amat()) / total)
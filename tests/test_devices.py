@@ -0,0 +1,180 @@
+# test_devices.py
+"""the device bus, UART, timer and DMA seen from programs"""
+import io
+import pytest
+import devices
+from devices import Bus, UART, Timer, DMA, UART_BASE, DMA_BASE, TIMER_BASE
+
+UART_SETUP = "    LUI x1, 0x10000\n"  # x1 = UART_BASE
+DMA_SETUP = "    LUI x1, 0x10001\n"  # x1 = DMA_BASE
+
+
+def with_devices(make_core, source, mapped, **options):
+    """a core for source with mapped, {base: device}, on a bus"""
+    core = make_core(source, **options)
+    bus = Bus()
+    for base, device in mapped.items():
+        bus.map(base, device)
+    bus.attach(core)
+    return core, bus
+
+
+def prints(text):
+    return UART_SETUP + ''.join(f"    ADDI x2, x0, {ord(c)}\n    SB x2, 0(x1)\n" for c in text)
+
+
+def dma(command, src, dst, length):
+    """a program that sets up the DMA registers and starts command, STATUS ends up in x6"""
+    return DMA_SETUP + f"""
+    ADDI x2, x0, {src}
+    SW x2, 0(x1)
+    ADDI x2, x0, {dst}
+    SW x2, 4(x1)
+    ADDI x2, x0, {length}
+    SW x2, 8(x1)
+    ADDI x2, x0, {command}
+    SW x2, 12(x1)
+    LW x6, 16(x1)
+"""
+
+
+def test_uart_output_is_buffered_until_flush(make_core):
+    output = io.BytesIO()
+    core, bus = with_devices(make_core, prints('hi'), {UART_BASE: UART(output)})
+    core.run()
+    assert output.getvalue() == b''
+    bus.flush()
+    assert output.getvalue() == b'hi'
+
+
+def test_uart_flushes_a_full_buffer_in_order(make_core, monkeypatch):
+    monkeypatch.setattr(devices, 'UART_BUFFER', 4)
+    output = io.BytesIO()
+    uart = UART(output)
+    core, bus = with_devices(make_core, prints('abcdefg'), {UART_BASE: uart})
+    core.run()
+    assert output.getvalue() == b'abcd'
+    assert bytes(uart.pending) == b'efg'
+    bus.run()  # Bus.run flushes at the end
+    assert output.getvalue() == b'abcdefg'
+    assert uart.sent == 7
+
+
+def test_uart_input_and_line_status(make_core):
+    source = UART_SETUP + """
+    LBU x2, 5(x1)
+    LBU x3, 0(x1)
+    LBU x4, 0(x1)
+    LBU x5, 5(x1)
+    LBU x6, 0(x1)
+"""
+    core, _ = with_devices(make_core, source, {UART_BASE: UART(io.BytesIO(), io.BytesIO(b'xy'))})
+    core.run()
+    ready, empty = UART.LSR_THR_EMPTY | UART.LSR_DATA_READY, UART.LSR_THR_EMPTY
+    assert core.registers[2:7] == [ready, ord('x'), ord('y'), empty, 0]
+    core, _ = with_devices(make_core, source, {UART_BASE: UART(io.BytesIO())})
+    core.run()
+    assert core.registers[2] == empty  # no input at all
+
+
+def test_timer_counts_instructions(make_core):
+    source = """
+    LUI x1, 0x2000
+    ADDI x2, x0, 6
+    SW x2, 16(x1)
+    SW x0, 20(x1)
+    LW x3, 0(x1)
+    LW x4, 24(x1)
+    ADDI x0, x0, 0
+    LW x5, 0(x1)
+    LW x6, 24(x1)
+"""
+    core, _ = with_devices(make_core, source, {TIMER_BASE: Timer()})
+    core.run()
+    # instret only moves at the end of a run, like Bus.run's slices
+    assert core.registers[3:7] == [0, 0, 0, 0]
+    core, bus = with_devices(make_core, source, {TIMER_BASE: Timer()})
+    bus.run(slice=1)
+    assert core.registers[3:7] == [4, 0, 7, 1]  # compare 6 is reached between the two status reads
+
+
+@pytest.mark.parametrize('paged', [False, True])
+@pytest.mark.parametrize('src, dst', [(256, 260), (260, 256)])
+def test_dma_copy_with_overlap(make_core, monkeypatch, paged, src, dst):
+    monkeypatch.setattr(devices, 'DMA_CHUNK', 4)  # several chunks, back to front when it matters
+    options = {'paged': True, 'memory_size': 1 << 32} if paged else {}
+    core, _ = with_devices(make_core, dma(DMA.COPY, src, dst, 16), {DMA_BASE: DMA()}, **options)
+    original = bytes(range(1, 33))
+    core.memory.write_bytes(256, original)
+    core.run()
+    copied = bytes(core.memory.read_bytes(dst, 16))
+    assert copied == original[src - 256:src - 256 + 16]
+    assert core.registers[6] == 16
+
+
+@pytest.mark.parametrize('paged', [False, True])
+def test_dma_file_to_memory_short_read(make_core, tmp_path, paged):
+    path = tmp_path / 'dma.bin'
+    path.write_bytes(b'0123456789')
+    options = {'paged': True, 'memory_size': 1 << 32} if paged else {}
+    with open(path, 'r+b') as f:
+        core, _ = with_devices(make_core, dma(DMA.FILE_TO_MEMORY, 4, 512, 16), {DMA_BASE: DMA(f)}, **options)
+        core.memory.write_bytes(512, b'\xee' * 20)
+        core.run()
+    assert core.registers[6] == 6  # STATUS: the file ran out after 6 bytes
+    assert bytes(core.memory.read_bytes(512, 8)) == b'456789\xee\xee'
+
+
+def test_dma_memory_to_file(make_core, tmp_path):
+    path = tmp_path / 'dma.bin'
+    path.write_bytes(b'..........')
+    with open(path, 'r+b') as f:
+        core, _ = with_devices(make_core, dma(DMA.MEMORY_TO_FILE, 256, 2, 4), {DMA_BASE: DMA(f)})
+        core.memory.write_bytes(256, b'abcd')
+        core.run()
+    assert core.registers[6] == 4
+    assert path.read_bytes() == b'..abcd....'
+
+
+def test_dma_into_code_invalidates_it(make_core):
+    source = dma(DMA.COPY, 0, 4 * 10, 4) + "    ADDI x7, x0, 1\n"  # word 10 is this ADDI
+    core, _ = with_devices(make_core, source, {DMA_BASE: DMA()})
+    core.run()
+    assert core.registers[7] == 0  # replaced by the LUI at 0 before it ran
+    assert core.registers[1] == DMA_BASE
+
+
+def test_device_over_ram_is_rejected(make_core):
+    core = make_core("    ADDI x0, x0, 0\n", memory_size=8192)
+    bus = Bus()
+    bus.map(0x1000, UART(io.BytesIO()))
+    with pytest.raises(ValueError, match='inside'):
+        bus.attach(core)
+    core = make_core("    ADDI x0, x0, 0\n", paged=True, memory_size=1 << 16)
+    core.memory.store(0x3000, 1, 4)
+    bus = Bus()
+    bus.map(0x3000, UART(io.BytesIO()))
+    with pytest.raises(ValueError, match='already holds RAM'):
+        bus.attach(core)
+
+
+def test_map_rejects_overlap_and_misalignment():
+    bus = Bus()
+    bus.map(UART_BASE, UART(io.BytesIO()))
+    with pytest.raises(ValueError, match='overlaps'):
+        bus.map(UART_BASE, DMA())
+    with pytest.raises(ValueError, match='page aligned'):
+        bus.map(DMA_BASE + 4, DMA())
+
+
+def test_translator_drops_the_flat_fast_path(make_core):
+    output = io.BytesIO()
+    core = make_core(prints('ok') + "    SW x2, 100(x0)\n    LW x3, 100(x0)\n", engine='block')
+    assert core.translator.flat
+    bus = Bus()
+    bus.map(UART_BASE, UART(output))
+    bus.attach(core)
+    assert not core.translator.flat
+    bus.run()
+    assert output.getvalue() == b'ok'
+    assert core.registers[3] == ord('k')
@@ -0,0 +1,109 @@
+# test_elf.py
+"""write_elf and ElfFile agree, and an ELF built from a .apo runs like the .apo"""
+import os
+import pytest
+from conftest import ROOT
+from cpu import ApocaCore
+from elf import ElfFile, write_elf, program_segments, is_elf, PF_R, PF_W, PF_X
+from fileParser import Parser
+
+
+def test_round_trip(tmp_path):
+    code = bytes(range(64))
+    data = b'apocacore data' * 3
+    path = str(tmp_path / 'a.elf')
+    write_elf(path, [(0x1000, code, PF_R | PF_X), (0x3004, data, PF_R | PF_W)], entry=0x1010,
+              symbols={'main': 0x1010, 'table': 0x3004})
+    assert is_elf(path)
+    elf = ElfFile(path)
+    assert elf.entry == 0x1010
+    assert [(s.vaddr, s.filesz, s.memsz, s.flags) for s in elf.segments] == \
+        [(0x1000, len(code), len(code), PF_R | PF_X), (0x3004, len(data), len(data), PF_R | PF_W)]
+    assert elf.symbols == {'main': 0x1010, 'table': 0x3004}
+    assert elf.code_end() == 0x1000 + len(code)
+    for segment, contents in zip(elf.segments, (code, data)):
+        assert elf.map[segment.offset:segment.offset + segment.filesz] == contents
+        assert segment.offset % 0x1000 == segment.vaddr % 0x1000
+
+
+@pytest.mark.parametrize('paged', [False, True])
+def test_load(tmp_path, paged):
+    code = bytes(range(64))
+    data = b'\xff' * 5000  # runs over a page boundary
+    path = str(tmp_path / 'a.elf')
+    write_elf(path, [(0x1000, code, PF_R | PF_X), (0x3004, data, PF_R | PF_W)], entry=0x1010)
+    core = ApocaCore(memory_size=1 << 16, paged=paged)
+    ElfFile(path).load(core)
+    assert bytes(core.memory.read_bytes(0x1000, len(code))) == code
+    assert bytes(core.memory.read_bytes(0x3004, len(data))) == data
+    assert bytes(core.memory.read_bytes(0x3000, 4)) == bytes(4)
+    assert core.pc == 0x1010 >> 2
+    assert core.code_end == 0x1000 + len(code)
+    # the copy on write mapping is private: stores never reach the file
+    core.memory.store(0x3004, 0, 4)
+    again = ElfFile(path)
+    assert again.map[again.segments[1].offset] == 0xff
+
+
+@pytest.mark.parametrize('name', ['test.apo', 'vect.apo'])
+@pytest.mark.parametrize('paged', [False, True])
+def test_runs_like_the_source(tmp_path, name, paged):
+    parser = Parser()
+    code, data = parser.assemble(os.path.join(ROOT, name))
+    path = str(tmp_path / 'prog.elf')
+    write_elf(path, program_segments(code, data), 0, parser.symbols)
+    source = ApocaCore(memory_size=4096)
+    source.load_memory(data)
+    source.load_program(code)
+    source.run()
+    built = ApocaCore(memory_size=4096, paged=paged)
+    ElfFile(path).load(built)
+    built.run()
+    assert built.registers == source.registers
+    assert built.instret == source.instret
+    assert (built.vrf == source.vrf).all()
+
+
+def test_rejects(tmp_path):
+    path = tmp_path / 'not.elf'
+    path.write_bytes(b'#apocacore' + bytes(100))
+    with pytest.raises(ValueError):
+        ElfFile(str(path))
+    path = str(tmp_path / 'big.elf')
+    write_elf(path, [(0x8000, bytes(16), PF_R | PF_X)])
+    with pytest.raises(ValueError):
+        ElfFile(path).load(ApocaCore(memory_size=4096))
+    write_elf(path, [(0, bytes(16), PF_R | PF_X)], entry=2)
+    with pytest.raises(ValueError):
+        ElfFile(path).load(ApocaCore(memory_size=4096))
+
+
+def test_rejects_no_loadable_segments(tmp_path):
+    path = str(tmp_path / 'empty.elf')
+    write_elf(path, [], symbols={'start': 0})
+    with pytest.raises(ValueError, match='empty.elf: no PT_LOAD segments'):
+        ElfFile(path)
+
+
+def test_checked_in_sample():
+    """test.elf in the repository, written once: a reader/writer bug that cancels out cannot pass this"""
+    path = os.path.join(ROOT, 'test.elf')
+    assert is_elf(path)
+    elf = ElfFile(path)
+    assert elf.entry == 0
+    assert [(s.vaddr, s.filesz, s.memsz, s.flags) for s in elf.segments] == \
+        [(0, 64, 64, PF_R | PF_X), (0x200, 68, 68, PF_R | PF_W)]
+    assert elf.symbols == {'start': 0, 'jump1': 56, 'data': 64}
+    assert elf.code_end() == 64
+    # the code segment holds the words test.apo assembles to
+    code, data = Parser().assemble(os.path.join(ROOT, 'test.apo'))
+    text = elf.segments[0]
+    assert [int.from_bytes(elf.map[offset:offset + 4], 'little')
+            for offset in range(text.offset, text.offset + text.filesz, 4)] == code
+    core = ApocaCore(memory_size=4096)
+    elf.load(core)
+    core.run()
+    assert core.registers[10:13] == [5, 5, 10]
+    assert sum(core.registers) == 20
+    assert core.vreg[1][:8].tolist() == [1, 2, 3, 4, 5, 6, 7, 8]
+    assert core.vreg[3][:8].tolist() == [3, 6, 9, 12, 15, 18, 21, 24]
@@ -0,0 +1,113 @@
+# test_ensemble.py
+"""every ensemble instance ends where a single ApocaCore with its data does"""
+import numpy as np
+import pytest
+from cpu import ApocaCore
+from ensemble import Ensemble
+
+# sums the x10 + 3 words at 600, with a data dependent trip count
+SUM = """
+    ADDI x2, x10, 3
+    ADDI x3, x0, 600
+    ADDI x4, x0, 0
+loop:
+    LW x5, 0(x3)
+    ADD x4, x4, x5
+    ADDI x3, x3, 4
+    ADDI x2, x2, -1
+    BNE x2, x0, loop
+    SW x4, 592(x0)
+    DIV x6, x4, x10
+    REM x7, x4, x10
+    SLT x8, x4, x0
+"""
+
+# vector and atomic instructions run lane by lane on the scalar cores
+MIXED = """
+    VSETIVLI x1, 4, e32, m1
+    ADDI x2, x0, 512
+    LV v1, 0(x2)
+    VADD.VX v2, v1, x10
+    SV v2, 16(x2)
+    AMOADD.W x3, x10, (x2)
+    LW x4, 16(x2)
+    LW x5, 0(x2)
+"""
+
+# x1 = (x10 + 1) << 40 << 30: past 64 bits in every lane, the lanes go solo
+OVERFLOW = """
+    ADDI x1, x10, 1
+    SLLI x1, x1, 20
+    SLLI x1, x1, 20
+    SLLI x1, x1, 30
+    ADDI x2, x0, 5
+    SRLI x3, x1, 4
+"""
+
+# lanes other than 0 copy the word of 'ADDI x7, x0, 2' over 'ADDI x6, x0, 1' first
+SELF_MODIFYING = """
+    BEQ x10, x0, plain
+    LW x1, 20(x0)
+    SW x1, 16(x0)
+plain:
+    ADDI x0, x0, 0
+    ADDI x6, x0, 1
+    ADDI x7, x0, 2
+"""
+
+
+def run_both(assemble, source, n, data=None):
+    program, apo_data = assemble(source)
+    ensemble = Ensemble(n, memory_size=2048)
+    ensemble.load_program(program)
+    ensemble.load_memory(apo_data)
+    ensemble.set_register(10, np.arange(n))
+    if data is not None:
+        ensemble.load_data(600, data)
+    ensemble.run()
+    results = ensemble.results()
+    for lane in range(n):
+        core = ApocaCore(memory_size=2048)
+        core.load_memory(apo_data)
+        core.load_program(program)
+        core.registers[10] = lane
+        if data is not None:
+            for i, value in enumerate(data[lane]):
+                core.write_memory(600 + 4 * i, int(value), 4)
+        core.run()
+        assert results[lane]['registers'][1:] == core.registers[1:], lane
+        assert results[lane]['retired'] == core.instret, lane
+        assert bytes(ensemble.memory[lane]) == bytes(core.memory.read_bytes(0, 2048)), lane
+    return ensemble
+
+
+def test_diverging_loops(assemble):
+    data = np.random.default_rng(0).integers(-1000, 1000, (8, 12))
+    run_both(assemble, SUM, 8, data)
+
+
+def test_vector_and_atomics(assemble):
+    ensemble = run_both(assemble, MIXED, 4)
+    assert len(ensemble.cores) == 4
+    assert not ensemble.solo.any()
+
+
+def test_overflow_leaves_the_ensemble(assemble):
+    ensemble = run_both(assemble, OVERFLOW, 3)
+    assert ensemble.solo.all()
+    assert ensemble.results()[2]['registers'][1] == 3 << 70
+
+
+def test_self_modifying_lanes_go_solo(assemble):
+    ensemble = run_both(assemble, SELF_MODIFYING, 3)
+    assert ensemble.solo.tolist() == [False, True, True]
+    assert [result['registers'][6] for result in ensemble.results()] == [1, 0, 0]
+
+
+def test_out_of_range_access_fails_like_a_core(assemble):
+    program, _ = assemble("    LW x1, 2044(x0)\n    LW x1, 2046(x0)\n")
+    ensemble = Ensemble(2, memory_size=2048)
+    ensemble.load_program(program)
+    with pytest.raises(Exception):
+        ensemble.run()
+    assert ensemble.retired.tolist() == [1, 1]
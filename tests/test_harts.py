@@ -0,0 +1,134 @@
+# test_harts.py
+"""LR/SC and AMOs across harts, in one process and over shared memory"""
+import os
+import time
+import pytest
+import harts
+from harts import System
+
+# every hart: 50 x AMOADD on 256, 50 x LR/SC increment of 260, then AMOMAX its id into 264
+COUNTERS = """
+    ADDI x1, x0, 50
+    ADDI x2, x0, 1
+    ADDI x3, x0, 256
+    ADDI x4, x0, 260
+    ADDI x7, x0, 264
+loop:
+    AMOADD.W x0, x2, (x3)
+retry:
+    LR.W x5, (x4)
+    ADDI x5, x5, 1
+    SC.W x6, x5, (x4)
+    BNE x6, x0, retry
+    ADDI x1, x1, -1
+    BNE x1, x0, loop
+    AMOMAX.W x0, x10, (x7)
+"""
+
+# hart 0 reserves 256 and spins, hart 1 stores 5 then 0 back: the value is the
+# same again but the reservation has to be gone
+ABA = """
+    ADDI x3, x0, 256
+    BNE x10, x0, other
+    LR.W x5, (x3)
+    ADDI x1, x0, 20
+spin:
+    ADDI x1, x1, -1
+    BNE x1, x0, spin
+    ADDI x5, x5, 9
+    SC.W x6, x5, (x3)
+    JAL x0, end
+other:
+    ADDI x7, x0, 5
+    SW x7, 0(x3)
+    SW x0, 0(x3)
+end:
+    ADDI x0, x0, 0
+"""
+
+# one SC without a reservation, one after an LR of another word
+UNRESERVED = """
+    ADDI x3, x0, 256
+    ADDI x4, x0, 260
+    ADDI x2, x0, 7
+    SC.W x6, x2, (x3)
+    LR.W x5, (x4)
+    SC.W x7, x2, (x3)
+    LR.W x5, (x3)
+    SC.W x8, x2, (x3)
+    ADDI x4, x0, -3
+    AMOSWAP.W x9, x4, (x3)
+    AMOMINU.W x11, x2, (x3)
+    AMOMIN.W x12, x2, (x3)
+    AMOXOR.W x13, x2, (x3)
+    AMOAND.W x14, x2, (x3)
+    AMOOR.W x15, x2, (x3)
+    LW x1, 0(x3)
+"""
+
+
+def system(assemble, source, **options):
+    program, data = assemble(source)
+    machine = System(memory_size=4096, **options)
+    machine.load_program(program, data)
+    return machine
+
+
+@pytest.mark.parametrize('quantum', [1, 3, 1000])
+@pytest.mark.parametrize('engine', ['interp', 'block'])
+def test_counters(assemble, quantum, engine):
+    machine = system(assemble, COUNTERS, harts=4, quantum=quantum, engine=engine)
+    machine.run()
+    assert machine.memory.load(256, 4) == 200
+    assert machine.memory.load(260, 4) == 200
+    assert machine.memory.load(264, 4) == 3
+
+
+def test_counters_in_processes(assemble):
+    with system(assemble, COUNTERS, harts=4, quantum=7, processes=2) as machine:
+        machine.run()
+        assert machine.memory.load(256, 4) == 200
+        assert machine.memory.load(260, 4) == 200
+        assert machine.memory.load(264, 4) == 3
+    assert [hart.hartid for hart in machine.harts] == [0, 1, 2, 3]
+    assert all(hart.registers[1] == 0 for hart in machine.harts)
+
+
+@pytest.mark.skipif(harts.multiprocessing.get_start_method() != 'fork', reason='the patched worker has to be forked')
+def test_dead_worker_does_not_hang_the_parent(assemble, monkeypatch):
+    run_worker = harts.run_worker
+
+    def dies(worker, *args):
+        if worker == 1:
+            os._exit(3)  # like a kill, no exception reaches run_worker's handler
+        run_worker(worker, *args)
+
+    monkeypatch.setattr(harts, 'run_worker', dies)
+    monkeypatch.setattr(harts, 'POLL', 0.05)
+    start = time.perf_counter()
+    with system(assemble, COUNTERS, harts=4, processes=2) as machine:
+        with pytest.raises(RuntimeError, match='worker 1 exited with code 3'):
+            machine.run()
+    assert time.perf_counter() - start < 10
+
+
+@pytest.mark.parametrize('engine', ['interp', 'block'])
+def test_store_by_another_hart_breaks_the_reservation(assemble, engine):
+    machine = system(assemble, ABA, harts=2, quantum=4, engine=engine)
+    machine.run()
+    assert machine.harts[0].registers[6] == 1
+    assert machine.memory.load(256, 4) == 0
+
+
+def test_reservation_rules(assemble):
+    machine = system(assemble, UNRESERVED, harts=1)
+    machine.run()
+    r = machine.harts[0].registers
+    assert (r[6], r[7], r[8]) == (1, 1, 0)
+    assert r[9] == 7  # the SC stored it
+    assert r[11] == -3  # AMOs hand back the old value signed
+    assert r[12] == 7  # min(0xFFFFFFFD, 7) unsigned
+    assert r[13] == 7  # min(7, 7)
+    assert r[14] == 0  # 7 ^ 7
+    assert r[15] == 0  # 0 & 7
+    assert r[1] == 7  # 0 | 7
@@ -0,0 +1,128 @@
+# test_hostcall.py
+"""host calls behind ECALL: files, the program break, exit"""
+import io
+import os
+import errno
+import pytest
+from hostcall import HostCalls, O_CREAT, O_TRUNC
+
+O_RDONLY, O_WRONLY = 0, 1
+OPEN, CLOSE, LSEEK, READ, WRITE, EXIT, BRK = 1024, 57, 62, 63, 64, 93, 214
+PATH, DATA, BUFFER = 1024, 1536, 2560  # byte addresses used in memory
+
+
+def call(core, number, *args):
+    """one host call straight from Python, x10 comes back signed"""
+    r = core.registers
+    r[5] = number
+    for i, value in enumerate(args):
+        r[10 + i] = value
+    core.host.call(core)
+    return r[10] - (1 << 32) if r[10] >= 1 << 31 else r[10]
+
+
+@pytest.fixture
+def hosted(make_core):
+    def hosted(source="    ADDI x0, x0, 0\n", stdin=None, stdout=None, stderr=None, **options):
+        core = make_core(source, **options)
+        HostCalls(stdin or io.BytesIO(), stdout or io.BytesIO(), stderr or io.BytesIO()).attach(core)
+        return core
+    return hosted
+
+
+def test_file_round_trip(hosted, tmp_path):
+    core = hosted()
+    name = str(tmp_path / 'guest.txt')
+    core.memory.write_bytes(PATH, name.encode() + b'\0')
+    core.memory.write_bytes(DATA, b'hello world')
+    fd = call(core, OPEN, PATH, O_WRONLY | O_CREAT | O_TRUNC, 0o644)
+    assert fd == 3
+    assert call(core, WRITE, fd, DATA, 11) == 11
+    assert call(core, CLOSE, fd) == 0
+    assert open(name, 'rb').read() == b'hello world'
+    fd = call(core, OPEN, PATH, O_RDONLY, 0)
+    assert fd == 3  # the lowest free descriptor again
+    assert call(core, LSEEK, fd, 6, os.SEEK_SET) == 6
+    assert call(core, READ, fd, BUFFER, 16) == 5
+    assert bytes(core.memory.read_bytes(BUFFER, 5)) == b'world'
+    assert call(core, READ, fd, BUFFER, 16) == 0  # end of file
+    assert call(core, LSEEK, fd, -5, os.SEEK_END) == 6
+    assert call(core, CLOSE, fd) == 0
+    assert core.host.bytes_written == 11 and core.host.bytes_read == 5
+    assert core.host.calls == {'open': 2, 'write': 1, 'close': 2, 'lseek': 2, 'read': 2}
+
+
+def test_error_returns(hosted, tmp_path):
+    core = hosted()
+    for number, args in ((READ, (9, BUFFER, 4)), (WRITE, (9, DATA, 4)), (CLOSE, (9,)), (LSEEK, (9, 0, 0))):
+        assert call(core, number, *args) == -errno.EBADF
+    assert call(core, 999) == -errno.ENOSYS
+    core.memory.write_bytes(PATH, str(tmp_path / 'missing').encode() + b'\0')
+    assert call(core, OPEN, PATH, O_RDONLY, 0) == -errno.ENOENT
+    assert call(core, WRITE, 1, 4000, 1000) == -errno.EFAULT  # runs off the end of memory
+    (tmp_path / 'read-only').write_bytes(b'x')
+    core.memory.write_bytes(PATH, str(tmp_path / 'read-only').encode() + b'\0')
+    fd = call(core, OPEN, PATH, O_RDONLY, 0)
+    assert call(core, WRITE, fd, DATA, 4) == -errno.EBADF  # opened for reading only
+
+
+def test_brk_stays_inside_memory(hosted):
+    core = hosted()
+    start = core.image_end
+    assert call(core, BRK, 0) == start
+    assert call(core, BRK, start + 256) == start + 256
+    assert call(core, BRK, len(core.memory) + 4) == start + 256  # past the end: no move
+    assert call(core, BRK, start - 4) == start + 256  # into the image: no move
+    assert call(core, BRK, len(core.memory)) == len(core.memory)
+
+
+def test_exit_flushes_buffered_output(hosted, tmp_path):
+    source = f"""
+    ADDI x5, x0, {WRITE}
+    ADDI x10, x0, 1
+    ADDI x11, x0, {DATA}
+    ADDI x12, x0, 5
+    ECALL
+    ADDI x5, x0, {EXIT}
+    ADDI x10, x0, 7
+    ECALL
+    ADDI x1, x0, 1
+"""
+    path = tmp_path / 'stdout'
+    with open(path, 'wb', buffering=1 << 20) as stdout:
+        core = hosted(source, stdout=stdout)
+        core.memory.write_bytes(DATA, b'bye!\n')
+        core.run(5)
+        assert path.read_bytes() == b''  # still in the host buffer
+        core.run()
+        assert path.read_bytes() == b'bye!\n'
+    assert core.exit_code == 7
+    assert core.registers[1] == 0  # nothing after exit ran
+
+
+@pytest.mark.parametrize('engine', ['interp', 'block'])
+@pytest.mark.parametrize('paged', [False, True])
+def test_read_into_code_is_seen(hosted, assemble, engine, paged):
+    # the second time round the loop runs what read() put over word 1
+    source = """
+    ADDI x8, x0, 2
+loop:
+    ADDI x7, x7, 1
+    ADDI x8, x8, -1
+    BEQ x8, x0, done
+    ADDI x5, x0, 63
+    ADDI x10, x0, 0
+    ADDI x11, x0, 4
+    ADDI x12, x0, 4
+    ECALL
+    JAL x0, loop
+done:
+    ADDI x0, x0, 0
+"""
+    patch = assemble("    ADDI x7, x7, 100\n", 'patch.apo')[0][0].to_bytes(4, 'little')
+    options = {'engine': engine}
+    if paged:
+        options.update(paged=True, memory_size=1 << 16)
+    core = hosted(source, stdin=io.BytesIO(patch), **options)
+    core.run()
+    assert core.registers[7] == 101
@@ -0,0 +1,121 @@
+# test_ilp.py
+"""critical path length and the pcs credited for it"""
+import ilp
+from ilp import ILPAnalyzer, analyze_trace, chain_totals
+from timing import Retirement
+from tracing import Tracer, TraceWriter
+
+# chain A: three dependent ADDIs on x1, then chain B: five on x2. B is the
+# critical path, A has to get no credit for it
+TWO_CHAINS = """
+    ADDI x1, x1, 1
+    ADDI x1, x1, 1
+    ADDI x1, x1, 1
+    ADDI x2, x2, 1
+    ADDI x2, x2, 1
+    ADDI x2, x2, 1
+    ADDI x2, x2, 1
+    ADDI x2, x2, 1
+"""
+
+# the LW of 100 waits for the SW to 100, the LW of 200 does not wait for anything
+THROUGH_MEMORY = """
+    ADDI x1, x1, 1
+    ADDI x1, x1, 1
+    SW x1, 100(x0)
+    LW x2, 200(x0)
+    LW x3, 100(x0)
+    ADDI x3, x3, 1
+"""
+
+# the AMOADD waits for x1 and the LW of 100 waits for the AMOADD
+THROUGH_ATOMIC = """
+    ADDI x1, x1, 1
+    ADDI x1, x1, 1
+    ADDI x4, x0, 100
+    AMOADD.W x0, x1, (x4)
+    LW x3, 100(x0)
+    ADDI x3, x3, 1
+"""
+
+LONG_LOOP = """
+    ADDI x1, x0, 400
+loop:
+    ADDI x2, x2, 3
+    ADDI x1, x1, -1
+    BNE x1, x0, loop
+"""
+
+
+def analyze(make_core, source, **options):
+    core = make_core(source)
+    analyzer = ILPAnalyzer(**options)
+    Retirement(analyzer).attach(core)
+    core.run()
+    return analyzer
+
+
+def test_credits_only_the_critical_chain(make_core):
+    report = analyze(make_core, TWO_CHAINS).report()
+    assert report['critical_path'] == 5
+    assert sorted(spot['address'] for spot in report['critical_pcs']) == [12, 16, 20, 24, 28]
+    assert all(spot['share'] == 0.2 for spot in report['critical_pcs'])
+
+
+def test_chain_through_memory(make_core):
+    report = analyze(make_core, THROUGH_MEMORY).report()
+    assert report['critical_path'] == 5
+    assert sorted(spot['address'] for spot in report['critical_pcs']) == [0, 4, 8, 16, 20]
+
+
+def test_chain_through_atomic(make_core):
+    report = analyze(make_core, THROUGH_ATOMIC).report()
+    assert report['critical_path'] == 5
+    assert sorted(spot['address'] for spot in report['critical_pcs']) == [0, 4, 12, 16, 20]
+
+
+def test_report_leaves_the_windows_open(make_core):
+    whole = analyze(make_core, LONG_LOOP, windows=(16, 1024)).report()
+    core = make_core(LONG_LOOP)
+    analyzer = ILPAnalyzer(windows=(16, 1024))
+    Retirement(analyzer).attach(core)
+    core.run(50)
+    first = analyzer.report()
+    assert analyzer.report() == first
+    assert analyzer.table() == analyzer.table()
+    assert first['windows'][1024]['blocks'] == 1  # the partial window counts, but stays open
+    core.run()
+    assert analyzer.report() == whole
+
+
+def test_latencies(make_core):
+    report = analyze(make_core, THROUGH_MEMORY, latencies={'load': 4}).report()
+    assert report['critical_path'] == 8
+    assert {spot['address']: spot['cycles'] for spot in report['critical_pcs']}[16] == 4
+
+
+def test_folded_totals_add_up(make_core):
+    analyzer = analyze(make_core, LONG_LOOP)
+    assert analyzer.depth == 1 + 400 + 1  # x1 = 400, the decrements, the last BNE
+    totals = chain_totals(analyzer.tail)  # keyed by word pc
+    assert sum(totals.values()) == analyzer.depth
+    assert totals == {0: 1, 2: 400, 3: 1}
+
+
+def test_stored_words_are_bounded(make_core, monkeypatch):
+    monkeypatch.setattr(ilp, 'STORED_WORDS', 8)
+    source = ''.join(f"    SW x0, {4 * i}(x0)\n" for i in range(20))
+    analyzer = analyze(make_core, source)
+    assert list(analyzer.stored) == list(range(12, 20))
+
+
+def test_trace_matches_live(make_core, tmp_path):
+    for source in (TWO_CHAINS, THROUGH_MEMORY, THROUGH_ATOMIC, LONG_LOOP):
+        live = analyze(make_core, source).report()
+        core = make_core(source)
+        path = str(tmp_path / 'run.trace')
+        writer = TraceWriter(path)
+        Tracer(core, writer).attach()
+        core.run()
+        writer.close()
+        assert analyze_trace(path, ILPAnalyzer()).report() == live
@@ -0,0 +1,75 @@
+# test_memory.py
+"""flat and paged memory answer every access the same way"""
+import numpy as np
+import pytest
+from memory import Memory, PagedMemory, PAGE_SIZE
+
+SIZE = 1 << 16
+
+
+def both():
+    return Memory(SIZE), PagedMemory(SIZE)
+
+
+@pytest.mark.parametrize('size', [1, 2, 4, 8])
+def test_load_store(size):
+    rng = np.random.default_rng(size)
+    flat, paged = both()
+    # addresses on both sides of page boundaries, unaligned ones too
+    addresses = [PAGE_SIZE - 1, PAGE_SIZE - size, 3 * PAGE_SIZE - 2, 0, SIZE - size, 777]
+    for address in addresses:
+        value = int(rng.integers(0, 1 << 62)) - (1 << 61)
+        flat.store(address, value, size)
+        paged.store(address, value, size)
+        assert paged.load(address, size) == flat.load(address, size) == value & ((1 << (8 * size)) - 1)
+        assert paged.load_signed(address, size) == flat.load_signed(address, size)
+    assert bytes(paged.read_bytes(0, SIZE)) == bytes(flat.data)
+
+
+def test_bulk_copies():
+    flat, paged = both()
+    data = bytes(range(256)) * 40  # spans three pages
+    for memory in (flat, paged):
+        memory.write_bytes(PAGE_SIZE - 100, data)
+        memory.load_words(8, [1, 2, 0xFFFFFFFF])
+    assert bytes(paged.read_bytes(PAGE_SIZE - 100, len(data))) == data
+    assert bytes(paged.read_bytes(0, SIZE)) == bytes(flat.data)
+    assert [paged.words[i] for i in range(2, 5)] == [flat.words[i] for i in range(2, 5)] == [1, 2, 0xFFFFFFFF]
+
+
+@pytest.mark.parametrize('size', [1, 4, 8])
+def test_gather_scatter(size):
+    rng = np.random.default_rng(size)
+    flat, paged = both()
+    addresses = np.array([PAGE_SIZE - 2, 5, 2 * PAGE_SIZE + 3, SIZE - size, 4 * PAGE_SIZE - 1], dtype=np.int64)
+    rows = rng.integers(0, 256, (len(addresses), size), dtype=np.uint8)
+    flat.scatter(addresses, rows)
+    paged.scatter(addresses, rows)
+    assert bytes(paged.read_bytes(0, SIZE)) == bytes(flat.data)
+    assert np.array_equal(paged.gather(addresses, size), flat.gather(addresses, size))
+    assert np.array_equal(flat.gather(addresses, size), rows)
+
+
+def test_pages_appear_on_first_write():
+    paged = PagedMemory(1 << 32)
+    assert paged.load(0xFFFF0000, 4) == 0
+    assert paged.resident_pages() == []
+    paged.store(0xFFFF0000, 5, 4)
+    paged.store(0x1000, 5, 1)
+    assert sorted(paged.resident_pages()) == [1, 0xFFFF0]
+    assert paged.load(0xFFFF0000, 4) == 5
+
+
+def test_paged_size_is_a_power_of_two():
+    with pytest.raises(ValueError):
+        PagedMemory(10000)
+
+
+@pytest.mark.parametrize('paged', [False, True])
+def test_core_runs_the_same(make_core, paged):
+    core = make_core('vect.apo', paged=paged, memory_size=4096)
+    reference = make_core('vect.apo', memory_size=4096)
+    core.run()
+    reference.run()
+    assert core.registers == reference.registers
+    assert (core.vrf == reference.vrf).all()
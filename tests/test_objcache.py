@@ -0,0 +1,128 @@
+# test_objcache.py
+"""the object cache against a plain assemble, invalidation and broken objects"""
+import os
+import pytest
+import objcache
+from fileParser import Parser
+from cpu import ApocaCore
+from objcache import ObjectCache, ObjectFile, source_key, write_object
+
+SOURCE = """
+data: .word 7, -1, 0x10
+start:
+    ADDI x1, x0, 3
+loop:
+    ADDI x1, x1, -1
+    BNE x1, x0, loop
+    LW x2, 0(x0)
+"""
+
+
+@pytest.fixture
+def program(tmp_path):
+    path = tmp_path / 'prog.apo'
+    path.write_text(SOURCE)
+    return str(path)
+
+
+def assembled(filename, cache=None):
+    parser = Parser()
+    parser.obj_cache = cache
+    code, data = parser.assemble(filename)
+    return list(code), [list(segment) for segment in data], dict(parser.symbols), \
+        [parser.source[pc] for pc in range(len(parser.source))]
+
+
+def test_hit_matches_a_plain_assemble(program, tmp_path):
+    cache = ObjectCache(str(tmp_path / 'cache'))
+    plain = assembled(program)
+    first = assembled(program, cache)
+    second = assembled(program, cache)
+    assert (cache.misses, cache.hits) == (1, 1)
+    assert first == plain
+    code, data, symbols, source = second
+    assert code == plain[0] and symbols == plain[2] and source == plain[3]
+    # the object keeps data as unsigned 64 bit values, memory ends up the same
+    images = []
+    for program_data in (plain[1], data):
+        core = ApocaCore(memory_size=4096)
+        core.load_memory(program_data)
+        images.append([core.memory.load(address, 4) for address in range(512, 536, 4)])
+    assert images[0] == images[1] == [7, 0xFFFFFFFF, 0x10, 0, 0, 0]
+
+
+def test_changed_source_misses(program, tmp_path):
+    cache = ObjectCache(str(tmp_path / 'cache'))
+    assembled(program, cache)
+    with open(program, 'a') as f:
+        f.write("    ADDI x3, x0, 1\n")
+    code = assembled(program, cache)[0]
+    assert (cache.misses, cache.hits) == (2, 0)
+    assert len(code) == 5
+    assert len(os.listdir(cache.directory)) == 2
+
+
+def test_assembler_version_is_part_of_the_key(program, tmp_path, monkeypatch):
+    cache = ObjectCache(str(tmp_path / 'cache'))
+    key = source_key(program)
+    assembled(program, cache)
+    monkeypatch.setattr(objcache, 'ASSEMBLER_VERSION', objcache.ASSEMBLER_VERSION + 1)
+    assert source_key(program) != key
+    assembled(program, cache)
+    assert (cache.misses, cache.hits) == (2, 0)
+
+
+def break_object(path, how):
+    with open(path, 'rb') as f:
+        image = bytearray(f.read())
+    if how == 'truncated':
+        image = image[:-3]
+    elif how == 'header':
+        image = image[:10]
+    elif how == 'magic':
+        image[:8] = b'NOTANOBJ'
+    elif how == 'counts':
+        image[12:16] = (1 << 20).to_bytes(4, 'little')  # far more words than the file holds
+    elif how == 'names':
+        image[image.find(b'start') + 2] = ord('\n')  # one symbol name more than symbols
+    elif how == 'empty':
+        image = b''
+    with open(path, 'wb') as f:
+        f.write(image)
+
+
+@pytest.mark.parametrize('how', ['truncated', 'header', 'magic', 'counts', 'names', 'empty'])
+def test_broken_objects_are_rejected(program, tmp_path, how):
+    cache = ObjectCache(str(tmp_path / 'cache'))
+    plain = assembled(program, cache)
+    path = cache.path(source_key(program))
+    break_object(path, how)
+    with pytest.raises(ValueError):
+        ObjectFile(path)
+    # the cache assembles again and writes a good object over the broken one
+    assert assembled(program, cache) == plain
+    assert (cache.misses, cache.hits) == (2, 0)
+    assert assembled(program, cache)[0] == plain[0]
+    assert cache.hits == 1
+
+
+def test_write_is_atomic(program, tmp_path, monkeypatch):
+    code, data, symbols, source = assembled(program)
+    path = str(tmp_path / 'prog.apobj')
+    seen = []
+
+    def replace(src, dst):
+        seen.append((os.path.dirname(src), os.path.exists(dst), os.path.getsize(src)))
+        raise OSError('disk full')
+
+    monkeypatch.setattr(os, 'replace', replace)
+    with pytest.raises(OSError):
+        write_object(path, code, data, symbols, source)
+    # the whole image went to a temporary next to the target, the target never appeared
+    directory, existed, size = seen[0]
+    assert directory == str(tmp_path) and not existed and size > 0
+    assert os.listdir(tmp_path) == ['prog.apo']  # and the temporary is gone
+    monkeypatch.undo()
+    write_object(path, code, data, symbols, source)
+    assert list(ObjectFile(path).code) == code
+    assert sorted(os.listdir(tmp_path)) == ['prog.apo', 'prog.apobj']
@@ -0,0 +1,76 @@
+# test_ooo.py
+"""out-of-order timing on small kernels with known dependencies"""
+import ooo
+from ooo import OutOfOrder, parse_units
+from timing import Retirement
+
+CHAIN = "    ADDI x1, x1, 1\n" * 40
+INDEPENDENT = ''.join(f"    ADDI x{1 + i % 8}, x0, {i}\n" for i in range(40))
+# a slow load, one use of it, then 40 ops that do not need it
+BEHIND_A_LOAD = "    LW x1, 0(x0)\n    ADDI x2, x1, 1\n" + \
+    ''.join(f"    ADDI x{3 + i % 8}, x0, {i}\n" for i in range(40))
+
+
+def modelled(make_core, source, **options):
+    core = make_core(source)
+    model = OutOfOrder(**options)
+    Retirement(model).attach(core)
+    core.run()
+    return model.report()
+
+
+def test_dependent_chain(make_core):
+    report = modelled(make_core, CHAIN, units=parse_units('alu=4:1'))
+    # one a cycle whatever the width, front_depth + 3 cycles to fill and drain
+    assert (report['instructions'], report['cycles']) == (40, 45)
+    assert report['stalls']['dependency'] > 0
+    assert report['stalls']['ports'] == report['stalls']['rob_full'] == 0
+
+
+def test_independent_ops_fill_the_width(make_core):
+    report = modelled(make_core, INDEPENDENT, units=parse_units('alu=4:1'))
+    assert report['cycles'] == 40 // 4 + 5
+    assert report['ipc'] > 2.5
+    assert report['stalls']['dependency'] == 0
+
+
+def test_width_limits_ipc(make_core):
+    report = modelled(make_core, INDEPENDENT, width=2, units=parse_units('alu=4:1'))
+    assert report['cycles'] == 40 // 2 + 5
+    assert report['ipc'] <= 2
+
+
+def test_alu_count_limits_ipc(make_core):
+    report = modelled(make_core, INDEPENDENT)  # the default 2 ALUs
+    assert report['cycles'] == 40 // 2 + 5
+    assert report['stalls']['ports'] > 0
+    assert report['units']['alu']['issued'] == 40
+
+
+def test_rob_limits_run_ahead(make_core):
+    units = parse_units('lsu=1:20,alu=4:1')
+    small = modelled(make_core, BEHIND_A_LOAD, rob_size=4, units=units)
+    large = modelled(make_core, BEHIND_A_LOAD, rob_size=64, units=units)
+    assert small['stalls']['rob_full'] > 0
+    assert large['stalls']['rob_full'] == 0
+    assert small['cycles'] > large['cycles']
+
+
+def test_loads_wait_for_stores_and_atomics(make_core):
+    waits = {}
+    for name, source in (('store', "    SW x1, 100(x0)\n"), ('amo', "    AMOADD.W x0, x1, (x4)\n")):
+        for word in (100, 200):
+            head = "    ADDI x4, x0, 100\n    ADDI x1, x0, 1\n"
+            report = modelled(make_core, head + source + f"    LW x3, {word}(x0)\n")
+            waits[name, word] = report['stalls']['dependency']
+    assert waits['store', 100] > waits['store', 200]
+    assert waits['amo', 100] > waits['amo', 200]
+
+
+def test_stored_words_are_bounded(make_core, monkeypatch):
+    monkeypatch.setattr(ooo, 'STORED_WORDS', 8)
+    core = make_core(''.join(f"    SW x0, {4 * i}(x0)\n" for i in range(20)))
+    model = OutOfOrder()
+    Retirement(model).attach(core)
+    core.run()
+    assert list(model.stored) == list(range(12, 20))
@@ -0,0 +1,77 @@
+# test_pipeline.py
+"""in-order pipeline cycle counts for hazards with and without forwarding"""
+import pytest
+from pipeline import Pipeline
+from predictor import BranchUnit, make_predictor
+from timing import Retirement
+
+CHAIN = "    ADDI x1, x1, 1\n" * 10
+INDEPENDENT = ''.join(f"    ADDI x{1 + i}, x0, {i}\n" for i in range(10))
+LOAD_USE = "    LW x1, 0(x0)\n    ADDI x2, x1, 1\n"
+LOAD_THEN_OTHER = "    LW x1, 0(x0)\n    ADDI x3, x0, 1\n    ADDI x2, x1, 1\n"
+LOOP = """
+    ADDI x1, x0, 10
+loop:
+    ADDI x1, x1, -1
+    BNE x1, x0, loop
+"""
+
+
+def modelled(make_core, source, **options):
+    core = make_core(source)
+    model = Pipeline(**options)
+    Retirement(model).attach(core)
+    core.run()
+    return model.report()
+
+
+def test_no_hazards_one_per_cycle(make_core):
+    for forwarding in ('full', 'mem', 'none'):
+        report = modelled(make_core, INDEPENDENT, forwarding=forwarding)
+        # EX of the first in cycle 2, one more per instruction, MEM and WB after the last
+        assert report['cycles'] == 2 + 9 + 3
+        assert sum(report['stalls'].values()) == 0
+
+
+@pytest.mark.parametrize('forwarding, stalls', [('full', 0), ('mem', 9), ('none', 18)])
+def test_raw_chain(make_core, forwarding, stalls):
+    report = modelled(make_core, CHAIN, forwarding=forwarding)
+    assert report['stalls']['raw'] == stalls
+    assert report['cycles'] == 14 + stalls
+    assert report['cpi'] == pytest.approx(report['cycles'] / 10)
+
+
+@pytest.mark.parametrize('forwarding, stalls', [('full', 1), ('mem', 1), ('none', 2)])
+def test_load_use(make_core, forwarding, stalls):
+    report = modelled(make_core, LOAD_USE, forwarding=forwarding)
+    assert report['stalls']['load_use'] == stalls
+    assert report['stalls']['raw'] == 0
+    assert report['cycles'] == 2 + 1 + stalls + 3
+
+
+def test_load_use_hidden_by_an_independent_op(make_core):
+    report = modelled(make_core, LOAD_THEN_OTHER)
+    assert report['stalls']['load_use'] == 0
+    assert report['cycles'] == 2 + 2 + 3
+
+
+def test_taken_branches_flush(make_core):
+    ex = modelled(make_core, LOOP, branch_stage='ex')
+    id_ = modelled(make_core, LOOP, branch_stage='id')
+    # 9 taken BNEs, the last falls through
+    assert (ex['stalls']['branch'], id_['stalls']['branch']) == (18, 9)
+    assert ex['cycles'] - id_['cycles'] == 9
+
+
+def test_predicted_branches_do_not_flush(make_core):
+    plain = modelled(make_core, LOOP)
+    predicted = modelled(make_core, LOOP, branches=BranchUnit(make_predictor('bimodal')))
+    assert predicted['stalls']['branch'] < plain['stalls']['branch']
+    assert predicted['branches']['branches'] == 10
+
+
+def test_rejects_bad_options():
+    with pytest.raises(ValueError):
+        Pipeline(forwarding='some')
+    with pytest.raises(ValueError):
+        Pipeline(branch_stage='mem')
@@ -0,0 +1,98 @@
+# test_predictor.py
+"""direction predictor accuracy on fixed patterns and BTB hits"""
+import pytest
+from predictor import BTB, BranchUnit, make_predictor
+from timing import Retirement
+
+PC = 40
+
+
+def accuracy(predictor, pattern):
+    right = 0
+    for taken in pattern:
+        right += predictor.predict(PC, PC - 4) == taken
+        predictor.update(PC, PC - 4, taken)
+    return right / len(pattern)
+
+
+ALTERNATING = [True, False] * 200
+LOOP_EXIT = ([True] * 9 + [False]) * 40
+
+
+def test_bimodal_cannot_follow_alternation():
+    # weakly not taken to start, every outcome pushes the counter to the wrong side
+    assert accuracy(make_predictor('bimodal'), ALTERNATING) == 0.0
+
+
+@pytest.mark.parametrize('name', ['gshare', 'tournament'])
+def test_history_learns_alternation(name):
+    assert accuracy(make_predictor(name), ALTERNATING) > 0.95
+
+
+def test_bimodal_misses_only_loop_exits():
+    # 2 warm up misses, then only the exit each time round
+    assert accuracy(make_predictor('bimodal'), LOOP_EXIT) == pytest.approx((400 - 40 - 1) / 400)
+
+
+def test_gshare_learns_loop_exits():
+    # the history has to reach back past 8 takens to tell the 9th from the exit
+    assert accuracy(make_predictor('gshare', history=10), LOOP_EXIT) > 0.95
+
+
+def test_static_predictors():
+    assert accuracy(make_predictor('static-taken'), LOOP_EXIT) == 0.9
+    assert accuracy(make_predictor('static-not-taken'), LOOP_EXIT) == pytest.approx(0.1)
+    assert accuracy(make_predictor('btfn'), LOOP_EXIT) == 0.9  # the target is behind PC
+    with pytest.raises(ValueError):
+        make_predictor('perfect')
+
+
+def test_btb():
+    btb = BTB(8)
+    assert btb.lookup(3) is None
+    btb.update(3, 100)
+    assert btb.lookup(3) == 100
+    btb.update(11, 200)  # same entry, evicts pc 3
+    assert (btb.lookup(3), btb.lookup(11)) == (None, 200)
+    with pytest.raises(ValueError):
+        BTB(12)
+
+
+# every other trip round the loop skips an ADDI, then a call and a return
+ALTERNATE_AND_CALL = """
+    ADDI x5, x0, 40
+loop:
+    ANDI x6, x5, 1
+    BEQ x6, x0, even
+    ADDI x7, x7, 1
+even:
+    JAL x1, function
+    ADDI x5, x5, -1
+    BNE x5, x0, loop
+    JAL x0, end
+function:
+    ADDI x8, x8, 1
+    JALR x0, x1, 0
+end:
+"""
+
+
+@pytest.mark.parametrize('name, better', [('bimodal', False), ('gshare', True), ('tournament', True)])
+def test_branch_unit_on_a_run(make_core, name, better):
+    core = make_core(ALTERNATE_AND_CALL)
+    unit = BranchUnit(make_predictor(name))
+    Retirement(unit).attach(core)
+    core.run()
+    assert core.registers[7] == 20 and core.registers[8] == 40
+    report = unit.report()
+    assert report['branches'] == 80
+    beq = report['per_pc'][8]
+    assert (beq['executed'], beq['taken']) == (40, 20)
+    if better:
+        assert beq['accuracy'] > 0.85
+    else:
+        assert beq['accuracy'] < 0.1
+    # the call, the return (always back to the same place) and the final jump
+    # each miss the BTB once, then hit
+    assert report['jumps'] == 40 + 40 + 1
+    assert report['btb_misses'] == 3
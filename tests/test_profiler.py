@@ -0,0 +1,107 @@
+# test_profiler.py
+"""per pc, per mnemonic and per symbol counts of a profiled run"""
+import json
+import pytest
+from fileParser import Parser
+from cpu import ApocaCore
+from profiler import Profiler
+
+LOOP = """
+start:
+    ADDI x1, x0, 5
+loop:
+    ADDI x2, x2, 3
+    JAL x5, add_one
+    ADDI x1, x1, -1
+    BNE x1, x0, loop
+    JAL x0, end
+add_one:
+    ADDI x3, x3, 1
+    JALR x0, x5, 0
+end:
+"""
+
+
+@pytest.fixture
+def profiled(tmp_path):
+    path = tmp_path / 'loop.apo'
+    path.write_text(LOOP)
+    parser = Parser()
+    program, data = parser.assemble(str(path))
+    core = ApocaCore(memory_size=4096)
+    core.load_memory(data)
+    core.load_program(program)
+    profiler = Profiler(core, parser.source, parser.symbols).attach()
+    core.run()
+    return core, profiler
+
+
+def test_per_pc_counts(profiled):
+    core, profiler = profiled
+    assert profiler.heat == [1, 5, 5, 5, 5, 1, 5, 5]
+    assert profiler.instructions == core.instret == sum(profiler.heat) == 32
+    spots = profiler.hot_spots()
+    assert [spot['pc'] for spot in spots[:6]] == [1, 2, 3, 4, 6, 7]  # ties keep pc order
+    assert spots[0]['line'] == 5 and spots[0]['source'] == 'ADDI x2, x2, 3'
+    assert len(profiler.hot_spots(3)) == 3
+
+
+def test_mnemonic_and_class_counts(profiled):
+    _, profiler = profiled
+    mnemonics, classes = profiler.counts()
+    assert mnemonics == {'ADDI': 1 + 5 + 5 + 5, 'JAL': 5 + 1, 'BNE': 5, 'JALR': 5}
+    assert classes == {'ALU_IMM': 16, 'JAL': 6, 'BRANCH': 5, 'JALR': 5}
+
+
+def test_symbol_attribution(profiled):
+    _, profiler = profiled
+    assert profiler.symbol(0) == 'start'
+    assert profiler.symbol(4) == 'loop'
+    assert profiler.symbol(12) == 'loop+0x8'  # between loop and add_one
+    assert profiler.symbol(28) == 'add_one+0x4'
+    assert profiler.by_symbol() == {'loop': 21, 'add_one': 10, 'start': 1}
+    assert Profiler(profiler.core, [], {'late': 8}).symbol(4) is None  # nothing at or below
+
+
+def test_json_schema(profiled, tmp_path):
+    _, profiler = profiled
+    path = tmp_path / 'profile.json'
+    profiler.write_json(str(path))
+    report = json.loads(path.read_text())
+    assert set(report) == {'instructions', 'wall_time', 'instructions_per_second',
+                           'mnemonics', 'classes', 'symbols', 'pcs'}
+    assert report['instructions'] == 32 and report['wall_time'] > 0
+    assert list(report['mnemonics'])[0] == 'ADDI'  # hottest first
+    assert report['symbols'] == profiler.by_symbol()
+    assert set(report['pcs'][0]) == {'pc', 'address', 'count', 'symbol', 'mnemonic', 'line', 'source'}
+    assert report['pcs'][0] == {'pc': 1, 'address': 4, 'count': 5, 'symbol': 'loop',
+                                'mnemonic': 'ADDI', 'line': 5, 'source': 'ADDI x2, x2, 3'}
+
+
+def test_table(profiled):
+    _, profiler = profiled
+    text = profiler.table(top=2)
+    assert text.startswith('32 instructions in')
+    assert 'ADDI x2, x2, 3' in text and 'add_one' in text
+
+
+@pytest.mark.parametrize('engine', ['interp', 'block'])
+def test_counts_of_overwritten_code(make_core, engine):
+    # the second time round, the SW has turned ADDI x3 into a copy of the last ORI
+    core = make_core("""
+    LW x6, 28(x0)
+    ADDI x1, x0, 2
+loop:
+    ADDI x3, x3, 1
+    ADDI x4, x4, 1
+    SW x6, 8(x0)
+    ADDI x1, x1, -1
+    BNE x1, x0, loop
+    ORI x7, x7, 8
+""", engine=engine)
+    profiler = Profiler(core).attach()
+    core.run()
+    assert (core.registers[3], core.registers[4], core.registers[7]) == (1, 2, 8)
+    mnemonics, _ = profiler.counts()
+    assert mnemonics == {'LW': 1, 'ADDI': 1 + 1 + 2 + 2, 'ORI': 1 + 1, 'SW': 2, 'BNE': 2}
+    assert profiler.heat[2] == 2  # the pc counts whatever was there
@@ -0,0 +1,90 @@
+# test_sampling.py
+"""sampled runs end where full runs do and measure what they say they measured"""
+import pytest
+from cache import CacheHierarchy
+from sampling import Sampler, parse_sample, basic_block_vectors
+from timing import Retirement
+from pipeline import Pipeline
+
+# a streaming phase over 2 KiB, then a compute phase on registers, twice
+PHASES = """
+    ADDI x9, x0, 2
+again:
+    ADDI x1, x0, 0
+    ADDI x2, x0, 512
+stream:
+    LW x3, 1024(x1)
+    ADD x4, x4, x3
+    SW x4, 1024(x1)
+    ADDI x1, x1, 4
+    BNE x1, x2, stream
+    ADDI x5, x0, 300
+compute:
+    MUL x6, x6, x5
+    ADDI x6, x6, 1
+    ADDI x5, x5, -1
+    BNE x5, x0, compute
+    ADDI x9, x9, -1
+    BNE x9, x0, again
+"""
+
+
+def plain(make_core):
+    core = make_core(PHASES)
+    core.run()
+    return core
+
+
+def detailed_core(make_core):
+    core = make_core(PHASES)
+    CacheHierarchy.from_spec().attach(core)
+    Retirement(Pipeline()).attach(core)
+    return core
+
+
+def test_periodic(make_core):
+    core = detailed_core(make_core)
+    sampler = Sampler(core, 300, 50, 100)
+    report = sampler.run()
+    reference = plain(make_core)
+    assert core.registers == reference.registers
+    assert report['instructions'] == core.instret == reference.instret
+    assert report['functional_instructions'] + report['detailed_instructions'] == core.instret
+    assert all(sample['instructions'] == 100 for sample in report['samples'])
+    assert len(report['samples']) == core.instret // 450
+    assert core.translator.blocks  # the fast forward went through compiled blocks
+    assert 'Pipeline CPI' in report['estimates'] and 'L1D MPKI' in report['estimates']
+    assert core.observers  # the detailed models are attached again afterwards
+
+
+def test_simpoints(make_core):
+    core = detailed_core(make_core)
+    report = Sampler(core, 0, 50, 200).simpoints(4)
+    reference = plain(make_core)
+    assert core.registers == reference.registers
+    assert core.instret == reference.instret
+    assert 1 <= report['clusters'] <= 4
+    assert sum(sample['weight'] for sample in report['samples']) == pytest.approx(1.0)
+
+
+def test_basic_block_vectors(make_core):
+    core = make_core(PHASES)
+    vectors, lengths = basic_block_vectors(core, 250)
+    assert sum(lengths) == core.instret == plain(make_core).instret
+    assert all(sum(vector.values()) == length for vector, length in zip(vectors, lengths))
+    assert not core.observers
+
+
+def test_needs_a_detailed_model(make_core):
+    with pytest.raises(ValueError):
+        Sampler(make_core(PHASES))
+
+
+@pytest.mark.parametrize('spec', ['10:5:0', '1:2', 'a:b:c', '-1:5:10'])
+def test_parse_sample_rejects(spec):
+    with pytest.raises(ValueError):
+        parse_sample(spec)
+
+
+def test_parse_sample():
+    assert parse_sample('1000:100:50') == (1000, 100, 50)
@@ -0,0 +1,101 @@
+# test_snapshot.py
+"""snapshots in memory and checkpoint chains on disk give back the same machine"""
+import pytest
+from cpu import ApocaCore
+from snapshot import Checkpointer, load_chain, write_checkpoint, Snapshot
+
+# stores one word every 1000 bytes, so the pages change one after another
+WALK = """
+    ADDI x1, x0, 0
+    ADDI x2, x0, 9
+    LUI x3, 2
+loop:
+    SW x2, 512(x1)
+    ADDI x1, x1, 1000
+    ADDI x2, x2, 7
+    BLT x1, x3, loop
+    VSETIVLI x0, 4, e32, m1
+    VADD.VX v1, v1, x2
+"""
+
+
+def size(paged):
+    """flat memory ends in a short page, paged memory has to be a power of two"""
+    return 16384 if paged else 10000
+
+
+def machine(core):
+    return (list(core.registers), core.pc, core.instret, core.vl, core.vrf.tobytes(),
+            bytes(core.memory.read_bytes(0, len(core.memory))))
+
+
+@pytest.mark.parametrize('paged', [False, True])
+def test_snapshot_restore(make_core, paged):
+    core = make_core(WALK, memory_size=size(paged), paged=paged)
+    core.run(13)
+    middle = core.snapshot()
+    core.run()
+    end = machine(core)
+    core.restore(middle)
+    assert core.instret == 13
+    core.run()
+    assert machine(core) == end
+
+
+def test_restore_needs_the_same_memory(make_core):
+    snapshot = make_core(WALK, memory_size=10000).snapshot()
+    with pytest.raises(ValueError):
+        make_core(WALK, memory_size=8192).restore(snapshot)
+    with pytest.raises(ValueError):
+        make_core(WALK, memory_size=16384, paged=True).restore(snapshot)
+
+
+@pytest.mark.parametrize('compress', [False, True])
+@pytest.mark.parametrize('paged', [False, True])
+def test_checkpoint_chain(make_core, tmp_path, paged, compress):
+    core = make_core(WALK, memory_size=size(paged), paged=paged)
+    checkpoints = Checkpointer(core, compress=compress)
+    paths, states, written = [], [], []
+    while core.pc < core.program_length:
+        core.run(9)
+        path = str(tmp_path / f'run.{checkpoints.sequence:04d}.snap')
+        written.append(checkpoints.write(path))
+        paths.append(path)
+        states.append(machine(core))
+    assert len(paths) > 3
+    assert max(written[1:]) <= 2  # only the pages the last 9 instructions stored to
+    for i, state in enumerate(states):
+        fresh = make_core(WALK, memory_size=size(paged), paged=paged)
+        fresh.restore(load_chain(paths[:i + 1]))
+        assert machine(fresh) == state
+    # and a run picked up from the middle finishes like the original
+    fresh = make_core(WALK, memory_size=size(paged), paged=paged)
+    fresh.restore(load_chain(paths[:2]))
+    fresh.run()
+    assert machine(fresh) == states[-1]
+
+
+def test_chain_order(make_core, tmp_path):
+    core = make_core(WALK, memory_size=10000)
+    first, second = Checkpointer(core), Checkpointer(core)
+    paths = []
+    for i in range(3):
+        core.run(5)
+        paths.append(str(tmp_path / f'a{i}.snap'))
+        first.write(paths[-1])
+    other = str(tmp_path / 'b0.snap')
+    second.write(other)
+    other_increment = str(tmp_path / 'b1.snap')
+    second.write(other_increment)
+    for chain in ([paths[1]], [paths[0], paths[2]], [paths[0], other_increment], []):
+        with pytest.raises(ValueError):
+            load_chain(chain)
+
+
+def test_registers_past_64_bits_wrap(make_core, tmp_path):
+    core = make_core(WALK)
+    core.registers[5] = (1 << 64) + 3
+    path = str(tmp_path / 'big.snap')
+    snapshot = Snapshot(core)
+    write_checkpoint(path, snapshot, {})
+    assert load_chain([path]).registers[5] == 3
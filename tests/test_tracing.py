@@ -0,0 +1,120 @@
+# test_tracing.py
+"""trace records written while running and read back"""
+import pytest
+from tracing import (Tracer, TraceWriter, read_trace, filter_trace, summarize,
+                     WROTE_RD, MEM_READ, MEM_WRITE, VECTOR)
+from profiler import Profiler
+from cache import CacheHierarchy
+
+MEMORY_OPS = """
+    ADDI x1, x0, -1
+    ADDI x2, x0, 300
+    SB x1, 4(x2)
+    LW x3, 4(x2)
+    VSETIVLI x0, 4, e32, m1
+    ADDI x4, x0, 8
+    LV v1, 8(x2)
+    SV v1, 16(x2)
+    VLSE v2, (x2), x4
+    SH x1, 40(x2)
+    ADDI x5, x0, 10
+loop:
+    ADDI x5, x5, -1
+    BNE x5, x0, loop
+"""
+
+ATOMIC_OPS = """
+    ADDI x3, x0, 200
+    ADDI x2, x0, 5
+    SW x2, 0(x3)
+    AMOADD.W x4, x2, (x3)
+    AMOSWAP.W x0, x0, (x3)
+    LR.W x5, (x3)
+    SC.W x6, x2, (x3)
+    SC.W x7, x2, (x3)
+"""
+
+
+def traced(make_core, tmp_path, compress=False, chunk_records=4, engine='interp', source=MEMORY_OPS):
+    core = make_core(source, engine=engine)
+    path = str(tmp_path / 'run.trace')
+    writer = TraceWriter(path, compress=compress, chunk_records=chunk_records)
+    Tracer(core, writer).attach()
+    core.run()
+    writer.close()
+    return core, list(read_trace(path))
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_one_record_per_instruction(make_core, tmp_path, compress):
+    core, records = traced(make_core, tmp_path, compress)
+    assert len(records) == core.instret == 31
+    assert [record.pc for record in records[:11]] == list(range(0, 44, 4))
+    assert all(record.instruction == core.memory.words[record.pc >> 2] for record in records)
+
+
+def test_compression_does_not_change_records(make_core, tmp_path):
+    _, plain = traced(make_core, tmp_path, False, chunk_records=1 << 16)
+    _, packed = traced(make_core, tmp_path, True, chunk_records=3)
+    assert plain == packed
+
+
+def test_memory_records(make_core, tmp_path):
+    _, records = traced(make_core, tmp_path)
+    sb, lw, lv, sv, vlse, sh = (records[i] for i in (2, 3, 6, 7, 8, 9))
+    assert (sb.flags, sb.address, sb.data) == (MEM_WRITE, 304, 0xFF)  # store data cut to its size
+    assert (lw.flags, lw.rd, lw.value, lw.address) == (WROTE_RD | MEM_READ, 3, 0xFF, 304)
+    assert (lv.flags, lv.address) == (MEM_READ | VECTOR, 308)
+    assert (sv.flags, sv.address) == (MEM_WRITE | VECTOR, 316)
+    assert (vlse.flags, vlse.address) == (MEM_READ | VECTOR, 300)
+    assert (sh.flags, sh.address, sh.data) == (MEM_WRITE, 340, 0xFFFF)
+    assert records[0].flags == WROTE_RD and records[0].value == 0xFFFFFFFF
+    assert records[-1].flags == 0  # the last BNE writes nothing
+
+
+def test_atomic_records(make_core, tmp_path):
+    _, records = traced(make_core, tmp_path, source=ATOMIC_OPS)
+    amoadd, amoswap, lr, sc, failed = records[3:]
+    # value is the word an AMO loaded, data the word it stored
+    assert (amoadd.flags, amoadd.rd, amoadd.value, amoadd.address, amoadd.data) == \
+        (WROTE_RD | MEM_READ | MEM_WRITE, 4, 5, 200, 10)
+    assert (amoswap.flags, amoswap.value, amoswap.address, amoswap.data) == (MEM_READ | MEM_WRITE, 10, 200, 0)
+    assert (lr.flags, lr.rd, lr.value, lr.address, lr.data) == (WROTE_RD | MEM_READ, 5, 0, 200, 0)
+    assert (sc.flags, sc.rd, sc.value, sc.address, sc.data) == (WROTE_RD | MEM_WRITE, 6, 0, 200, 5)
+    assert (failed.flags, failed.rd, failed.value) == (WROTE_RD, 7, 1)  # no reservation left, no store
+    summary = summarize(records)
+    assert (summary['loads'], summary['stores']) == (3, 4)
+
+
+def test_atomic_records_leave_the_caches_alone(make_core, tmp_path):
+    counts = []
+    for trace in (False, True):
+        core = make_core(ATOMIC_OPS)
+        caches = CacheHierarchy.from_spec('l1d=1k:2:32').attach(core)
+        if trace:
+            writer = TraceWriter(str(tmp_path / 'run.trace'))
+            Tracer(core, writer).attach()
+        core.run()
+        counts.append((caches.l1d.hits, caches.l1d.misses))
+    assert counts[0] == counts[1]
+
+
+def test_filter_and_summary(make_core, tmp_path):
+    _, records = traced(make_core, tmp_path)
+    assert len(list(filter_trace(records, pc=44))) == 10
+    assert len(list(filter_trace(records, address=(300, 310)))) == 4
+    assert len(list(filter_trace(records, flags=VECTOR))) == 3
+    summary = summarize(records)
+    assert (summary['loads'], summary['stores']) == (3, 3)
+    assert (summary['lowest_address'], summary['highest_address']) == (300, 340)
+
+
+def test_runs_alongside_the_profiler(make_core, tmp_path):
+    core = make_core(MEMORY_OPS, engine='block')
+    path = str(tmp_path / 'run.trace')
+    writer = TraceWriter(path)
+    Profiler(core, [], {}).attach()
+    Tracer(core, writer).attach()
+    core.run()
+    writer.close()
+    assert len(list(read_trace(path))) == core.instret == sum(core.profiler.heat)
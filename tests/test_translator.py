@@ -0,0 +1,72 @@
+# test_translator.py
+"""the block engine has to end up exactly where the interpreter does"""
+import random
+import pytest
+
+LOOPS = """
+    ADDI x8, x0, 20
+    ADDI x4, x0, 0
+outer:
+    BEQ x8, x0, done
+    ADDI x2, x0, 30
+inner:
+    BEQ x2, x0, next
+    ADD x4, x4, x2
+    ADDI x2, x2, -1
+    BEQ x0, x0, inner
+next:
+    ADDI x8, x8, -1
+    SW x4, 592(x0)
+    BEQ x0, x0, outer
+done:
+    LW x5, 592(x0)
+"""
+
+# the SW copies the word of 'ADDI x6, x0, 2' over 'ADDI x6, x0, 1' before it runs
+SELF_MODIFYING = """
+    LW x1, 16(x0)
+    SW x1, 12(x0)
+    ADDI x2, x0, 3
+    ADDI x6, x0, 1
+    ADDI x6, x0, 2
+"""
+
+PROGRAMS = ['test.apo', 'vect.apo', LOOPS, SELF_MODIFYING]
+
+
+def state(core):
+    return core.registers, core.instret, core.pc, bytes(core.memory.read_bytes(0, 1024))
+
+
+@pytest.mark.parametrize('source', PROGRAMS)
+def test_block_matches_interp(make_core, source):
+    interp = make_core(source)
+    block = make_core(source, engine='block')
+    interp.run()
+    block.run()
+    assert state(block) == state(interp)
+
+
+@pytest.mark.parametrize('source', PROGRAMS)
+def test_budgeted_slices_match(make_core, source):
+    interp = make_core(source)
+    block = make_core(source, engine='block')
+    rng = random.Random(1)
+    while interp.pc < interp.program_length:
+        budget = rng.choice([1, 2, 3, 7, 50])
+        interp.run(budget)
+        block.run(budget)
+        assert state(block) == state(interp)
+
+
+def test_loop_totals(make_core):
+    core = make_core(LOOPS, engine='block')
+    core.run()
+    assert core.registers[5] == 20 * sum(range(1, 31))
+    assert core.instret == 2 + 20 * (2 + 30 * 4 + 1 + 3) + 1 + 1
+
+
+def test_self_modifying_store(make_core):
+    core = make_core(SELF_MODIFYING, engine='block')
+    core.run()
+    assert core.registers[6] == 2
@@ -0,0 +1,214 @@
+# test_vector.py
+"""vector ALU, reductions and memory ops, masked and unmasked, against numpy"""
+import numpy as np
+import pytest
+from fileParser import Parser
+from cpu import ApocaCore
+
+PARSER = Parser()
+SEWS = [8, 16, 32, 64]
+
+
+def execute(core, line):
+    handler, operands = core.resolve(core.decode(PARSER.parse_line(line, 0)))
+    handler(core, *operands)
+
+
+def vector_core(sew, seed=0):
+    """a core with random v1-v4, vl = VLMAX and a random mask in v0"""
+    core = ApocaCore(memory_size=4096)
+    core.set_vtype(sew, 1)
+    core.vl = core.VLMAX
+    rng = np.random.default_rng(seed)
+    vlenb = core.VLEN // 8
+    core.vrf[vlenb:5 * vlenb] = rng.integers(0, 256, 4 * vlenb, dtype=np.uint8)
+    core.vreg[2][:4] = [0, -1, 1, np.iinfo(core.vreg.dtype).min]  # the divide corner cases
+    core.vreg[1][:4] = [5, np.iinfo(core.vreg.dtype).min, 0, -1]
+    core.vrf[:vlenb] = rng.integers(0, 256, vlenb, dtype=np.uint8)
+    return core
+
+
+def mask_of(core):
+    return np.unpackbits(core.vrf[:core.VLEN // 8], bitorder='little')[:core.vl].astype(bool)
+
+
+def wrap(value, sew):
+    value &= (1 << sew) - 1
+    return value - (1 << sew) if value >> (sew - 1) else value
+
+
+def unsigned(value, sew):
+    return value & ((1 << sew) - 1)
+
+
+def div(a, b, sew):
+    if b == 0:
+        return -1
+    quotient = abs(a) // abs(b)
+    return wrap(quotient if (a < 0) == (b < 0) else -quotient, sew)
+
+
+def rem(a, b, sew):
+    if b == 0:
+        return a
+    remainder = abs(a) % abs(b)
+    return wrap(remainder if a >= 0 else -remainder, sew)
+
+
+# mnemonic -> reference on python ints, vd[i] = op(vs2[i], vs1[i])
+BINARY = {
+    'VADD': lambda a, b, sew: wrap(a + b, sew),
+    'VSUB': lambda a, b, sew: wrap(a - b, sew),
+    'VMUL': lambda a, b, sew: wrap(a * b, sew),
+    'VAND': lambda a, b, sew: a & b,
+    'VOR': lambda a, b, sew: a | b,
+    'VXOR': lambda a, b, sew: a ^ b,
+    'VMIN': lambda a, b, sew: min(a, b),
+    'VMAX': lambda a, b, sew: max(a, b),
+    'VMINU': lambda a, b, sew: wrap(min(unsigned(a, sew), unsigned(b, sew)), sew),
+    'VMAXU': lambda a, b, sew: wrap(max(unsigned(a, sew), unsigned(b, sew)), sew),
+    'VDIV': div,
+    'VREM': rem,
+    'VDIVU': lambda a, b, sew: -1 if b == 0 else wrap(unsigned(a, sew) // unsigned(b, sew), sew),
+    'VREMU': lambda a, b, sew: a if b == 0 else wrap(unsigned(a, sew) % unsigned(b, sew), sew),
+}
+
+COMPARES = {
+    'VMSEQ': lambda a, b, sew: a == b,
+    'VMSNE': lambda a, b, sew: a != b,
+    'VMSLT': lambda a, b, sew: a < b,
+    'VMSLE': lambda a, b, sew: a <= b,
+    'VMSLTU': lambda a, b, sew: unsigned(a, sew) < unsigned(b, sew),
+    'VMSLEU': lambda a, b, sew: unsigned(a, sew) <= unsigned(b, sew),
+}
+
+REDUCTIONS = {
+    'VREDSUM': lambda values, sew: wrap(sum(values), sew),
+    'VREDMAX': lambda values, sew: max(values),
+    'VREDMIN': lambda values, sew: min(values),
+    'VREDMAXU': lambda values, sew: wrap(max(unsigned(v, sew) for v in values), sew),
+    'VREDMINU': lambda values, sew: wrap(min(unsigned(v, sew) for v in values), sew),
+}
+
+
+@pytest.mark.parametrize('masked', [False, True])
+@pytest.mark.parametrize('sew', SEWS)
+@pytest.mark.parametrize('mnemonic', sorted(BINARY))
+def test_binary_ops(mnemonic, sew, masked):
+    core = vector_core(sew)
+    vl = core.vl
+    a, b, old = (core.vreg[r][:vl].tolist() for r in (2, 1, 3))
+    tail = core.vreg[3][vl:].copy()
+    execute(core, f"{mnemonic} v3, v2, v1" + (", v0.t" if masked else ""))
+    active = mask_of(core) if masked else np.ones(vl, dtype=bool)
+    expected = [BINARY[mnemonic](x, y, sew) if on else o for x, y, o, on in zip(a, b, old, active)]
+    assert core.vreg[3][:vl].tolist() == expected
+    assert np.array_equal(core.vreg[3][vl:], tail)
+
+
+@pytest.mark.parametrize('sew', SEWS)
+def test_scalar_and_immediate_forms(sew):
+    core = vector_core(sew)
+    vl = core.vl
+    a = core.vreg[2][:vl].tolist()
+    core.registers[5] = -3
+    execute(core, "VADD.VX v3, v2, x5")
+    assert core.vreg[3][:vl].tolist() == [wrap(x - 3, sew) for x in a]
+    execute(core, "VXOR.VI v4, v2, -2")
+    assert core.vreg[4][:vl].tolist() == [x ^ -2 for x in a]
+
+
+@pytest.mark.parametrize('masked', [False, True])
+@pytest.mark.parametrize('sew', SEWS)
+@pytest.mark.parametrize('mnemonic', sorted(COMPARES))
+def test_compares(mnemonic, sew, masked):
+    core = vector_core(sew)
+    vl = core.vl
+    vlenb = core.VLEN // 8
+    a, b = core.vreg[2][:vl].tolist(), core.vreg[1][:vl].tolist()
+    old = np.unpackbits(core.vrf[3 * vlenb:4 * vlenb], bitorder='little').astype(bool)
+    execute(core, f"{mnemonic} v3, v2, v1" + (", v0.t" if masked else ""))
+    active = mask_of(core) if masked else np.ones(vl, dtype=bool)
+    expected = old.copy()
+    for i, (x, y) in enumerate(zip(a, b)):
+        if active[i]:
+            expected[i] = COMPARES[mnemonic](x, y, sew)
+    bits = np.unpackbits(core.vrf[3 * vlenb:4 * vlenb], bitorder='little').astype(bool)
+    assert np.array_equal(bits, expected)
+
+
+@pytest.mark.parametrize('masked', [False, True])
+@pytest.mark.parametrize('sew', SEWS)
+@pytest.mark.parametrize('mnemonic', sorted(REDUCTIONS))
+def test_reductions(mnemonic, sew, masked):
+    core = vector_core(sew)
+    vl = core.vl
+    values = core.vreg[2][:vl].tolist()
+    start = int(core.vreg[1][0])
+    execute(core, f"{mnemonic} v3, v2, v1" + (", v0.t" if masked else ""))
+    active = mask_of(core) if masked else np.ones(vl, dtype=bool)
+    expected = REDUCTIONS[mnemonic]([start] + [v for v, on in zip(values, active) if on], sew)
+    assert int(core.vreg[3][0]) == expected
+
+
+def memory_core(sew):
+    core = vector_core(sew, seed=1)
+    core.memory.write_bytes(0, np.arange(4096, dtype=np.uint32).astype(np.uint8).tobytes())
+    core.registers[5] = 1024
+    return core
+
+
+def memory_elements(core, base, count, stride=None):
+    size = core.vreg.itemsize
+    stride = size if stride is None else stride
+    return [int(np.frombuffer(bytes(core.memory.read_bytes(base + i * stride, size)), dtype=core.vreg.dtype)[0])
+            for i in range(count)]
+
+
+def unit_stride(core, line, vm):
+    """LV / SV keep imm[5] where vm would go, so the handler gets vm directly"""
+    handler, operands = core.resolve(core.decode(PARSER.parse_line(line, 0)))
+    handler(core, *operands[:3], vm)
+
+
+@pytest.mark.parametrize('masked', [False, True])
+@pytest.mark.parametrize('sew', SEWS)
+def test_unit_stride(sew, masked):
+    core = memory_core(sew)
+    vl = core.vl
+    active = mask_of(core) if masked else np.ones(vl, dtype=bool)
+    old = core.vreg[3][:vl].tolist()
+    unit_stride(core, "LV v3, 16(x5)", 0 if masked else 1)
+    loaded = memory_elements(core, 1040, vl)
+    assert core.vreg[3][:vl].tolist() == [m if on else o for m, o, on in zip(loaded, old, active)]
+    before = memory_elements(core, 1024, vl)
+    after = memory_elements(core, 1024 + vl * core.vreg.itemsize, 4)
+    values = core.vreg[2][:vl].tolist()
+    unit_stride(core, "SV v2, 0(x5)", 0 if masked else 1)
+    assert memory_elements(core, 1024, vl) == [v if on else b for v, b, on in zip(values, before, active)]
+    assert memory_elements(core, 1024 + vl * core.vreg.itemsize, 4) == after
+
+
+@pytest.mark.parametrize('masked', [False, True])
+@pytest.mark.parametrize('sew', SEWS)
+def test_strided_and_indexed(sew, masked):
+    core = memory_core(sew)
+    vl = core.vl
+    size = core.vreg.itemsize
+    suffix = ", v0.t" if masked else ""
+    active = mask_of(core) if masked else np.ones(vl, dtype=bool)
+    core.registers[6] = 3 * size
+    before = memory_elements(core, 1024, vl, 3 * size)
+    values = core.vreg[2][:vl].tolist()
+    execute(core, "VSSE v2, (x5), x6" + suffix)
+    assert memory_elements(core, 1024, vl, 3 * size) == [v if on else b for v, b, on in zip(values, before, active)]
+    old = core.vreg[3][:vl].tolist()
+    execute(core, "VLSE v3, (x5), x6" + suffix)
+    stored = memory_elements(core, 1024, vl, 3 * size)
+    assert core.vreg[3][:vl].tolist() == [m if on else o for m, o, on in zip(stored, old, active)]
+    # indexed: element i from base + 2 * size * (vl - 1 - i), offsets are unsigned
+    core.vreg[4][:vl] = [2 * size * (vl - 1 - i) for i in range(vl)]
+    old = core.vreg[1][:vl].tolist()
+    execute(core, "VLUXEI v1, (x5), v4" + suffix)
+    reversed_memory = memory_elements(core, 1024, vl, 2 * size)[::-1]
+    assert core.vreg[1][:vl].tolist() == [m if on else o for m, o, on in zip(reversed_memory, old, active)]
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# timing.py
+"""
+Retired instruction stream for the timing models.
+The functional core still does all the work; Retirement watches it one
+instruction at a time and hands every retired instruction to the attached
+models as (pc, op, next_pc, address). op is an Op worked out once per
+decoded pc: what kind of instruction it is and which registers it reads
+and writes. Vector registers are numbered 16-31 after x0-x15 so one
+scoreboard covers both.
+"""
+from constants import *
+
+# instruction kinds
+ALU, LOAD, STORE, BRANCH, JUMP, VALU, VLOAD, VSTORE, VCFG, NOP, AMO = range(11)
+KIND_NAMES = ('alu', 'load', 'store', 'branch', 'jump', 'valu', 'vload', 'vstore', 'vcfg', 'nop', 'amo')
+MEMORY_KINDS = (LOAD, STORE, VLOAD, VSTORE, AMO)  # AMO loads and stores the same word
+VREG = 16  # vector register v is scoreboard slot VREG + v
+STORED_WORDS = 1 << 16  # most recently stored words whose store a model keeps track of
+
+BRANCHES = ('exec_beq', 'exec_beqi', 'exec_bne', 'exec_blt', 'exec_bge', 'exec_bltu', 'exec_bgeu')
+LOADS = ('exec_lb', 'exec_lh', 'exec_lw', 'exec_lbu', 'exec_lhu')
+STORES = ('exec_sb', 'exec_sh', 'exec_sw')
+REG_REG = ('exec_add', 'exec_sub', 'exec_sll', 'exec_slt', 'exec_sltu', 'exec_xor',
+           'exec_srl', 'exec_sra', 'exec_or', 'exec_and', 'exec_mul', 'exec_mulh', 'exec_mulhsu',
+           'exec_mulhu', 'exec_div', 'exec_divu', 'exec_rem', 'exec_remu')
+REG_IMM = ('exec_addi', 'exec_slti', 'exec_sltiu', 'exec_xori', 'exec_ori', 'exec_andi',
+           'exec_slli', 'exec_srli', 'exec_srai')
+ATOMICS = ('exec_lr', 'exec_sc', 'exec_amoswap', 'exec_amoadd', 'exec_amoxor', 'exec_amoand',
+           'exec_amoor', 'exec_amomin', 'exec_amomax', 'exec_amominu', 'exec_amomaxu')
+ATOMIC_WRITES = tuple(name for name in ATOMICS if name != 'exec_lr')  # everything but LR.W writes memory
+VECTOR_LOADS = ('exec_vl', 'exec_vlse', 'exec_vluxei')
+VECTOR_STORES = ('exec_vs', 'exec_vsse', 'exec_vsuxei')
+
+
+class Op:
+    """static facts about one decoded instruction"""
+    __slots__ = ('pc', 'name', 'kind', 'dst', 'srcs', 'base', 'offset', 'word', 'target')
+
+    def __init__(self, pc, name, kind, dst=None, srcs=(), base=None, offset=0, word=0, target=None):
+        self.pc = pc
+        self.name = name
+        self.kind = kind
+        self.dst = dst  # register slot written, None for none / x0
+        self.srcs = srcs  # register slots read, x0 left out
+        self.base = base  # address = r[base] + offset for memory ops
+        self.offset = offset
+        self.word = word
+        self.target = target  # taken target of a branch or JAL, None when it depends on a register
+
+
+def scalars(*regs):
+    return tuple(r for r in regs if r)
+
+
+def describe(core, pc, op, word=None):
+    """work out the Op for the bound handler op the core predecoded at pc"""
+    name = op.func.__name__
+    args = op.args[1:]  # op.args[0] is the core
+    if word is None:
+        word = core.memory.words[pc]
+    if name in REG_REG:
+        rd, rs1, rs2, imm = args
+        return Op(pc, name, ALU, rd or None, scalars(rs1, rs2), word=word)
+    if name in REG_IMM:
+        rd, rs1, rs2, imm = args
+        return Op(pc, name, ALU, rd or None, scalars(rs1), word=word)
+    if name in LOADS:
+        rd, rs1, rs2, imm = args
+        return Op(pc, name, LOAD, rd or None, scalars(rs1), rs1, imm, word)
+    if name in STORES:
+        rd, rs1, rs2, imm = args
+        return Op(pc, name, STORE, None, scalars(rs1, rs2), rs1, imm, word)
+    if name == 'exec_lr':
+        rd, rs1, rs2, imm = args
+        return Op(pc, name, LOAD, rd or None, scalars(rs1), rs1, 0, word)
+    if name in ATOMIC_WRITES:
+        # SC and the AMOs read the word at r[rs1] and write it back
+        rd, rs1, rs2, imm = args
+        return Op(pc, name, AMO, rd or None, scalars(rs1, rs2), rs1, 0, word)
+    # targets follow the pc arithmetic of the handlers in exec.py
+    if name in BRANCHES:
+        rs1, rs2, imm = args
+        srcs = scalars(rs1) if name == 'exec_beqi' else scalars(rs1, rs2)  # BEQI's rs2 is an immediate
+        return Op(pc, name, BRANCH, None, srcs, word=word, target=pc + imm // 4)
+    if name == 'exec_jal':
+        rd, rs1, rs2, imm = args
+        return Op(pc, name, JUMP, rd or None, (), word=word, target=pc + imm // 4)
+    if name == 'exec_jalr':
+        rd, rs1, rs2, imm = args
+        return Op(pc, name, JUMP, rd or None, scalars(rs1), word=word)
+    if name in ('exec_lui', 'exec_auipc'):
+        return Op(pc, name, ALU, args[0] or None, (), word=word)
+    if name == 'exec_ecall':
+        # host call number in x5, arguments x10-x13, result in x10
+        return Op(pc, name, ALU, 10, (5, 10, 11, 12, 13), word=word)
+    if name == 'exec_nop':
+        return Op(pc, name, NOP, word=word)
+    if name in VECTOR_LOADS or name in VECTOR_STORES:
+        vd, rs1, other, vm = args
+        srcs = list(scalars(rs1))
+        if name in ('exec_vlse', 'exec_vsse'):
+            srcs += scalars(other)
+        elif name in ('exec_vluxei', 'exec_vsuxei'):
+            srcs.append(VREG + other)
+        if not vm:
+            srcs.append(VREG)
+        offset = other if name in ('exec_vl', 'exec_vs') else 0
+        if name in VECTOR_STORES:
+            return Op(pc, name, VSTORE, None, tuple(srcs) + (VREG + vd,), rs1, offset, word)
+        return Op(pc, name, VLOAD, VREG + vd, tuple(srcs), rs1, offset, word)
+    if name in ('exec_vsetvli', 'exec_vsetivli', 'exec_vsetvl'):
+        rd, rs1, operand = args
+        srcs = () if name == 'exec_vsetivli' else scalars(rs1)
+        if name == 'exec_vsetvl':
+            srcs += scalars(operand)
+        return Op(pc, name, VCFG, rd or None, srcs, word=word)
+    if name.startswith('exec_v'):
+        vd, rs1, vs2, vm, funct3 = args
+        srcs = [VREG + vs2]
+        if funct3 in (vector_funct3['OPIVV'], vector_funct3['OPMVV']):
+            srcs.append(VREG + rs1)
+        elif funct3 in (vector_funct3['OPIVX'], vector_funct3['OPMVX']):
+            srcs.extend(scalars(rs1))
+        if not vm:
+            srcs.append(VREG)
+        return Op(pc, name, VALU, VREG + vd, tuple(srcs), word=word)
+    return Op(pc, name, ALU, (args[0] or None) if args else None, (), word=word)
+
+
+class Retirement:
+    """
+    Drives timing models from the functional core. attach(core) makes it
+    one of the core's observers, every model gets model.retire(pc, op,
+    next_pc, address) for each instruction core.run() retires, in order.
+    """
+    def __init__(self, *models):
+        self.models = list(models)
+        self.retires = [model.retire for model in self.models]
+        self.core = None
+        self.ops = {}  # pc -> Op
+        self.op = None  # the instruction in flight and its address
+        self.address = 0
+        self.wall_time = 0.0
+
+    def attach(self, core):
+        self.core = core
+        core.timing = self
+        for model in self.models:
+            if hasattr(model, 'bind'):
+                model.bind(core)
+        core.observe(self)
+        return self
+
+    def decoded(self, pc, handler):
+        self.ops[pc] = describe(self.core, pc, handler)
+
+    def before(self, pc, handler):
+        try:
+            op = self.ops[pc]
+        except KeyError:
+            op = self.ops[pc] = describe(self.core, pc, handler)
+        self.op = op
+        self.address = self.core.registers[op.base] + op.offset if op.base is not None else 0
+
+    def after(self, pc, handler):
+        op, address, next_pc = self.op, self.address, self.core.pc
+        for retire in self.retires:
+            retire(pc, op, next_pc, address)
+
+    def finish(self, count, seconds):
+        self.wall_time += seconds
+
+    def report(self):
+        return {type(model).__name__: model.report() for model in self.models}
+
+    def table(self):
+        return '\n\n'.join(model.table() for model in self.models)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# tracing.py
+"""
+Binary execution traces.
+Every retired instruction becomes one fixed size record (pc, raw word, the
+value written to rd, the memory address and value touched) packed with
+struct into a big buffer that goes to disk a chunk at a time, optionally
+zlib compressed per chunk. Store data is cut to the size of the store;
+vector loads and stores carry their base address and the VECTOR flag but
+no data. An AMO is both a read and a write: value is the word it loaded
+(what rd gets) and data the word it stored. A successful SC is a write of
+rs2, a failed one touches no memory. read_trace streams the records back with a generator so traces
+bigger than memory can be filtered and summarized.
+"""
+import sys
+import zlib
+import struct
+import argparse
+from collections import namedtuple
+from memory import PAGE_BITS
+from timing import ATOMIC_WRITES
+
+MAGIC = b'APOTRACE'
+VERSION = 1
+HEADER = struct.Struct('<8sHHI')  # magic, version, flags, record size
+CHUNK = struct.Struct('<II')  # raw length, stored length of a compressed chunk
+COMPRESSED = 1
+
+# pc (byte address), instruction, flags, rd, rd value, memory address, memory value
+RECORD = struct.Struct('<IIBBxxIII')
+WROTE_RD = 1
+MEM_READ = 2
+MEM_WRITE = 4
+VECTOR = 8  # a vector load / store: address is its base, no data
+
+SIZE_MASKS = {1: 0xFF, 2: 0xFFFF, 4: 0xFFFFFFFF}
+
+Record = namedtuple('Record', 'pc instruction flags rd value address data')
+
+LOADS = {'exec_lw': 4, 'exec_lh': 2, 'exec_lhu': 2, 'exec_lb': 1, 'exec_lbu': 1}
+STORES = {'exec_sw': 4, 'exec_sh': 2, 'exec_sb': 1}
+# the base is r[rs1], plus the immediate for unit stride
+VECTOR_LOADS = ('exec_vl', 'exec_vlse', 'exec_vluxei')
+VECTOR_STORES = ('exec_vs', 'exec_vsse', 'exec_vsuxei')
+NO_RD = ('exec_beq', 'exec_beqi', 'exec_bne', 'exec_blt', 'exec_bge', 'exec_bltu', 'exec_bgeu', 'exec_nop',
+         'exec_ecall', 'exec_ebreak')
+
+
+class TraceWriter:
+    """records go into a preallocated bytearray, flushed when it is full"""
+    def __init__(self, path, compress=False, chunk_records=1 << 16, level=1):
+        self.file = open(path, 'wb')
+        self.compress = compress
+        self.level = level
+        self.buffer = bytearray(RECORD.size * chunk_records)
+        self.offset = 0
+        self.records = 0
+        self.file.write(HEADER.pack(MAGIC, VERSION, COMPRESSED if compress else 0, RECORD.size))
+
+    def write(self, pc, instruction, flags, rd, value, address, data):
+        RECORD.pack_into(self.buffer, self.offset, pc, instruction, flags, rd,
+                         value & 0xFFFFFFFF, address & 0xFFFFFFFF, data & 0xFFFFFFFF)
+        self.offset += RECORD.size
+        self.records += 1
+        if self.offset == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        if not self.offset:
+            return
+        raw = memoryview(self.buffer)[:self.offset]
+        if self.compress:
+            packed = zlib.compress(raw, self.level)
+            self.file.write(CHUNK.pack(len(raw), len(packed)))
+            self.file.write(packed)
+        else:
+            self.file.write(raw)
+        self.offset = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Tracer:
+    """
+    Attach with Tracer(core, writer).attach(), core.run() then writes a
+    record per instruction.
+    """
+    def __init__(self, core, writer):
+        self.core = core
+        self.writer = writer
+        self.info = {}  # pc -> (kind, word, rd, rs1, rs2, imm, size)
+        self.address = 0  # of the load or atomic in flight
+        self.loaded = 0  # the word an AMO found
+        self.data = None  # what an SC stores, None when it is going to fail
+
+    def attach(self):
+        self.core.tracer = self
+        self.core.observe(self)
+        return self
+
+    def decoded(self, pc, op):
+        self.info[pc] = self.describe(pc, op)
+
+    def describe(self, pc, op):
+        """what the instruction at pc touches, from its bound operands"""
+        name = op.func.__name__
+        word = self.core.memory.words[pc]
+        args = op.args[1:] + (0, 0, 0, 0)  # args[0] is the core
+        if name in LOADS:
+            return ('load', word, args[0], args[1], args[2], args[3], LOADS[name])
+        if name in STORES:
+            return ('store', word, 0, args[1], args[2], args[3], STORES[name])
+        if name == 'exec_lr':
+            return ('lr', word, args[0], args[1], 0, 0, 4)
+        if name in ATOMIC_WRITES:
+            return ('sc' if name == 'exec_sc' else 'amo', word, args[0], args[1], args[2], 0, 4)
+        if name in VECTOR_LOADS or name in VECTOR_STORES:
+            imm = args[2] if name in ('exec_vl', 'exec_vs') else 0
+            return ('vload' if name in VECTOR_LOADS else 'vstore', word, 0, args[1], 0, imm, 0)
+        if name in NO_RD or name.startswith('exec_v'):
+            return (None, word, 0, 0, 0, 0, 0)
+        return ('rd', word, args[0], 0, 0, 0, 0)
+
+    def before(self, pc, op):
+        """stores are recorded before they run, loads need their address before rd is written"""
+        try:
+            kind, word, rd, rs1, rs2, imm, size = self.info[pc]
+        except KeyError:
+            kind, word, rd, rs1, rs2, imm, size = self.info[pc] = self.describe(pc, op)
+        r = self.core.registers
+        if kind == 'store':
+            self.writer.write(pc << 2, word, MEM_WRITE, 0, 0, r[rs1] + imm, r[rs2] & SIZE_MASKS[size])
+        elif kind == 'vstore':
+            self.writer.write(pc << 2, word, MEM_WRITE | VECTOR, 0, 0, r[rs1] + imm, 0)
+        elif kind == 'load' or kind == 'vload' or kind == 'lr':
+            self.address = r[rs1] + imm
+        elif kind == 'amo':
+            self.address = r[rs1]
+            self.loaded = self.peek(self.address)
+        elif kind == 'sc':
+            # the same test exec_sc makes
+            self.address = address = r[rs1]
+            reservation = self.core.reservation
+            held = reservation is not None and reservation[0] == address and self.peek(address) == reservation[1]
+            self.data = r[rs2] if held else None
+
+    def after(self, pc, op):
+        kind, word, rd, rs1, rs2, imm, size = self.info[pc]
+        r = self.core.registers
+        if kind == 'load':
+            self.writer.write(pc << 2, word, (WROTE_RD if rd else 0) | MEM_READ, rd, r[rd], self.address, r[rd])
+        elif kind == 'vload':
+            self.writer.write(pc << 2, word, MEM_READ | VECTOR, 0, 0, self.address, 0)
+        elif kind == 'lr':
+            value = self.core.reservation[1]
+            self.writer.write(pc << 2, word, (WROTE_RD if rd else 0) | MEM_READ, rd, value, self.address, value)
+        elif kind == 'amo':
+            self.writer.write(pc << 2, word, (WROTE_RD if rd else 0) | MEM_READ | MEM_WRITE, rd, self.loaded,
+                              self.address, self.peek(self.address))
+        elif kind == 'sc':
+            stored = self.data is not None
+            self.writer.write(pc << 2, word, (WROTE_RD if rd else 0) | (MEM_WRITE if stored else 0), rd, r[rd],
+                              self.address, self.data if stored else 0)
+        elif kind == 'rd' and rd:
+            self.writer.write(pc << 2, word, WROTE_RD, rd, r[rd], 0, 0)
+        elif kind != 'store' and kind != 'vstore':
+            self.writer.write(pc << 2, word, 0, 0, 0, 0, 0)
+
+    def peek(self, address):
+        """the signed word at address, past any caches and 0 for a device"""
+        memory = self.core.memory
+        memory = getattr(memory, 'memory', memory)  # the RAM under a cache.CachedMemory
+        if memory.bus is not None and (address >> PAGE_BITS) in memory.bus.pages:
+            return 0
+        return memory.load_signed(address, 4)
+
+
+def read_chunks(path):
+    """the raw record bytes of a trace, a chunk at a time"""
+    with open(path, 'rb') as f:
+        magic, version, flags, size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or size != RECORD.size:
+            raise ValueError(f"{path} is not an apocacore trace (version {VERSION})")
+        if flags & COMPRESSED:
+            while True:
+                head = f.read(CHUNK.size)
+                if not head:
+                    return
+                raw, stored = CHUNK.unpack(head)
+                yield zlib.decompress(f.read(stored))
+        else:
+            while True:
+                block = f.read(RECORD.size * (1 << 16))
+                if not block:
+                    return
+                yield block
+
+
+def read_trace(path):
+    """every record in the trace, in order"""
+    for chunk in read_chunks(path):
+        for fields in RECORD.iter_unpack(chunk):
+            yield Record(*fields)
+
+
+def filter_trace(records, pc=None, address=None, flags=0):
+    """records at pc, touching memory in the [start, end) address range, with all of flags set"""
+    for record in records:
+        if pc is not None and record.pc != pc:
+            continue
+        if address is not None and not (record.flags & (MEM_READ | MEM_WRITE)
+                                        and address[0] <= record.address < address[1]):
+            continue
+        if record.flags & flags != flags:
+            continue
+        yield record
+
+
+def summarize(records):
+    """counts over a record stream, in one pass"""
+    summary = {'records': 0, 'loads': 0, 'stores': 0, 'register_writes': 0,
+               'distinct_pcs': 0, 'lowest_address': None, 'highest_address': None}
+    pcs = set()
+    low = high = None
+    for record in records:
+        summary['records'] += 1
+        pcs.add(record.pc)
+        if record.flags & WROTE_RD:
+            summary['register_writes'] += 1
+        if record.flags & (MEM_READ | MEM_WRITE):
+            if record.flags & MEM_READ:
+                summary['loads'] += 1
+            if record.flags & MEM_WRITE:
+                summary['stores'] += 1
+            low = record.address if low is None else min(low, record.address)
+            high = record.address if high is None else max(high, record.address)
+    summary['distinct_pcs'] = len(pcs)
+    summary['lowest_address'] = low
+    summary['highest_address'] = high
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='read an apocacore execution trace')
+    parser.add_argument('trace', help='trace file')
+    parser.add_argument('--pc', type=lambda v: int(v, 0), help='only records at this byte address')
+    parser.add_argument('--memory', nargs=2, type=lambda v: int(v, 0), metavar=('START', 'END'),
+                        help='only loads and stores in [START, END)')
+    parser.add_argument('--limit', type=int, default=None, help='print at most this many records')
+    parser.add_argument('--summary', action='store_true', help='print counts instead of records')
+    args = parser.parse_args()
+    records = filter_trace(read_trace(args.trace), pc=args.pc, address=args.memory)
+    if args.summary:
+        for key, value in summarize(records).items():
+            print(f"{key:>16}: {value}")
+        sys.exit()
+    for i, record in enumerate(records):
+        if args.limit is not None and i >= args.limit:
+            break
+        line = f"{record.pc:08x}: {record.instruction:08x}"
+        if record.flags & WROTE_RD:
+            line += f"  x{record.rd}={record.value:#x}"
+        if record.flags & VECTOR:
+            line += f"  [{record.address:#x}] vector {'load' if record.flags & MEM_READ else 'store'}"
+        elif record.flags & MEM_READ and record.flags & MEM_WRITE:
+            line += f"  [{record.address:#x}] {record.value:#x} -> {record.data:#x}"
+        elif record.flags & MEM_READ:
+            line += f"  [{record.address:#x}] -> {record.data:#x}"
+        elif record.flags & MEM_WRITE:
+            line += f"  [{record.address:#x}] <- {record.data:#x}"
+        print(line)
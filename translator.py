@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# translator.py
+"""
+Basic block translation engine.
+Straight-line runs of instructions (ending at a BRANCH, JAL or JALR) are
+turned into one generated python function each, compiled once with
+compile() and cached by the start pc of the block. A block returns the pc
+it exits to and how many instructions it retired; every exit knows its
+count when it is generated, a block that loops on itself adds up its
+rounds and stops early rather than run past the budget it is given.
+"""
+from constants import *
+from memory import Memory, SIGNED, UNSIGNED
+
+BLOCK_ENDS = (opCodes['BRANCH'], opCodes['JAL'], opCodes['JALR'], opCodes['SYSTEM'])
+MAX_BLOCK = 256  # cap so a huge straight-line program still translates lazily
+UNLIMITED = 1 << 62  # budget of an unbudgeted run
+
+# Python source for every handler in exec.py that can be inlined.
+# {d} {s1} {s2} {imm} are the decoded operands, the text mirrors the
+# matching InstructionHandlers.exec_* method.
+TEMPLATES = {
+    'exec_add':   'r[{d}] = r[{s1}] + r[{s2}]',
+    'exec_sub':   'r[{d}] = r[{s1}] - r[{s2}]',
+    'exec_sll':   'r[{d}] = r[{s1}] << (r[{s2}] & 0x1F)',
+    'exec_slt':   'r[{d}] = 1 if r[{s1}] < r[{s2}] else 0',
+    'exec_sltu':  'r[{d}] = 1 if (r[{s1}] & 0xFFFFFFFF) < (r[{s2}] & 0xFFFFFFFF) else 0',
+    'exec_xor':   'r[{d}] = r[{s1}] ^ r[{s2}]',
+    'exec_srl':   'r[{d}] = (r[{s1}] & 0xFFFFFFFF) >> (r[{s2}] & 0x1F)',
+    'exec_sra':   'r[{d}] = r[{s1}] >> (r[{s2}] & 0x1F)',
+    'exec_or':    'r[{d}] = r[{s1}] | r[{s2}]',
+    'exec_and':   'r[{d}] = r[{s1}] & r[{s2}]',
+    'exec_addi':  'r[{d}] = r[{s1}] + {imm}',
+    'exec_slti':  'r[{d}] = 1 if r[{s1}] < {imm} else 0',
+    'exec_sltiu': 'r[{d}] = 1 if (r[{s1}] & 0xFFFFFFFF) < ({imm} & 0xFFFFFFFF) else 0',
+    'exec_xori':  'r[{d}] = r[{s1}] ^ {imm}',
+    'exec_ori':   'r[{d}] = r[{s1}] | {imm}',
+    'exec_andi':  'r[{d}] = r[{s1}] & {imm}',
+    'exec_slli':  'r[{d}] = r[{s1}] << ({imm} & 0x1F)',
+    'exec_srli':  'r[{d}] = (r[{s1}] & 0xFFFFFFFF) >> ({imm} & 0x1F)',
+    'exec_srai':  'r[{d}] = r[{s1}] >> ({imm} & 0x1F)',
+    'exec_lw':    'r[{d}] = LW(mem, r[{s1}] + {imm})[0]',
+    'exec_lbu':   'r[{d}] = mem[r[{s1}] + {imm}]',
+    'exec_lhu':   'r[{d}] = LHU(mem, r[{s1}] + {imm})[0]',
+    'exec_lb':    'v = mem[r[{s1}] + {imm}]\n'
+                  'r[{d}] = v | 0xFFFFFF00 if v & 0x80 else v',
+    'exec_lh':    'v = LHU(mem, r[{s1}] + {imm})[0]\n'
+                  'r[{d}] = v | 0xFFFF0000 if v & 0x8000 else v',
+    'exec_lui':   'r[{d}] = {imm} << 12',
+}
+
+# Stores leave the block early when they land on translated code
+STORES = {
+    'exec_sw': ('SW(mem, a, r[{s2}] & 0xFFFFFFFF)', 4),
+    'exec_sh': ('SH(mem, a, r[{s2}] & 0xFFFF)', 2),
+    'exec_sb': ('mem[a] = r[{s2}] & 0xFF', 1),
+}
+
+MEMORY_OPS = ('exec_lw', 'exec_lbu', 'exec_lhu', 'exec_lb', 'exec_lh')
+
+# struct accessors the generated code reads and writes the bytearray with
+ACCESSORS = {
+    'LW': SIGNED[4].unpack_from,
+    'LHU': UNSIGNED[2].unpack_from,
+    'SW': UNSIGNED[4].pack_into,
+    'SH': UNSIGNED[2].pack_into,
+}
+
+# Conditional branches are inlined as side exits, {s1} {s2} are the registers
+CONDITIONS = {
+    'exec_beq':  'r[{s1}] == r[{s2}]',
+    'exec_bne':  'r[{s1}] != r[{s2}]',
+    'exec_blt':  'r[{s1}] < r[{s2}]',
+    'exec_bge':  'r[{s1}] >= r[{s2}]',
+    'exec_bltu': '(r[{s1}] & 0xFFFFFFFF) < (r[{s2}] & 0xFFFFFFFF)',
+    'exec_bgeu': '(r[{s1}] & 0xFFFFFFFF) >= (r[{s2}] & 0xFFFFFFFF)',
+}
+
+# Handlers that look at processor.pc, it has to be up to date before the call
+# (ECALL / EBREAK can halt, which moves it)
+PC_READERS = ('exec_beqi', 'exec_jal', 'exec_jalr', 'exec_auipc', 'exec_ecall', 'exec_ebreak')
+
+
+class Block:
+    """One translated basic block, chained to the blocks it exits to"""
+    __slots__ = ('start', 'end', 'length', 'run', 'valid', 'taken', 'fall')
+
+    def __init__(self, start, end, run):
+        self.start = start
+        self.end = end
+        self.length = end - start  # most instructions one pass can retire
+        self.run = run
+        self.valid = True
+        self.taken = None
+        self.fall = None
+
+
+class BlockTranslator:
+    """
+    Second execution engine next to the interpreter in ApocaCore.run.
+    Blocks are found on first execution, compiled and cached by start pc;
+    each block remembers its successors so hot loops go block to block
+    without a lookup.
+    """
+    def __init__(self, core):
+        self.core = core
+        self.blocks = {}
+        self.owners = {}  # pc -> blocks containing that instruction
+        self.stale = False
+        # the load/store templates poke the bytearray of a flat Memory,
+        # with paged memory or devices on the bus they go through the handlers instead
+        self.flat = isinstance(core.memory, Memory) and core.memory.bus is None
+
+    def run(self, max_instructions=None):
+        """
+        run blocks until the pc leaves the program or the next block could
+        take more than what is left of max_instructions, returns the
+        instructions retired (already added to core.instret)
+        """
+        core = self.core
+        r = core.registers
+        mem = core.memory.data if self.flat else core.memory
+        end = core.program_length
+        budget = UNLIMITED if max_instructions is None else max_instructions
+        retired = 0
+        pc = core.pc
+        if pc >= end:
+            return 0
+        block = self.lookup(pc)
+        while block.length <= budget - retired:
+            pc, count = block.run(core, r, mem, budget - retired)
+            retired += count
+            if pc >= end:
+                break
+            # chain to the successor remembered from the last time round
+            nxt = block.fall
+            if nxt is None or nxt.start != pc or not nxt.valid:
+                nxt = block.taken
+                if nxt is None or nxt.start != pc or not nxt.valid:
+                    nxt = self.lookup(pc)
+                    if pc == block.end:
+                        block.fall = nxt
+                    else:
+                        block.taken = nxt
+            block = nxt
+        core.pc = pc
+        core.instret += retired
+        return retired
+
+    def lookup(self, pc):
+        block = self.blocks.get(pc)
+        if block is None:
+            block = self.translate(pc)
+        return block
+
+    def translate(self, start):
+        """find the basic block starting at start and compile it"""
+        core = self.core
+        end = core.program_length
+        ops = []
+        pc = start
+        while pc < end and pc - start < MAX_BLOCK:
+            word = core.memory.words[pc]
+            try:
+                handler, operands = core.resolve(core.decode(word))
+            except Exception:
+                if pc == start:
+                    raise
+                break  # let the interpreter path raise when it gets there
+            ops.append((pc, handler, operands))
+            pc += 1
+            if (word & 0x7F) in BLOCK_ENDS:
+                # a conditional branch becomes a side exit and translation
+                # carries on down the fall-through path
+                name = handler.__name__
+                if name not in CONDITIONS or (name == 'exec_beq' and operands[0] == operands[1]):
+                    break
+
+        # a block that branches back to its own start runs as a while loop
+        loop = any(h.__name__ in CONDITIONS and p + o[2] // 4 == start
+                   for p, h, o in ops)
+
+        names = dict(ACCESSORS)
+        body = []
+        for op in ops:
+            body.extend(self.emit(*op, names, start, pc - start, loop))
+        # a snippet ends the block when one of its unindented lines leaves
+        if not body or not any(line.startswith(('return', 'continue')) for line in body[-1].split('\n')):
+            body.append(exit_to(pc, pc - start, loop))
+
+        indent = '        ' if loop else '    '
+        lines = [f'def block_{start}(core, r, mem, budget):']
+        if loop:
+            lines.append('    n = 0')
+            lines.append('    while True:')
+        for line in body:
+            lines.extend(indent + part for part in line.split('\n'))
+        code = compile('\n'.join(lines) + '\n', f'<block {start}>', 'exec')
+        exec(code, names)
+
+        block = Block(start, pc, names[f'block_{start}'])
+        self.blocks[start] = block
+        for slot in range(start, pc):
+            self.owners.setdefault(slot, []).append(block)
+        return block
+
+    def emit(self, pc, handler, operands, names, start, length, loop):
+        """
+        source lines for one instruction of the block [start, start +
+        length), exits return the instructions retired up to and including it
+        """
+        name = handler.__name__
+        nxt = pc + 1
+        done = nxt - start
+        if name in TEMPLATES and (self.flat or name not in MEMORY_OPS):
+            rd, rs1, rs2, imm = operands
+            if rd == 0:
+                return []  # x0 is hardwired, the handlers skip these too
+            return [TEMPLATES[name].format(d=rd, s1=rs1, s2=rs2, imm=imm)]
+        if name in STORES and self.flat:
+            rd, rs1, rs2, imm = operands
+            store, size = STORES[name]
+            return [f'a = r[{rs1}] + {imm}\n'
+                    f'{store.format(s2=rs2)}\n'
+                    f'if a < core.code_end:\n'
+                    f'    core.invalidate_code(a, {size})\n'
+                    f'    {exit_to(nxt, done, loop)}']
+        if name in CONDITIONS:
+            rs1, rs2, imm = operands
+            target = pc + imm // 4
+            if loop and target == start:
+                # one more round only while it fits in the budget
+                taken = (f'n += {done}\n'
+                         f'if n + {length} > budget:\n'
+                         f'    return {start}, n\n'
+                         f'continue')
+            else:
+                taken = exit_to(target, done, loop)
+            if name == 'exec_beq' and rs1 == rs2:
+                return [taken]
+            return [f'if {CONDITIONS[name].format(s1=rs1, s2=rs2)}:\n' +
+                    '\n'.join('    ' + line for line in taken.split('\n'))]
+
+        # everything else goes through the handler itself
+        ref = f'h{len(names)}'
+        names[ref] = handler
+        lines = []
+        if name in PC_READERS:
+            lines.append(f'core.pc = {nxt}')
+        lines.append(f'{ref}(core, *{operands!r})')
+        if name in PC_READERS:
+            lines.append(exit_to('core.pc', done, loop))
+        else:
+            # vector stores reach invalidate_code through write_memory
+            lines.append(f'if core.translator.stale:\n'
+                         f'    core.translator.stale = False\n'
+                         f'    {exit_to(nxt, done, loop)}')
+        return lines
+
+    def invalidate(self, address, end):
+        """throw away every block that has an instruction in [address, end)"""
+        for slot in range(address, end):
+            for block in self.owners.pop(slot, ()):
+                if block.valid:
+                    block.valid = False
+                    self.stale = True
+                    if self.blocks.get(block.start) is block:
+                        del self.blocks[block.start]
+
+
+def exit_to(target, done, loop):
+    """the return of an exit to target after done instructions of this pass"""
+    return f'return {target}, n + {done}' if loop else f'return {target}, {done}'